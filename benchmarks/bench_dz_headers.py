@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Microbenchmark of decoding the chunk headers of a DZ file, on a synthetic
+# DZ with thousands of chunks.  Times DZStruct.unpackrecord() against what
+# each chunk header cost before it (a fresh Struct, unpackdict() and the
+# collapsing loop), and opening the whole file with UNDZFile, which walks
+# every chunk header.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, gc, hashlib, os, sys, tempfile, time, uuid, zlib
+from struct import Struct
+
+KDZTOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'kdztools')
+sys.path.insert(0, KDZTOOLS)
+sys.path.insert(0, os.path.join(KDZTOOLS, 'libexec'))
+
+import dz
+import undz
+
+BLOCK = 512
+GPT_HEADER = Struct('<8sIIIIQQQQ16sQIII')
+GPT_ENTRY = Struct('<16s16sQQQ72s')
+
+
+def gpt(blocks):
+    """Protective MBR, GPT header and entries of a disk with one 'system' slice"""
+    entries = GPT_ENTRY.pack(uuid.uuid4().bytes, uuid.uuid4().bytes, 34, blocks - 35, 0, 'system'.encode('utf-16-le')).ljust(128 * 128, b'\0')
+    fields = [b'EFI PART', 0x10000, 92, 0, 0, 1, blocks - 1, 34, blocks - 34, uuid.uuid4().bytes, 2, 128, 128, zlib.crc32(entries)]
+    fields[3] = zlib.crc32(GPT_HEADER.pack(*fields))
+    return bytes(BLOCK) + GPT_HEADER.pack(*fields).ljust(BLOCK, b'\0') + entries
+
+
+def makeDZ(path, count, chunkBlocks=8):
+    """Write a DZ of the GPTs and count small chunks of 'system' between them"""
+    blocks = 34 + count * chunkBlocks + 34
+    chunks = [(b'PrimaryGPT', b'PrimaryGPT_0.bin', 0, gpt(blocks))]
+    data = bytes(chunkBlocks * BLOCK)
+    for i in range(count):
+        addr = 34 + i * chunkBlocks
+        chunks.append((b'system', b'system_%d.bin' % addr, addr, data))
+    # The last slice is named after the last chunk, as on real DZ files
+    chunks.append((b'BackupGPT', b'BackupGPT_%d.bin' % (blocks - 34), blocks - 34, bytes(34 * BLOCK)))
+
+    header = dz.DZChunk()
+    md5 = hashlib.md5()
+    body = []
+    for sliceName, chunkName, addr, data in chunks:
+        compressed = zlib.compress(data, 1)
+        raw = header.packdict({'sliceName': sliceName, 'chunkName': chunkName, 'targetSize': len(data), 'dataSize': len(compressed),
+                               'md5': hashlib.md5(data).digest(), 'targetAddr': addr, 'trimCount': len(data) // BLOCK, 'dev': 0,
+                               'crc32': zlib.crc32(data)})
+        md5.update(raw)
+        body += [raw, compressed]
+
+    fileHeader = dz.DZFile().packdict({'formatMajor': 2, 'formatMinor': 1, 'device': b'BENCH', 'version': b'BENCH10a', 'unknown9': b'',
+                                       'chunkCount': len(chunks), 'md5': md5.digest(), 'unknown0': 256, 'unknown1': b'', 'unknown3': b'',
+                                       'reserved5': 0, 'unknown4': 0, 'unknown5': 0, 'unknown6': b'', 'unknown7': b'', 'unknown8': b''})
+    with open(path, 'wb') as f:
+        f.write(fileHeader + b''.join(body))
+    return body[::2]
+
+
+def oldDecode(raw):
+    """What a chunk object and loadHeader() cost per header before unpackrecord()"""
+    header = dz.DZChunk()
+    # DZStruct.__init__() compiled the format again for every instance
+    struct = Struct('<' + ''.join(f for f, _ in header._dz_format_dict.values()))
+    d = dict(zip(header._dz_format_dict.keys(), struct.unpack(raw)))
+    d['buffer'] = raw
+    for key in header._dz_collapsibles:
+        if type(d[key]) is bytes:
+            d[key] = d[key].rstrip(b'\x00')
+        elif d[key] != 0:
+            raise ValueError(key)
+    return d
+
+
+def best(runs, func):
+    # Like timeit, keep the collector from landing in one method only
+    times = []
+    gc.disable()
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time decoding the chunk headers of a synthetic DZ')
+    parser.add_argument('-n', '--chunks', type=int, default=5000, help='number of chunks (default: 5000)')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='runs of each method, the best counts (default: 5)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dz')
+        headers = makeDZ(path, args.chunks)
+        table = b''.join(headers)
+        length = dz.DZChunk._dz_length
+
+        results = [
+            ('unpackdict + collapse', best(args.runs, lambda: [oldDecode(h) for h in headers])),
+            ('unpackrecord', best(args.runs, lambda: [dz.DZChunk().unpackrecord(table, i) for i in range(0, len(table), length)])),
+        ]
+
+        def openDZ():
+            with undz.UNDZFile(path, batchMode=True):
+                pass
+        results.append(('UNDZFile open', best(args.runs, openDZ)))
+
+        for name, seconds in results:
+            print(f'{name:22} {seconds * 1000:9.2f} ms  {seconds / len(headers) * 1e6:7.2f} us/chunk')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Benchmark of copying the members out of a KDZ file, on a synthetic KDZ.
+# Times KDZMember.extract_to() (copy_file_range/sendfile/one big buffer)
+# against the 1 KiB read/write loop unkdz.py used to copy members with.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, os, struct, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'kdztools', 'libexec'))
+
+import kdz
+
+# v2 KDZ: 8 byte magic, 272 byte member records, then the data
+KDZ_MAGIC = b'\x28\x05\x00\x00\x24\x38\x22\x25'
+RECORD = struct.Struct('<256sQQ')
+DATA_START = 1320
+
+
+def makeKDZ(path, size):
+    """Write a KDZ with one size bytes .dz member of random data"""
+    with open(path, 'wb') as f:
+        f.write(KDZ_MAGIC + RECORD.pack(b'bench.dz', size, DATA_START) + b'\0')
+        f.seek(DATA_START)
+        block = os.urandom(1 << 20)
+        while size > 0:
+            size -= f.write(block[:size])
+
+
+def oldCopy(member, path):
+    """The copy loop unkdz.py had before extract_to()"""
+    with open(member.kdz.path, 'rb') as infile, open(path, 'wb') as outfile:
+        infile.seek(member.offset)
+        end = member.offset + member.length
+        while infile.tell() < end:
+            outfile.write(infile.read(min(1024, end - infile.tell())))
+
+
+def best(runs, func, *args):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time copying a member out of a synthetic KDZ')
+    parser.add_argument('-s', '--size', type=int, default=256, help='size of the member in MiB (default: 256)')
+    parser.add_argument('-r', '--runs', type=int, default=3, help='runs of each method, the best counts (default: 3)')
+    parser.add_argument('-d', '--dir', help='where to write the test files (default: a temporary directory)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, 'bench.kdz')
+        makeKDZ(path, args.size << 20)
+        with kdz.KDZ(path) as kdzfile:
+            member = kdzfile.members[0]
+            out = os.path.join(tmp, 'bench.dz')
+            for name, func in (('extract_to', member.extract_to), ('1 KiB loop', lambda p: oldCopy(member, p))):
+                seconds = best(args.runs, func, out)
+                print(f'{name:12} {seconds:8.3f} s  {args.size / seconds:10.1f} MiB/s')
@@ -26,26 +26,80 @@
 
 shopt -s extglob
 
-superimage() {
-    if [ -f super.img ]; then
-        echo "Creating super.img.raw ..."
-        $simg2img super.img super.img.raw 2>/dev/null
+# romlist: Print the names of the members of '${romzip}', one per line; the
+# archive is only listed once per run, by 'detect' if it had to look inside
+# it, every check reuses the saved copy
+romlistkey() {
+    echo "${romzip}:$(stat -c '%s:%Y' "${romzip}" 2>/dev/null)"
+}
+
+romlist() {
+    # Kept on disk, checks run it in pipelines (subshells)
+    if [[ "$(cat "${tmpdir}/romlist.key" 2>/dev/null)" != "$(romlistkey)" ]]; then
+        mkdir -p "${tmpdir}"
+        python3 "${detect}" --list "${romzip}" > "${tmpdir}/romlist.txt" 2>/dev/null
+        romlistkey > "${tmpdir}/romlist.key"
     fi
+    cat "${tmpdir}/romlist.txt"
+}
+
+superimage() {
+    local found image=super.img.raw
+
+    # A sparse 'super.img' is read as it is, it never gets unsparsed to disk
     if [[ ! -s super.img.raw ]] && [ -f super.img ]; then
-        mv super.img super.img.raw
+        image=super.img
     fi
+
+    # Read the LP metadata once and extract every partition in it at once,
+    # '<partition>_a' is preferred and written as '<partition>.img'
+    found=$(python3 "$lpunpack" --suffix _a --partition "${PARTITIONS// /,}" "${image}" . 2>/dev/null)
+
     for partition in $PARTITIONS; do
-        ($lpunpack --partition="$partition"_a super.img.raw || $lpunpack --partition="$partition" super.img.raw) 2>/dev/null
-        if [ -f "$partition"_a.img ]; then
-            mv "$partition"_a.img "$partition".img
+        if [[ $'\n'"$found"$'\n' == *$'\n'"$partition"$'\n'* ]]; then
+            continue
         elif [ -f "$romzip" ]; then
-            foundpartitions=$(7z l -ba "${romzip}" | rev | gawk '{ print $1 }' | rev | grep "$partition".img)
+            foundpartitions=$(romlist | grep "$partition".img)
             7z e -y "${romzip}" "$foundpartitions" dummypartition 2>/dev/null >> "$tmpdir"/zip.log
         fi
     done
     rm -rf super.img*
 }
 
+# finalize: Turn '<partition>.img' into its final image in '${outdir}':
+# unsparse it, strip any MOTO/ASUS header and drop it if it ended up empty.
+# Runs in the background, so the time of each stage goes to a file
+finalize() {
+    local partition="$1" t0 t1 t2 t3 header offset
+    t0=$EPOCHREALTIME
+
+    if [ -f "$partition".img ]; then
+        $simg2img "$partition".img "${outdir}"/"$partition".img 2>/dev/null
+    fi
+    if [[ ! -s "${outdir}"/$partition.img ]] && [ -f "$partition".img ]; then
+        mv "$partition".img "${outdir}"/"$partition".img
+    fi
+
+    t1=$EPOCHREALTIME
+
+    if [[ $EXT4PARTITIONS =~ (^|[[:space:]])"$partition"($|[[:space:]]) ]] && [ -f "${outdir}"/"$partition".img ]; then
+        read -r header offset < <(python3 "${striphdr}" "${outdir}"/"$partition".img)
+        if [[ -n "$header" ]]; then
+            echo "$header header detected on $partition in $offset"
+        fi
+    fi
+
+    t2=$EPOCHREALTIME
+
+    if [ ! -s "${outdir}"/"$partition".img ] && [ -f "${outdir}"/"$partition".img ]; then
+        rm "${outdir}"/"$partition".img
+    fi
+
+    t3=$EPOCHREALTIME
+
+    echo "$partition $t0 $t1 $t2 $t3" >> "${tmpdir}/timing"
+}
+
 # payload: Extract 'payload.bin'
 payload() {
     echo "[INFO] A/B package detected"
@@ -60,18 +114,9 @@ payload() {
 unisoc() {
     echo "[INFO] Unisoc package detected"
 
-    # Extract '.pac' to our directory, and sanitize image(s)
-    if echo "${romzip}" | grep -q ".pac$"; then
-        cp "${romzip}" "${tmpdir}"
-        find "${tmpdir}" -name "* *" -type d,f | rename 's/ /_/g' > /dev/null 2>&1
-    else
-        7z x -y "${romzip}" 2>/dev/null >> "$tmpdir"/zip.log
-        find "${tmpdir}" -name "* *" -type d,f | rename 's/ /_/g' > /dev/null 2>&1
-    fi
-
-    # Extract (all) found '.pac' package(s) 
-    PAC=$(find "$tmpdir"/ -type f -name "*.pac" -printf '%P\n' | sort)
-    for f in ${PAC}; do python3 "${pacextractor}" "${f}" "${PWD}" > /dev/null; done
+    # Extract (all) found '.pac' package(s), reading them straight from
+    # '${romzip}' instead of copying or unpacking the archive first
+    python3 "${pacextractor}" -u "${romzip}" "${PWD}" > /dev/null
 
     if [ -f super.img ]; then
         echo "[INFO] Extracting 'super.img'..."
@@ -110,14 +155,17 @@ for tool_url in "${EXTERNAL_TOOLS[@]}"; do
 done
 
 simg2img="$toolsdir/simg2img"
+simg="$toolsdir/simg.py"
 packsparseimg="$toolsdir/packsparseimg"
 unsin="$toolsdir/unsin"
 otadump="$toolsdir/otadump"
 sdat2img="$toolsdir/sdat2img.py"
 ozipdecrypt="$toolsdir/oppo_ozip_decrypt/ozipdecrypt.py"
-lpunpack="$toolsdir/lpunpack"
+lpunpack="$toolsdir/lpunpack.py"
 update_extractor="$toolsdir/update-extractor.py"
 pacextractor="$toolsdir/pacExtractor.py"
+detect="$toolsdir/detect.py"
+striphdr="$toolsdir/striphdr.py"
 nb0_extract="$toolsdir/nb0-extract"
 kdz_extract="$toolsdir/kdztools/unkdz.py"
 dz_extract="$toolsdir/kdztools/undz.py"
@@ -128,7 +176,6 @@ afptool_extract="$toolsdir/afptool"
 rk_extract="$toolsdir/rkImageMaker"
 
 romzip="$(realpath "$1")"
-romzipext="${romzip}##*.}"
 filename="$(basename "${romzip}%%.*}")"
 PARTITIONS="super system vendor cust odm oem factory product xrom modem dtbo dtb boot recovery tz systemex oppo_product preload_common system_ext system_other opproduct reserve india my_preload my_odm my_stock my_operator my_country my_product my_company my_engineering my_heytap my_custom my_manifest my_carrier my_region my_bigball my_version special_preload vendor_dlkm odm_dlkm system_dlkm init_boot vendor_kernel_boot vendor_boot mi_ext boot-debug vendor_boot-debug hw_product product_h preas preavs tvconfig tvservice linux_rootfs_a factory_a 3rd_a 3rd_rw boot_gki boot_xts my_reserve boot_oplus"
 EXT4PARTITIONS="system vendor cust odm oem factory product xrom systemex oppo_product preload_common hw_product product_h preas preavs"
@@ -150,21 +197,27 @@ mkdir -p "${tmpdir}" "${outdir}"
 # Change directory to working folder
 cd "${tmpdir}" || exit
 
+# Work out the format once: sets FORMAT (and MATCHES), PRE, MEMBERS,
+# EXTRAS, HAS_DTBO and HAS_RADIO, see 'tools/detect.py'
+# The archive listing it made is kept for 'romlist'
+rm -f "${tmpdir}/romlist.txt" "${tmpdir}/romlist.key"
+eval "$(python3 "${detect}" --other "${OTHERPARTITIONS}" --listing "${tmpdir}/romlist.txt" "${romzip}")"
+[ -f "${tmpdir}/romlist.txt" ] && romlistkey > "${tmpdir}/romlist.key"
+echo "[INFO] Detected format: ${FORMAT:-unknown}"
+
 # Simple images support
-if echo "${romzip}" | grep -q super.img; then
+if [[ "${PRE}" == "superimg" ]]; then
     echo "[INFO] Copying 'super.img' to working directory..."
     cp "${romzip}" "${tmpdir}"
     superimage
-elif echo "${romzip}" | grep -q payload.bin; then
+elif [[ "${PRE}" == "payload" ]]; then
     payload
-elif echo "${romzip}" | grep -q ".pac$"; then
+elif [[ "${PRE}" == "pac" ]]; then
     unisoc
 fi
 
-MAGIC=$(head -c12 "${romzip}" | tr -d '\0')
-
 # File is '.ozip'
-if [[ "${MAGIC}" == "OPPOENCRYPT!" ]] || [[ "${romzipext}" == "ozip" ]]; then
+if [[ "${FORMAT}" == "ozip" ]]; then
     # Function to archive directories to a fake image.
     directory_archive() {
         # We probably have 'vendor/' extracted to a directory.
@@ -210,11 +263,11 @@ if [[ "${MAGIC}" == "OPPOENCRYPT!" ]] || [[ "${romzipext}" == "ozip" ]]; then
     exit
 fi
 
-if echo "${romzip}" | grep -q kdz; then
+if [[ "${FORMAT}" == "kdz" ]]; then
     echo "KDZ detected"
-    python3 "$kdz_extract" -f "${romzip}" -x -o "./"
-    dzfile=$(ls *.dz)
-    python3 "$dz_extract" -f "$dzfile" -s -o "./"
+    # The DZ is read in place from the KDZ, no need to 'unkdz' it first,
+    # and only the slices we keep get decompressed
+    python3 "$dz_extract" -f "${romzip}" -s --sparse -o "./" "${PARTITIONS// /,}"
     # Some known dz-partitions "gpt_main persist misc metadata vendor system system_other product userdata gpt_backup tz boot dtbo vbmeta cust oem odm factory modem NON-HLOS"
     find . -maxdepth 4 -type f -name "*.image" | rename 's/.image/.img/g' > /dev/null 2>&1
     find . -maxdepth 4 -type f -name "*_a.img" | rename 's/_a.img/.img/g' > /dev/null 2>&1
@@ -228,7 +281,7 @@ if echo "${romzip}" | grep -q kdz; then
     exit 0
 fi
 
-if echo "${romzip}" | grep -i ruu_ | grep -qi exe; then
+if [[ "${FORMAT}" == "ruu" ]]; then
     echo "RUU detected"
     cp "${romzip}" "$tmpdir"
     romzip="$tmpdir/$(basename "${romzip}")"
@@ -242,7 +295,7 @@ if echo "${romzip}" | grep -i ruu_ | grep -qi exe; then
     exit 0
 fi
 
-if [[ "${romzip}" == *.@(img|bin) ]] && [ "$(head -c6 "${romzip}" | tr '\0' '\n')" == "RKFWf" ]; then
+if [[ "${FORMAT}" == "rockchip" ]]; then
     echo "[INFO] Detected rockchip archive"
 
     # Start the extraction of partition
@@ -280,7 +333,7 @@ if [[ "${romzip}" == *.@(img|bin) ]] && [ "$(head -c6 "${romzip}" | tr '\0' '\n'
     exit 0
 fi
 
-if 7z l -ba "${romzip}" 2>/dev/null | grep -q aml*.img; then
+if [[ "${FORMAT}" == "amlogic" ]]; then
     echo "[INFO] Amlogic package detected"
     cp "${romzip}" "${tmpdir}"
 
@@ -328,30 +381,23 @@ if 7z l -ba "${romzip}" 2>/dev/null | grep -q aml*.img; then
     exit 0
 fi
 
-# Extract firmware partitions
-for partition in ${OTHERPARTITIONS}; do
+# Extract firmware partitions (only of QFIL packages, found by 'detect')
+for partition in ${EXTRAS}; do
     # Set the names for the partition(s)
     IN=$(echo "$partition" | cut -f 1 -d ":")
     OUT=$(echo "$partition" | cut -f 2 -d ":")
 
-    # Check if partition is present on archive
-    if 7z l -ba "${romzip}" 2>/dev/null | grep -q "$IN" > /dev/null && 7z l -na "${romzip}" 2>/dev/null | grep -q "rawprogram"; then
-        echo "[INFO] Extracting ${IN}..."
+    echo "[INFO] Extracting ${IN}..."
 
-        # Extract to '${outdir}'
-        7z x "${romzip}" "${IN}" -so > "${outdir}"/"${IN}".sparse
-
-        # Convert from sparse to RAW image
-        $simg2img "${outdir}/${IN}".sparse "${outdir}/${OUT}".img   
-        rm -rf "${outdir}/${IN}".sparse
-    fi
+    # Extract to '${outdir}', converting sparse images to RAW on the way
+    7z x "${romzip}" "${IN}" -so | python3 "${simg}" -c - "${outdir}/${OUT}".img
 done
 
-if 7z l -ba "${romzip}" 2>/dev/null | grep -q firmware-update/dtbo.img; then
+if [[ -n "${HAS_DTBO}" ]]; then
     7z e -y "${romzip}" firmware-update/dtbo.img 2>/dev/null >> "$tmpdir"/zip.log
 fi
 
-if 7z l -ba "${romzip}" 2>/dev/null | grep -q system.new.dat; then
+if [[ "${FORMAT}" == "ota" ]]; then
     echo "Aonly OTA detected"
     for partition in $PARTITIONS; do
         7z e -y "${romzip}" "$partition".new.dat* "$partition".transfer.list "$partition".img 2>/dev/null >> "$tmpdir"/zip.log
@@ -382,7 +428,7 @@ if 7z l -ba "${romzip}" 2>/dev/null | grep -q system.new.dat; then
             rm -rf "$line".transfer.list "$line".new.dat
         done
     done
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q rawprogram; then
+elif [[ "${FORMAT}" == "qfil" ]]; then
     echo "[INFO] QFIL package detected"
 
     # Start extraction on '${PWD}/out/tmp'
@@ -417,9 +463,9 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q rawprogram; then
     if [[ -f super.img ]]; then
         superimage
     fi
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q nb0; then
+elif [[ "${FORMAT}" == "nb0" ]]; then
     echo "nb0 detected"
-    to_extract=$(7z l "${romzip}" | grep ".*.nb0" | gawk '{ print $6 }')
+    to_extract="${MEMBERS}"
     echo "$to_extract"
     7z e -y "${romzip}" "$to_extract" 2>/dev/null >> "$tmpdir"/zip.log
     $nb0_extract "$to_extract" "$tmpdir"
@@ -428,39 +474,39 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q nb0; then
         mv "$part" "$partition".img
     done
     romzip=""
-elif 7z l -ba "${romzip}" 2>/dev/null | grep system | grep chunk | grep -qv ".*\.so$"; then
+elif [[ "${FORMAT}" == "chunk" ]]; then
     echo "chunk detected"
     for partition in $PARTITIONS; do
-        foundpartitions=$(7z l -ba "${romzip}" | gawk '{ print $NF }' | grep "$partition".img)
-        7z e -y "${romzip}" *"$partition"*chunk* */*"$partition"*chunk* "$foundpartitions" dummypartition 2>/dev/null >> "$tmpdir"/zip.log
-        rm -f *"$partition"_b*
-        rm -f *"$partition"_other*
-        romchunk=$(ls | grep chunk | grep "$partition" | sort)
-        if echo "$romchunk" | grep -q "sparsechunk"; then
-            $simg2img "$(echo "$romchunk" | tr '\n' ' ')" "$partition".img.raw 2>/dev/null
-            rm -rf *"$partition"*chunk*
-            if [[ -f $partition.img ]]; then
-                rm -rf "$partition".img.raw
-            else
-                mv "$partition".img.raw "$partition".img
-            fi
+        foundpartitions=$(romlist | grep "$partition".img | grep -v chunk)
+        romchunk=$(romlist | grep -E "(^|/)${partition}(\.img)?_sparsechunk\.[0-9]+$" | sort -V)
+        if [[ -n "$foundpartitions" ]]; then
+            7z e -y "${romzip}" "$foundpartitions" dummypartition 2>/dev/null >> "$tmpdir"/zip.log
+        fi
+
+        # Sparsechunks are merged straight out of the archive, in one pass
+        # and without unpacking them first, unless the image is there whole
+        if [[ -n "$romchunk" ]] && [[ ! -f "$partition".img ]]; then
+            python3 "${simg}" -a "${romzip}" $romchunk "$partition".img 2>/dev/null
         fi
     done
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "super.img"; then
+elif [[ "${FORMAT}" == "super" ]]; then
     echo "[INFO] 'super.img' detected"
 
-    # Extract detected image(s)    
-    FOUND=$(7z l -ba "${romzip}" | gawk '{ print $NF }' | grep "super.img" | tr '\n' ' ')
-    7z x -y "${romzip}" ${FOUND} >> "$tmpdir"/zip.log
+    # Extract detected image(s)
+    FOUND=$(echo "${MEMBERS}" | grep -v "sparsechunk" | tr '\n' ' ')
+    if [[ -n "${FOUND// }" ]]; then
+        7z x -y "${romzip}" ${FOUND} >> "$tmpdir"/zip.log
+    fi
 
-    # If image is a 'super.img_sparsechunk', convert via 'simg2img'
-    if echo "${FOUND}" | grep -q "sparsechunk"; then
-        ${simg2img} ${FOUND} "${PWD}/super.img.raw" 2>/dev/null
+    # 'super.img_sparsechunk's are merged into one RAW image straight out of the archive
+    CHUNKS=$(echo "${MEMBERS}" | grep "sparsechunk" | sort -V | tr '\n' ' ')
+    if [[ -n "${CHUNKS// }" ]]; then
+        python3 "${simg}" -a "${romzip}" ${CHUNKS} "${PWD}/super.img.raw" 2>/dev/null
     fi
 
     # Run 'superimage' function over the 'super.img'
     superimage
-elif 7z l -ba "${romzip}" 2>/dev/null | gawk '{print $NF}' | grep "system_new.img\|^system.img\|\/system.img\|\/system_image.emmc.img\|^system_image.emmc.img"; then
+elif [[ "${FORMAT}" == "image" ]]; then
     echo "Image detected"
     7z x -y "${romzip}" 2>/dev/null >> "$tmpdir"/zip.log
     find "$tmpdir"/ -name "* *" -type d,f | rename 's/ /_/g' > /dev/null 2>&1 # removes space from file name
@@ -473,16 +519,16 @@ elif 7z l -ba "${romzip}" 2>/dev/null | gawk '{print $NF}' | grep "system_new.im
     find "$tmpdir" -maxdepth 1 -type f -name "*_new.img" | rename 's/_new.img/.img/g' > /dev/null 2>&1 # proper .img names
     find "$tmpdir" -maxdepth 1 -type f -name "*.img.ext4" | rename 's/.img.ext4/.img/g' > /dev/null 2>&1 # proper .img names
     romzip=""
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "system.sin\|.*system_.*\.sin"; then
+elif [[ "${FORMAT}" == "sin" ]]; then
     echo "sin detected"
-    to_remove=$(7z l "${romzip}" | grep ".*boot_.*\.sin" | gawk '{ print $6 }' | sed -e 's/boot_\(.*\).sin/\1/')
+    to_remove=$(romlist | grep ".*boot_.*\.sin" | sed -e 's/boot_\(.*\).sin/\1/')
     if [ -z "$to_remove" ]
     then
-      to_remove=$(7z l "${romzip}" | grep ".*cache_.*\.sin" | gawk '{ print $6 }' | sed -e 's/cache_\(.*\).sin/\1/')
+      to_remove=$(romlist | grep ".*cache_.*\.sin" | sed -e 's/cache_\(.*\).sin/\1/')
     fi
     if [ -z "$to_remove" ]
     then
-      to_remove=$(7z l "${romzip}" | grep ".*vendor_.*\.sin" | gawk '{ print $6 }' | sed -e 's/vendor_\(.*\).sin/\1/')
+      to_remove=$(romlist | grep ".*vendor_.*\.sin" | sed -e 's/vendor_\(.*\).sin/\1/')
     fi
     # Extract image(s) from archive
     7z x -y "${romzip}" 2>/dev/null >> "$tmpdir"/zip.log
@@ -498,24 +544,24 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "system.sin\|.*system_.*\.sin";
         echo "super image inside a sin detected"
         superimage
     fi
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q ".pac$"; then
+elif [[ "${FORMAT}" == "pac" ]]; then
     unisoc
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "*system.bin*"; then
+elif [[ "${FORMAT}" == "bin" ]]; then
     echo "bin images detected"
     7z x -y "${romzip}" 2>/dev/null >> "$tmpdir"/zip.log
     find "$tmpdir"/ -mindepth 2 -type f -name "*.bin" -exec mv {} . \; # move .img in sub-dir to $tmpdir
     find "$tmpdir" -maxdepth 1 -type f -name "*.bin" | rename 's/.bin/.img/g' > /dev/null 2>&1 # proper names
     romzip=""
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "system-p"; then
+elif [[ "${FORMAT}" == "psuffix" ]]; then
     echo "P suffix images detected"
     for partition in $PARTITIONS; do
-        foundpartitions=$(7z l -ba "${romzip}" | gawk '{ print $NF }' | grep "$partition"-p)
+        foundpartitions=$(romlist | grep "$partition"-p)
         7z e -y "${romzip}" "$foundpartitions" dummypartition 2>/dev/null >> "$tmpdir"/zip.log
         if [ -n "$foundpartitions" ]; then
             mv "$(ls "$partition"-p*)" "$partition.img"
         fi
     done
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q system-sign.img; then
+elif [[ "${FORMAT}" == "sign" ]]; then
     echo "[INFO] 'sign' images detected"
 
     # Extract images to '${tmpdir}'
@@ -576,7 +622,7 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q system-sign.img; then
         # Clean-up
         rm -rf "${tmpdir}/${f}.tmp"
     done
-elif 7z l -ba "${romzip}" 2>/dev/null | grep tar.md5 | gawk '{ print $NF }' | grep AP_; then
+elif [[ "${FORMAT}" == "tarmd5" ]]; then
     echo "AP tarmd5 detected"
     echo "Extracting tarmd5"
     7z e -y "${romzip}" 2>/dev/null >> "$tmpdir"/zip.log
@@ -603,18 +649,18 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep tar.md5 | gawk '{ print $NF }' | gr
         exit 1
     fi
     romzip=""
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "*.tar"; then
+elif [[ "${FORMAT}" == "tar" ]]; then
     echo "[INFO] Non-AP tar detected"
 
     # Extract '.tar' content
-    TAR=$(7z l -ba "${romzip}" | grep ./"*.tar" | gawk '{ print $NF }')
+    TAR=$(echo "${MEMBERS}" | head -1)
     7z e -y "${romzip}" "${TAR}" 2>/dev/null >> "${tmpdir}"/zip.log
 
-    "${LOCALDIR}/extractor.sh" "${TAR}" "${outdir}"
+    "${LOCALDIR}/extractor.sh" "$(basename "${TAR}")" "${outdir}"
     exit
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q payload.bin; then
+elif [[ "${FORMAT}" == "payload" ]]; then
     payload
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q ".*.rar\|.*.zip"; then
+elif [[ "${FORMAT}" == "zip" ]]; then
     echo "Image zip firmware detected"
     mkdir -p "$tmpdir"/zipfiles
     7z e -y "${romzip}" -o"$tmpdir"/zipfiles 2>/dev/null >> "$tmpdir"/zip.log
@@ -624,12 +670,12 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q ".*.rar\|.*.zip"; then
        "$LOCALDIR/extractor.sh" "$tmpdir"/zipfiles/"$file" "${outdir}"
     done
     exit
-elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "UPDATE.APP"; then
+elif [[ "${FORMAT}" == "updateapp" ]]; then
     echo "[INFO] Huawei 'UPDATE.APP' detected"
 
     # Gather and extract 'UPDATE.APP' from archive
     7z x "${romzip}" UPDATE.APP >> "$tmpdir"/zip.log
-    python "${update_extractor}" -e UPDATE.APP -o "${PWD}" > /dev/null
+    python3 "${update_extractor}" -e -u UPDATE.APP -o "${PWD}" > /dev/null
 
     # Change partition's name to lowercase
     for f in $(find . -name '*.img'); do
@@ -643,40 +689,31 @@ elif 7z l -ba "${romzip}" 2>/dev/null | grep -q "UPDATE.APP"; then
     fi
 fi
 
-for partition in $PARTITIONS; do
-    if [ -f "$partition".img ]; then
-        $simg2img "$partition".img "${outdir}"/"$partition".img 2>/dev/null
-    fi
-    if [[ ! -s "${outdir}"/$partition.img ]] && [ -f "$partition".img ]; then
-        mv "$partition".img "${outdir}"/"$partition".img
-    fi
+# Partitions are finished in parallel, at most this many at once
+jobs_max="${EXTRACTOR_JOBS:-$(nproc)}"
+finalize_start=$EPOCHREALTIME
+rm -f "${tmpdir}/timing"
 
-    if [[ $EXT4PARTITIONS =~ (^|[[:space:]])"$partition"($|[[:space:]]) ]] && [ -f "${outdir}"/"$partition".img ]; then
-        MAGIC=$(head -c12 "${outdir}"/"$partition".img | tr -d '\0')
-        offset=$(LANG=C grep -aobP -m1 '\x53\xEF' "${outdir}"/"$partition".img | head -1 | gawk '{print $1 - 1080}')
-        if echo "$MAGIC" | grep -q "MOTO"; then
-            if [[ "$offset" == 128055 ]]; then
-                offset=131072
-            fi
-            echo "MOTO header detected on $partition in $offset"
-        elif echo "$MAGIC" | grep -q "ASUS"; then
-            echo "ASUS header detected on $partition in $offset"
-        else
-            offset=0
-        fi
-        if [ ! "$offset" == "0" ]; then
-            dd if="${outdir}"/"$partition".img of="${outdir}"/"$partition".img-2 ibs="$offset" skip=1 2>/dev/null
-            mv "${outdir}"/"$partition".img-2 "${outdir}"/"$partition".img
-        fi
-    fi
+for partition in $PARTITIONS; do
+    [[ -f "$partition".img ]] || [[ -f "${outdir}"/"$partition".img ]] || continue
 
-    if [ ! -s "${outdir}"/"$partition".img ] && [ -f "${outdir}"/"$partition".img ]; then
-        rm "${outdir}"/"$partition".img
-    fi
+    while (( $(jobs -rp | wc -l) >= jobs_max )); do
+        wait -n
+    done
+    finalize "$partition" &
 done
+wait
+
+# Time spent in each stage, summed over all partitions
+if [[ -s "${tmpdir}/timing" ]]; then
+    gawk -v start="$finalize_start" -v end="$EPOCHREALTIME" '
+        { unsparse += $3 - $2; header += $4 - $3; cleanup += $5 - $4; n++ }
+        END { printf "[INFO] Finished %d partition(s) in %.2fs (unsparse %.2fs, header %.2fs, cleanup %.2fs)\n", n, end - start, unsparse, header, cleanup }
+    ' "${tmpdir}/timing"
+fi
 
-# Specifically check if input is 'radio.img'
-if 7z l -ba "${romzip}" 2>/dev/null | grep -q radio.img; then
+# Specifically check if input is 'radio.img' (unless it was let go of above)
+if [[ -n "${romzip}" ]] && [[ -n "${HAS_RADIO}" ]]; then
     ## Extract 'radio.img' from archive'
     echo "[INFO] Extracting 'radio.img'..."
     7z x "${romzip}" radio.img -o"${PWD}" >> "$tmpdir"/zip.log
@@ -690,14 +727,11 @@ if 7z l -ba "${romzip}" 2>/dev/null | grep -q radio.img; then
         find "${PWD}/" -type f ! -name 'NON-HLOS.bin' -and ! -name 'fsg.mbn' -delete
         mv "${PWD}"/fsg.mbn "${outdir}"/fsg.mbn
 
-        ## Move 'NON-HLOS.bin' to 'radio.img.sparse'
-        mv "${PWD}/NON-HLOS.bin" "${PWD}/radio.img.sparse"
-
-        ## Convert from sparse to RAW
-        ${simg2img} "${PWD}/radio.img.sparse" "${outdir}/radio.img" 2>/dev/null
+        ## Convert 'NON-HLOS.bin' from sparse to RAW
+        python3 "${simg}" "${PWD}/NON-HLOS.bin" "${outdir}/radio.img" 2>/dev/null
 
         ## Remove old sparsed image
-        rm -rf "${PWD}"/radio.img.sparse
+        rm -rf "${PWD}"/NON-HLOS.bin
     fi
 fi
 
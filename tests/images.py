@@ -0,0 +1,185 @@
+# Builders of small synthetic images for the tests
+
+import hashlib, os, struct, sys, uuid, zlib
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools')
+sys.path.insert(0, TOOLS)
+sys.path.insert(0, os.path.join(TOOLS, 'kdztools', 'libexec'))
+
+import dz
+import lpunpack as lp
+import pacExtractor
+import simg
+
+
+def sparse(chunks, blockSize=4096, blocks=None, fileHeaderSize=None, chunkHeaderSize=None):
+    """
+    A sparse image of chunks and the raw image it stands for.  Chunks are
+    ('raw', data), ('fill', pattern, blocks), ('skip', blocks) or ('crc',).
+    Parts not covered are zeros in the raw image, which has blocks blocks
+    (as many as the chunks cover by default).
+    """
+    fileHeaderSize = fileHeaderSize or simg.FILE_HEADER.size
+    chunkHeaderSize = chunkHeaderSize or simg.CHUNK_HEADER.size
+    body = []
+    raw = bytearray()
+    for chunk in chunks:
+        kind = chunk[0]
+        if kind == 'raw':
+            data = chunk[1]
+            count = len(data) // blockSize
+            body.append(chunkHeader(simg.CHUNK_RAW, count, len(data), chunkHeaderSize) + data)
+            raw += data
+        elif kind == 'fill':
+            pattern, count = chunk[1], chunk[2]
+            body.append(chunkHeader(simg.CHUNK_FILL, count, 4, chunkHeaderSize) + pattern)
+            raw += pattern * (count * blockSize // 4)
+        elif kind == 'skip':
+            count = chunk[1]
+            body.append(chunkHeader(simg.CHUNK_DONT_CARE, count, 0, chunkHeaderSize))
+            raw += bytes(count * blockSize)
+        elif kind == 'crc':
+            body.append(chunkHeader(simg.CHUNK_CRC32, 0, 4, chunkHeaderSize) + bytes(4))
+    if blocks is None:
+        blocks = len(raw) // blockSize
+    raw += bytes(blocks * blockSize - len(raw))
+    header = simg.FILE_HEADER.pack(simg.SPARSE_MAGIC, 1, 0, fileHeaderSize, chunkHeaderSize, blockSize, blocks, len(body), 0)
+    return header.ljust(fileHeaderSize, b'\0') + b''.join(body), bytes(raw)
+
+
+
+def toSparse(raw, blockSize=4096):
+    """raw as a sparse image: zero blocks are skipped, repeated words filled"""
+    chunks = []
+    for pos in range(0, len(raw), blockSize):
+        block = raw[pos:pos + blockSize]
+        if block == bytes(blockSize):
+            chunk = ('skip', 1)
+        elif block == block[:4] * (blockSize // 4):
+            chunk = ('fill', block[:4], 1)
+        else:
+            chunk = ('raw', block)
+        last = chunks[-1] if chunks else None
+        if last and last[0] == chunk[0] == 'skip':
+            chunks[-1] = ('skip', last[1] + 1)
+        elif last and last[0] == chunk[0] == 'fill' and last[1] == chunk[1]:
+            chunks[-1] = ('fill', last[1], last[2] + 1)
+        elif last and last[0] == chunk[0] == 'raw':
+            chunks[-1] = ('raw', last[1] + block)
+        else:
+            chunks.append(chunk)
+    return sparse(chunks, blockSize)[0]
+
+
+def chunkHeader(kind, blocks, payload, chunkHeaderSize):
+    return simg.CHUNK_HEADER.pack(kind, 0, blocks, chunkHeaderSize + payload).ljust(chunkHeaderSize, b'\0')
+
+
+def superImage(partitions, size, data=(), maxSize=65536, slots=2):
+    """
+    A super image with partitions, a list of (name, extents), extents being
+    (type, offset, length[, block device]) in bytes.  Both geometries and every metadata
+    slot and backup are written; data is (offset, bytes) to put in it.
+    """
+    image = bytearray(size)
+    pos = lp.PARTITION_RESERVED_BYTES
+    for _ in range(2):
+        image[pos:pos + lp.GEOMETRY_SIZE] = geometry(maxSize, slots)
+        pos += lp.GEOMETRY_SIZE
+    blob = metadata(partitions, maxSize)
+    for _ in range(2 * slots):
+        image[pos:pos + maxSize] = blob
+        pos += maxSize
+    for offset, blob in data:
+        image[offset:offset + len(blob)] = blob
+    return image
+
+
+def geometry(maxSize, slots, blockSize=4096):
+    buf = bytearray(lp.GEOMETRY.pack(lp.GEOMETRY_MAGIC, lp.GEOMETRY.size, bytes(32), maxSize, slots, blockSize))
+    buf[8:40] = hashlib.sha256(buf).digest()
+    return bytes(buf).ljust(lp.GEOMETRY_SIZE, b'\0')
+
+
+def metadata(partitions, maxSize):
+    table, extents = b'', b''
+    first = 0
+    for name, parts in partitions:
+        table += lp.PARTITION.pack(name.encode(), lp.ATTR_READONLY, first, len(parts), 0)
+        for kind, offset, length, *source in parts:
+            target = offset // lp.SECTOR_SIZE if kind == lp.TARGET_TYPE_LINEAR else 0
+            extents += lp.EXTENT.pack(length // lp.SECTOR_SIZE, kind, target, source[0] if source else 0)
+        first += len(parts)
+    groups = lp.GROUP.pack(b'default', 0, 0)
+    devices = lp.BLOCK_DEVICE.pack(0, 4096, 0, 0, b'super', 0)
+    tables = table + extents + groups + devices
+    descriptors = [
+        lp.TABLE.pack(0, len(partitions), lp.PARTITION.size),
+        lp.TABLE.pack(len(table), first, lp.EXTENT.size),
+        lp.TABLE.pack(len(table) + len(extents), 1, lp.GROUP.size),
+        lp.TABLE.pack(len(table) + len(extents) + len(groups), 1, lp.BLOCK_DEVICE.size),
+    ]
+    header = bytearray(lp.HEADER.pack(lp.HEADER_MAGIC, 10, 0, lp.HEADER.size, bytes(32), len(tables), hashlib.sha256(tables).digest(), *descriptors))
+    header[12:44] = hashlib.sha256(header).digest()
+    return (bytes(header) + tables).ljust(maxSize, b'\0')
+
+
+def pac(files, version='BP_R1.0.0'):
+    """A Spreadtrum PAC of files, (partition name, file name, data) each"""
+    def utf16(s, size):
+        return s.encode('utf-16le').ljust(size, b'\0')
+    headerSize = struct.calcsize(pacExtractor.PAC_HEADER_FMT)
+    fileSize = struct.calcsize(pacExtractor.FILE_HEADER_FMT)
+    offset = headerSize + fileSize * len(files)
+    headers, body = b'', b''
+    for partition, name, data in files:
+        headers += struct.pack(pacExtractor.FILE_HEADER_FMT, fileSize, utf16(partition, 512), utf16(name, 512), bytes(504), 0, 0,
+                               len(data), 1, 1, offset + len(body) if data else 0, 0, 0, 0, 0, 0, 0, 0, bytes(996))
+        body += data
+    total = headerSize + len(headers) + len(body)
+    header = struct.pack(pacExtractor.PAC_HEADER_FMT, utf16(version, 44), 0, total, utf16('product', 512), utf16('firmware', 512),
+                         len(files), headerSize, 0, 0, 0, 0, 0, utf16('', 200), 0, 0, 0, bytes(800), 0, 0, 0)
+    return header + headers + body
+
+
+GPT_HEADER = struct.Struct('<8sIIIIQQQQ16sQIII')
+GPT_ENTRY = struct.Struct('<16s16sQQQ72s')
+
+
+def gpt(slices, blocks, primary=True, blockSize=512):
+    """
+    The primary (protective MBR, header, entries) or backup (entries,
+    header) GPT of a disk of blocks blocks with slices, (name, first block,
+    end block) each
+    """
+    entries = b''.join(GPT_ENTRY.pack(uuid.uuid4().bytes, uuid.uuid4().bytes, start, end - 1, 0, name.encode('utf-16-le'))
+                       for name, start, end in slices).ljust(128 * 128, b'\0')
+    entryBlocks = len(entries) // blockSize
+    my, alternate, entryStart = (1, blocks - 1, 2) if primary else (blocks - 1, 1, blocks - 1 - entryBlocks)
+    fields = [b'EFI PART', 0x10000, 92, 0, 0, my, alternate, 2 + entryBlocks, blocks - 2 - entryBlocks,
+              uuid.UUID(int=5).bytes, entryStart, 128, 128, zlib.crc32(entries)]
+    fields[3] = zlib.crc32(GPT_HEADER.pack(*fields))
+    header = GPT_HEADER.pack(*fields).ljust(blockSize, b'\0')
+    return bytes(blockSize) + header + entries if primary else entries + header
+
+
+def dzFile(chunks, compress=lambda data: zlib.compress(data, 1)):
+    """
+    A DZ of chunks, (slice name, chunk name, first block, data, blocks
+    trimmed[, device]) each, 512 byte blocks
+    """
+    header = dz.DZChunk()
+    md5 = hashlib.md5()
+    body = []
+    for sliceName, chunkName, addr, data, trim, *dev in chunks:
+        compressed = compress(data)
+        raw = header.packdict({'sliceName': sliceName.encode(), 'chunkName': chunkName.encode(), 'targetSize': len(data),
+                               'dataSize': len(compressed), 'md5': hashlib.md5(data).digest(), 'targetAddr': addr,
+                               'trimCount': trim, 'dev': dev[0] if dev else 0, 'crc32': zlib.crc32(data)})
+        md5.update(raw)
+        body += [raw, compressed]
+    fileHeader = dz.DZFile().packdict({'formatMajor': 2, 'formatMinor': 1, 'device': b'LGTEST', 'version': b'TEST10a',
+                                       'unknown9': b'', 'chunkCount': len(chunks), 'md5': md5.digest(), 'unknown0': 256,
+                                       'unknown1': b'', 'unknown3': b'', 'reserved5': 0, 'unknown4': 0, 'unknown5': 0,
+                                       'unknown6': b'', 'unknown7': b'', 'unknown8': b''})
+    return fileHeader + b''.join(body)
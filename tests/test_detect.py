@@ -0,0 +1,135 @@
+import os, shutil, subprocess, sys, tempfile, unittest, zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+import detect
+
+QFIL = ['rawprogram0.xml', 'patch0.xml', 'NON-HLOS.bin', 'tz.mbn', 'boot-verified.img', 'system.img']
+
+# (name, members, format, members of the format, other matches)
+CASES = [
+    ('ota.zip', ['system.new.dat.br', 'system.transfer.list', 'boot.img'], 'ota', ['system.new.dat.br'], []),
+    ('qfil.zip', QFIL, 'qfil', ['rawprogram0.xml'], ['image']),
+    ('nb0.zip', ['firmware.nb0'], 'nb0', ['firmware.nb0'], []),
+    ('chunk.zip', ['system.img_sparsechunk.0', 'system.img_sparsechunk.1', 'lib/system_chunk.so'], 'chunk',
+     ['system.img_sparsechunk.0', 'system.img_sparsechunk.1'], ['image']),
+    ('super.zip', ['images/super.img', 'boot.img'], 'super', ['images/super.img'], []),
+    ('image.zip', ['image/system.img', 'vendor.img'], 'image', ['image/system.img'], []),
+    ('sin.zip', ['system_X-FLASH-ALL.sin', 'boot_X.sin'], 'sin', ['system_X-FLASH-ALL.sin'], []),
+    ('pac.zip', ['firmware.pac'], 'pac', ['firmware.pac'], []),
+    ('bin.zip', ['system.bin', 'firmware.tar'], 'bin', ['system.bin'], ['tar']),
+    ('psuffix.zip', ['system-p', 'vendor-p'], 'psuffix', ['system-p'], []),
+    ('sign.zip', ['system-sign.img'], 'sign', ['system-sign.img'], []),
+    ('tarmd5.zip', ['AP_G960F.tar.md5', 'BL_G960F.tar.md5', 'CSC.tar'], 'tarmd5', ['AP_G960F.tar.md5'], ['tar']),
+    ('tar.zip', ['firmware.tar', 'other.tar'], 'tar', ['firmware.tar', 'other.tar'], []),
+    ('payload.zip', ['payload.bin', 'payload_properties.txt'], 'payload', ['payload.bin'], []),
+    ('nested.zip', ['inner.zip'], 'zip', ['inner.zip'], []),
+    ('huawei.zip', ['UPDATE.APP'], 'updateapp', ['UPDATE.APP'], []),
+    ('aml.zip', ['aml_upgrade_package.img', 'firmware.tar'], 'amlogic', ['aml_upgrade_package.img'], ['tar']),
+    ('other.zip', ['readme.txt'], '', [], []),
+]
+
+
+def shell(script, *names):
+    """The values of names after 'eval' of script in bash"""
+    printf = ''.join(f'printf "%s\\0" "${name}"; ' for name in names)
+    out = subprocess.run(['bash', '-c', 'eval "$1"; ' + printf, '_', script], stdout=subprocess.PIPE, check=True).stdout
+    return out.decode().split('\0')[:-1]
+
+
+class DetectTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name, data=b''):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_members(self):
+        for name, members, fmt, found, others in CASES:
+            with self.subTest(name):
+                plan = detect.detect(self.path(name), [detect.Member(n, 0) for n in members])
+                self.assertEqual(plan.format, fmt)
+                self.assertEqual(plan.members, found)
+                self.assertEqual(plan.matches, [fmt] + others if fmt else [])
+                self.assertEqual(plan.listed, members)
+
+    def test_qfil_extras(self):
+        plan = detect.detect(self.path('qfil.zip'), [detect.Member(n, 0) for n in QFIL + ['firmware-update/dtbo.img']])
+        self.assertEqual(plan.extras, ['tz.mbn:tz', 'NON-HLOS:modem', 'boot-verified.img:boot'])
+        self.assertTrue(plan.dtbo)
+        self.assertFalse(plan.radio)
+        # Only for QFIL packages
+        self.assertEqual(detect.detect(self.path('image.zip'), [detect.Member('system.img', 0), detect.Member('tz.mbn', 0)]).extras, [])
+
+    def test_name_and_magic(self):
+        # Told without listing anything, ahead of whatever is inside
+        tar = [detect.Member('firmware.tar', 0), detect.Member('system.bin', 0)]
+        cases = [
+            (self.path('firmware.ozip', b'OPPOENCRYPT!' + bytes(4)), ['ozip']),
+            (self.path('firmware.zip', b'OPPOENCRYPT!' + bytes(4)), ['ozip']),
+            (self.path('H87010f_00_0316.kdz'), ['kdz']),
+            (self.path('RUU_PYRAMID.exe'), ['ruu']),
+            (self.path('update.img', b'RKFWf' + bytes(11)), ['rockchip']),
+            (self.path('kdz.ozip'), ['ozip', 'kdz']),
+        ]
+        for path, matches in cases:
+            with self.subTest(os.path.basename(path)):
+                plan = detect.detect(path, tar)
+                self.assertEqual((plan.format, plan.matches, plan.members, plan.listed), (matches[0], matches, [], None))
+
+    def test_pre(self):
+        for name, pre in (('super.img', 'superimg'), ('payload.bin', 'payload'), ('firmware.pac', 'pac'), ('firmware.zip', '')):
+            with self.subTest(name):
+                self.assertEqual(detect.detect(self.path(name), []).pre, pre)
+
+    def test_zip(self):
+        path = os.path.join(self.tmp.name, 'firmware.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('images/', b'')
+            z.writestr('images/system.img', b'system')
+            z.writestr('boot.img', b'boot')
+        plan = detect.detect(path)
+        self.assertEqual((plan.format, plan.members, plan.listed), ('image', ['images/system.img'], ['images/system.img', 'boot.img']))
+
+    @unittest.skipUnless(shutil.which('bash'), 'no bash')
+    def test_shell(self):
+        names = ["it's/system.img", 'system.img; rm -rf ~', '$(reboot)/system.img', '"quoted" `x`/system.img', 'new\nline/system.img']
+        plan = detect.detect(self.path('odd.zip'), [detect.Member(n, 0) for n in names] + [detect.Member('firmware-update/dtbo.img', 0)])
+        self.assertEqual(plan.members, names)
+        script = plan.toShell()
+        self.assertEqual(shell(script, 'FORMAT', 'MATCHES', 'PRE', 'MEMBERS', 'EXTRAS', 'HAS_DTBO', 'HAS_RADIO'),
+                         ['image', 'image', '', '\n'.join(names), '', '1', ''])
+
+    @unittest.skipUnless(shutil.which('bash'), 'no bash')
+    def test_shell_qfil(self):
+        plan = detect.detect(self.path('qfil.zip'), [detect.Member(n, 0) for n in QFIL])
+        self.assertEqual(shell(plan.toShell(), 'FORMAT', 'MATCHES', 'EXTRAS'), ['qfil', 'qfil image', 'tz.mbn:tz NON-HLOS:modem boot-verified.img:boot'])
+
+    def test_listing(self):
+        path = os.path.join(self.tmp.name, 'firmware.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('system.new.dat.br', b'')
+            z.writestr('dir/with space.img', b'')
+        listing = os.path.join(self.tmp.name, 'romlist.txt')
+        script = os.path.join(os.path.dirname(detect.__file__), 'detect.py')
+        out = subprocess.run([sys.executable, script, '--listing', listing, path], stdout=subprocess.PIPE, check=True).stdout
+        self.assertIn(b"FORMAT=ota\n", out)
+        with open(listing) as f:
+            self.assertEqual(f.read(), 'system.new.dat.br\ndir/with space.img\n')
+        # The same as listing it by itself
+        out = subprocess.run([sys.executable, script, '--list', path], stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(out, b'system.new.dat.br\ndir/with space.img\n')
+        # Nothing saved when the name is enough
+        os.remove(listing)
+        subprocess.run([sys.executable, script, '--listing', listing, self.path('firmware.kdz')], stdout=subprocess.PIPE, check=True)
+        self.assertFalse(os.path.exists(listing))
+
+
+if __name__ == '__main__':
+    unittest.main()
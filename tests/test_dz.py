@@ -0,0 +1,65 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'kdztools', 'libexec'))
+
+import dz
+
+CHUNK = {'sliceName': b'system', 'chunkName': b'system_34.bin', 'targetSize': 4096, 'dataSize': 100, 'md5': bytes(range(16)),
+         'targetAddr': 34, 'trimCount': 8, 'dev': 0, 'crc32': 0x12345678}
+
+FILE = {'formatMajor': 2, 'formatMinor': 1, 'device': b'LGTEST', 'version': b'TEST10a', 'unknown9': b'', 'chunkCount': 1,
+        'md5': bytes(16), 'unknown0': 256, 'unknown1': b'', 'unknown3': b'', 'reserved5': 0, 'unknown4': 0, 'unknown5': 0,
+        'unknown6': b'', 'unknown7': b'', 'unknown8': b''}
+
+
+class UnpackRecordTest(unittest.TestCase):
+    def test_round_trip(self):
+        header = dz.DZChunk()
+        raw = header.packdict(CHUNK)
+        record = header.unpackrecord(raw)
+        for key, value in CHUNK.items():
+            self.assertEqual(getattr(record, key), value, key)
+        self.assertEqual(record.pad, b'')
+        self.assertEqual(record.buffer, raw)
+
+    def test_matches_unpackdict(self):
+        header = dz.DZChunk()
+        raw = header.packdict(CHUNK)
+        record = header.unpackrecord(raw)
+        for key, value in header.unpackdict(raw).items():
+            if key in header._dz_collapsibles:
+                value = value.rstrip(b'\0')
+            self.assertEqual(getattr(record, key), value, key)
+
+    def test_offset_into_table(self):
+        header = dz.DZChunk()
+        first = header.packdict(CHUNK)
+        second = header.packdict(dict(CHUNK, chunkName=b'system_42.bin', targetAddr=42))
+        table = memoryview(first + b'payload' + second)
+        record = header.unpackrecord(table, len(first) + len(b'payload'))
+        self.assertEqual((record.chunkName, record.targetAddr), (b'system_42.bin', 42))
+
+    def test_rejects_bad_or_short_headers(self):
+        header = dz.DZChunk()
+        raw = header.packdict(CHUNK)
+        self.assertIsNone(header.unpackrecord(b'\0' * 4 + raw[4:]))
+        self.assertIsNone(header.unpackrecord(raw[:-1]))
+        self.assertIsNone(header.unpackrecord(raw, 1))
+        # A file header is not a chunk header
+        self.assertIsNone(header.unpackrecord(dz.DZFile().packdict(FILE)))
+
+    def test_nonzero_reserved_integer(self):
+        header = dz.DZFile()
+        record = header.unpackrecord(header.packdict(FILE))
+        self.assertEqual((record.device, record.version), (b'LGTEST', b'TEST10a'))
+        with self.assertRaises(ValueError):
+            header.unpackrecord(header.packdict(dict(FILE, reserved1=1)))
+
+    def test_format_compiled_once(self):
+        for kind in (dz.DZChunk, dz.DZFile):
+            self.assertIs(kind()._dz_struct, kind()._dz_struct)
+            self.assertEqual(kind._dz_struct.size, kind._dz_length)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import mmap, os, tempfile, unittest
+from unittest import mock
+
+import images  # noqa: F401, puts libexec on the path
+import kdz
+
+DATA_START = 1320
+
+
+def kdzFile(files):
+    """A KDZ of files, (name, data) each"""
+    record = kdz.KDZFile()
+    headers, body = b'', b''
+    for name, data in files:
+        headers += record.packdict({'name': name.encode(), 'length': len(data), 'offset': DATA_START + len(body)})
+        body += data
+    return (kdz.KDZFile._dz_header + headers + b'\0').ljust(DATA_START, b'\0') + body
+
+
+class KDZTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test.kdz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_members(self):
+        files = [('test.dz', os.urandom(5000)), ('LGUP_c.dll', os.urandom(100))]
+        self.write(kdzFile(files))
+        with kdz.KDZ.open(self.path) as k:
+            self.assertEqual([(m.name, m.length) for m in k.members], [(name.encode(), len(data)) for name, data in files])
+            self.assertFalse(k.hasExtra)
+            out = os.path.join(self.tmp.name, 'test.dz')
+            k.members[0].extract_to(out)
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), files[0][1])
+            with k.members[1].open() as f:
+                self.assertEqual(f.read(), files[1][1])
+
+    def test_errors_close_everything(self):
+        good = kdzFile([('test.dz', bytes(100))])
+        # Every mapping and file KDZ opens, made with the real ones
+        maps, files = [], []
+        newMap, newFile = mmap.mmap, open
+        def track(*args, **kwargs):
+            maps.append(newMap(*args, **kwargs))
+            return maps[-1]
+        def opened(*args, **kwargs):
+            files.append(newFile(*args, **kwargs))
+            return files[-1]
+        for data, message in ((b'not a KDZ file', 'Unsupported'), (good[:200], 'truncated')):
+            with self.subTest(message), mock.patch('kdz.mmap.mmap', track), mock.patch('kdz.io.open', opened):
+                self.write(data)
+                with self.assertRaisesRegex(kdz.KDZError, message):
+                    kdz.KDZ.open(self.path)
+                self.assertTrue(all(m.closed for m in maps))
+                self.assertTrue(files[-1].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
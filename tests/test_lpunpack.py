@@ -0,0 +1,142 @@
+import os, tempfile, unittest
+
+from images import superImage, toSparse, lp, simg
+
+MiB = 1 << 20
+MAX_SIZE = 65536
+
+GEOMETRY = lp.PARTITION_RESERVED_BYTES
+# Metadata of slot 0 and its backup, with two slots
+PRIMARY = lp.METADATA_OFFSET
+BACKUP = lp.METADATA_OFFSET + 2 * MAX_SIZE
+
+
+def corrupt(image, offset):
+    image[offset] ^= 0xFF
+
+
+class Image:
+    """A super image in a bytearray, read like lpunpack's RawImage"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def pread(self, size, offset):
+        return bytes(self.data[offset:offset + size])
+
+
+def layout():
+    system, vendor = os.urandom(MiB), os.urandom(256 << 10)
+    partitions = [
+        ('system_a', [(lp.TARGET_TYPE_LINEAR, MiB, MiB // 2), (lp.TARGET_TYPE_LINEAR, 3 * MiB, MiB // 2)]),
+        ('vendor_a', [(lp.TARGET_TYPE_LINEAR, 2 * MiB, len(vendor)), (lp.TARGET_TYPE_ZERO, 0, 8192)]),
+        ('vendor', []),
+        ('system_b', []),
+    ]
+    data = [(MiB, system[:MiB // 2]), (3 * MiB, system[MiB // 2:]), (2 * MiB, vendor)]
+    return superImage(partitions, 4 * MiB, data, MAX_SIZE), {'system': system, 'vendor': vendor + bytes(8192)}
+
+
+class LpMetadataTest(unittest.TestCase):
+    def test_parse(self):
+        image, _ = layout()
+        metadata = lp.LpMetadata.fromImage(Image(image))
+        self.assertEqual((metadata.metadataMaxSize, metadata.slotCount, metadata.blockSize), (MAX_SIZE, 2, 4096))
+        self.assertEqual([p.name for p in metadata.partitions], ['system_a', 'vendor_a', 'vendor', 'system_b'])
+        self.assertEqual(metadata.byName['system_a'].size, MiB)
+        self.assertEqual(metadata.byName['vendor_a'].group, 'default')
+        self.assertEqual(metadata.blockDevices, ['super'])
+
+    def test_resolve(self):
+        metadata = lp.LpMetadata.fromImage(Image(layout()[0]))
+        self.assertEqual(metadata.resolve('system', '_a').name, 'system_a')
+        # Empty, but the only one there is
+        self.assertEqual(metadata.resolve('system', '_b').name, 'system_b')
+        # A partition with data beats an empty one
+        self.assertEqual(metadata.resolve('vendor', '_a').name, 'vendor_a')
+        self.assertEqual(metadata.resolve('vendor').name, 'vendor')
+        self.assertIsNone(metadata.resolve('odm', '_a'))
+
+    def test_backup_geometry(self):
+        image, _ = layout()
+        corrupt(image, GEOMETRY + 8)
+        self.assertEqual(len(lp.LpMetadata.fromImage(Image(image)).partitions), 4)
+
+    def test_backup_metadata(self):
+        # In the header, then in the tables
+        for offset in (PRIMARY + 20, PRIMARY + lp.HEADER.size + 1):
+            with self.subTest(offset=offset):
+                image, _ = layout()
+                corrupt(image, offset)
+                self.assertEqual(len(lp.LpMetadata.fromImage(Image(image)).partitions), 4)
+
+    def test_all_copies_corrupt(self):
+        image, _ = layout()
+        corrupt(image, PRIMARY + 20)
+        corrupt(image, BACKUP + 20)
+        with self.assertRaisesRegex(lp.LpError, 'corrupt'):
+            lp.LpMetadata.fromImage(Image(image))
+
+        image, _ = layout()
+        corrupt(image, GEOMETRY + 8)
+        corrupt(image, GEOMETRY + lp.GEOMETRY_SIZE + 8)
+        with self.assertRaisesRegex(lp.LpError, 'geometry'):
+            lp.LpMetadata.fromImage(Image(image))
+
+    def test_other_slot(self):
+        image, _ = layout()
+        corrupt(image, PRIMARY + 20)
+        corrupt(image, BACKUP + 20)
+        # Slot 1 has its own copies
+        self.assertEqual(len(lp.LpMetadata.fromImage(Image(image), 1).partitions), 4)
+        with self.assertRaisesRegex(lp.LpError, 'no metadata slot 2'):
+            lp.LpMetadata.fromImage(Image(image), 2)
+
+
+class UnpackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'super.img')
+        self.out = os.path.join(self.tmp.name, 'out')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, image):
+        with open(self.path, 'wb') as f:
+            f.write(image)
+
+    def read(self, name):
+        with open(os.path.join(self.out, name + '.img'), 'rb') as f:
+            return f.read()
+
+    def test_unpack(self):
+        image, expected = layout()
+        self.write(image)
+        self.assertEqual(lp.unpack(self.path, self.out, ['system', 'vendor', 'odm'], '_a', jobs=2), ['system', 'vendor'])
+        for name, data in expected.items():
+            self.assertEqual(self.read(name), data, name)
+
+    def test_unpack_all(self):
+        image, expected = layout()
+        self.write(image)
+        self.assertEqual(lp.unpack(self.path, self.out), ['system_a', 'vendor_a', 'vendor', 'system_b'])
+        self.assertEqual(self.read('system_a'), expected['system'])
+        self.assertEqual(self.read('system_b'), b'')
+
+    def test_unpack_sparse(self):
+        image, expected = layout()
+        self.write(toSparse(bytes(image)))
+        self.assertTrue(simg.isSparse(self.path))
+        self.assertEqual(lp.unpack(self.path, self.out, ['system', 'vendor'], '_a'), ['system', 'vendor'])
+        for name, data in expected.items():
+            self.assertEqual(self.read(name), data, name)
+
+    def test_other_block_device(self):
+        self.write(superImage([('system', [(lp.TARGET_TYPE_LINEAR, MiB, MiB, 1)])], 2 * MiB))
+        with self.assertRaisesRegex(lp.LpError, 'block device 1'):
+            lp.unpack(self.path, self.out)
+
+
+if __name__ == '__main__':
+    unittest.main()
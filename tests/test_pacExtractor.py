@@ -0,0 +1,77 @@
+import contextlib, io, os, random, tempfile, unittest, zipfile
+
+from images import pac, pacExtractor
+
+FILES = [('system', 'system.img', os.urandom(300000)), ('boot', 'boot.img', os.urandom(5000)), ('FLASH', '', b'')]
+
+
+class PacExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.tmp.name, 'out')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def zip(self, name, members, compression=zipfile.ZIP_STORED):
+        path = os.path.join(self.tmp.name, name)
+        with zipfile.ZipFile(path, 'w', compression) as z:
+            for member, data in members:
+                z.writestr(member, data)
+        return path
+
+    def extract(self, path, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            pacExtractor.main(path, self.out, **kwargs)
+
+    def checkOutput(self):
+        for _, name, data in FILES:
+            if data:
+                with open(os.path.join(self.out, name), 'rb') as f:
+                    self.assertEqual(f.read(), data, name)
+
+    def test_is_pac(self):
+        self.assertTrue(pacExtractor.isPac(self.write('fw.pac', pac(FILES))))
+        self.assertTrue(pacExtractor.isPac(self.write('fw2.pac', pac(FILES, 'BP_R2.0.1'))))
+        self.assertFalse(pacExtractor.isPac(self.write('short', b'BP')))
+        self.assertFalse(pacExtractor.isPac(self.zip('fw.zip', [('fw.pac', pac(FILES))])))
+
+    def test_is_pac_undecodable(self):
+        # Lone UTF-16 surrogates, like zip and 7z headers often have
+        self.assertFalse(pacExtractor.isPac(self.write('bad', b'\x00\xd8' * 22)))
+        rng = random.Random(0)
+        for i in range(50):
+            path = self.write(f'random{i}', bytes(rng.randrange(256) for _ in range(64)))
+            self.assertFalse(pacExtractor.isPac(path))
+
+    def test_bare_pac(self):
+        self.extract(self.write('fw.pac', pac(FILES)))
+        self.checkOutput()
+
+    def test_pac_in_zip(self):
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with self.subTest(compression=compression):
+                path = self.zip('fw.zip', [('readme.txt', b'hi'), ('fw/firmware.pac', pac(FILES))], compression)
+                f, _ = pacExtractor.openPac(path, 'fw/firmware.pac')
+                try:
+                    self.assertEqual(f.read(44), pac(FILES)[:44])
+                finally:
+                    f.close()
+                self.extract(path)
+                self.checkOutput()
+
+    def test_zip_without_pac(self):
+        path = self.zip('other.zip', [('퟿ odd.bin', os.urandom(100))])
+        self.assertFalse(pacExtractor.isPac(path))
+        with self.assertRaisesRegex(SystemExit, 'No PAC firmware'):
+            self.extract(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+import io, os, tempfile, unittest, zipfile
+from unittest import mock
+
+from images import sparse, toSparse, simg
+
+BLOCK = 4096
+
+
+def mixed():
+    """Every kind of chunk, including a zero FILL that has to stay a hole"""
+    return sparse([
+        ('raw', os.urandom(3 * BLOCK)),
+        ('fill', b'\x01\x02\x03\x04', 2),
+        ('skip', 5),
+        ('crc',),
+        ('fill', bytes(4), 300),
+        ('raw', os.urandom(BLOCK)),
+    ], blocks=320)
+
+
+def sparsechunks(count=3, blocks=12):
+    """A raw image split into sparsechunk files, each leaving the others' parts alone"""
+    raw = os.urandom(blocks * BLOCK)
+    per = blocks // count
+    images = []
+    for i in range(count):
+        chunks = [('skip', i * per)] if i else []
+        chunks.append(('raw', raw[i * per * BLOCK:(i + 1) * per * BLOCK]))
+        if i < count - 1:
+            chunks.append(('skip', blocks - (i + 1) * per))
+        images.append(sparse(chunks)[0])
+    return images, raw
+
+
+class Unseekable(io.RawIOBase):
+    """A pipe-like output"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+class SparseDecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'raw.img')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def decodeFile(self, *sparseImages):
+        """Decode through real files, so RAW data goes through copy_file_range()"""
+        sources = []
+        for i, data in enumerate(sparseImages):
+            path = os.path.join(self.tmp.name, f'sparse{i}.img')
+            with open(path, 'wb') as f:
+                f.write(data)
+            sources.append(open(path, 'rb'))
+        try:
+            with open(self.path, 'wb') as out:
+                size = simg.unsparse(sources, out)
+        finally:
+            for f in sources:
+                f.close()
+        with open(self.path, 'rb') as f:
+            return size, f.read()
+
+    def test_file_round_trip(self):
+        data, raw = mixed()
+        self.assertEqual(self.decodeFile(data), (len(raw), raw))
+
+    def test_zero_fill_is_a_hole(self):
+        data, raw = mixed()
+        self.decodeFile(data)
+        # The 300 zero blocks are never written
+        self.assertLess(os.stat(self.path).st_blocks * 512, len(raw) - 200 * BLOCK)
+
+    def test_small_pieces(self):
+        data, raw = mixed()
+        out = io.BytesIO()
+        decoder = simg.SparseDecoder(out)
+        for pos in range(0, len(data), 7):
+            decoder.write(data[pos:pos + 7])
+        self.assertEqual(decoder.close(), len(raw))
+        self.assertEqual(out.getvalue(), raw)
+
+    def test_unseekable_output(self):
+        data, raw = mixed()
+        out = Unseekable()
+        self.assertEqual(simg.unsparse([io.BytesIO(data)], out), len(raw))
+        self.assertEqual(bytes(out.data), raw)
+
+    def test_larger_headers(self):
+        data, raw = sparse([('raw', os.urandom(BLOCK)), ('fill', b'abcd', 1), ('skip', 1)], fileHeaderSize=40, chunkHeaderSize=16)
+        self.assertEqual(self.decodeFile(data), (len(raw), raw))
+
+    def test_copy_raw(self):
+        raw = os.urandom(10000)
+        out = io.BytesIO()
+        self.assertEqual(simg.unsparse([io.BytesIO(raw)], out, copyRaw=True), len(raw))
+        self.assertEqual(out.getvalue(), raw)
+
+    def test_sparsechunks(self):
+        images, raw = sparsechunks()
+        self.assertEqual(self.decodeFile(*images), (len(raw), raw))
+        # Also when they come in as one stream
+        out = io.BytesIO()
+        simg.unsparse([io.BytesIO(b''.join(images))], out)
+        self.assertEqual(out.getvalue(), raw)
+
+    def test_sparsechunks_from_zip(self):
+        images, raw = sparsechunks()
+        names = [f'system.img_sparsechunk.{i}' for i in range(len(images))]
+        archive = os.path.join(self.tmp.name, 'firmware.zip')
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name, data in zip(names, images):
+                z.writestr(name, data)
+        with open(self.path, 'wb') as out:
+            simg.unsparse(simg.openMembers(archive, names), out)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), raw)
+        with self.assertRaisesRegex(simg.SparseError, 'not in'):
+            simg.unsparse(simg.openMembers(archive, names + ['missing']), io.BytesIO())
+
+    def test_sparsechunks_need_seekable_output(self):
+        images, _ = sparsechunks()
+        with self.assertRaisesRegex(simg.SparseError, 'seekable'):
+            simg.unsparse([io.BytesIO(data) for data in images], Unseekable())
+
+    def test_empty_sparsechunk(self):
+        images, _ = sparsechunks()
+        with self.assertRaisesRegex(simg.SparseError, 'empty'):
+            simg.unsparse([io.BytesIO(images[0]), io.BytesIO()], io.BytesIO())
+
+    def test_errors(self):
+        data, _ = mixed()
+        raw = sparse([('raw', bytes(BLOCK))])[0]
+        bad = [
+            (b'not a sparse image at all', 'not a sparse image'),
+            (data[:-100], 'truncated'),
+            # RAW chunk claiming one block but carrying two
+            (raw[:simg.FILE_HEADER.size] + simg.CHUNK_HEADER.pack(simg.CHUNK_RAW, 0, 1, simg.CHUNK_HEADER.size + 2 * BLOCK), 'bytes of data'),
+            (raw[:simg.FILE_HEADER.size] + simg.CHUNK_HEADER.pack(0xCAC9, 0, 1, simg.CHUNK_HEADER.size), 'unknown chunk type'),
+        ]
+        for data, message in bad:
+            with self.subTest(message), self.assertRaisesRegex(simg.SparseError, message):
+                simg.unsparse([io.BytesIO(data)], io.BytesIO())
+
+    def test_is_sparse(self):
+        data, _ = mixed()
+        self.assertTrue(simg.isSparse(data))
+        self.assertFalse(simg.isSparse(b'\0' * 28))
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        self.assertTrue(simg.isSparse(self.path))
+        self.assertFalse(simg.isSparse(self.path + '.missing'))
+
+
+class SparseIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data, self.raw = mixed()
+        self.fd = self.open('sparse.img', self.data)
+
+    def tearDown(self):
+        os.close(self.fd)
+        self.tmp.cleanup()
+
+    def open(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return os.open(path, os.O_RDONLY)
+
+    def ranges(self):
+        """Ranges across and inside every kind of chunk, unaligned ones too"""
+        size = len(self.raw)
+        yield 0, size
+        yield 3 * BLOCK - 5, 2 * BLOCK + 13
+        yield 3 * BLOCK + 1, 7
+        yield 3 * BLOCK + 6, BLOCK
+        yield 4 * BLOCK, 6 * BLOCK
+        yield size - BLOCK - 3, BLOCK + 3
+        yield size, 0
+
+    def test_pread(self):
+        index = simg.SparseIndex(self.fd)
+        self.assertEqual(index.size, len(self.raw))
+        for offset, length in self.ranges():
+            with self.subTest(offset=offset, length=length):
+                self.assertEqual(index.pread(length, offset), self.raw[offset:offset + length])
+        # Short at the end, like os.pread()
+        self.assertEqual(index.pread(100, len(self.raw) - 10), self.raw[-10:])
+
+    def test_copy_to(self):
+        index = simg.SparseIndex(self.fd)
+        path = os.path.join(self.tmp.name, 'out.img')
+        for offset, length in self.ranges():
+            with self.subTest(offset=offset, length=length):
+                with open(path, 'wb') as out:
+                    index.copyTo(out.fileno(), offset, length, 100)
+                    out.truncate(100 + length)
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), bytes(100) + self.raw[offset:offset + length])
+
+    def test_copy_to_by_hand(self):
+        # Where copy_file_range() is not supported
+        index = simg.SparseIndex(self.fd)
+        path = os.path.join(self.tmp.name, 'out.img')
+        with open(path, 'wb') as out, mock.patch('os.copy_file_range', side_effect=OSError('unsupported'), create=True):
+            out.write(b'keep')
+            index.copyTo(out.fileno(), 0, len(self.raw), 100)
+            self.assertEqual(out.tell(), 4)
+            out.truncate(100 + len(self.raw))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'keep' + bytes(96) + self.raw)
+
+    def test_round_trip(self):
+        raw = bytearray(os.urandom(40 * BLOCK))
+        raw[BLOCK:10 * BLOCK] = bytes(9 * BLOCK)
+        raw[20 * BLOCK:25 * BLOCK] = b'\xaa\xbb\xcc\xdd' * (5 * BLOCK // 4)
+        fd = self.open('round.img', toSparse(bytes(raw)))
+        try:
+            self.assertEqual(simg.SparseIndex(fd).pread(len(raw), 0), raw)
+        finally:
+            os.close(fd)
+
+    def test_errors(self):
+        index = simg.SparseIndex(self.fd)
+        with self.assertRaisesRegex(simg.SparseError, 'past the end'):
+            list(index.pieces(len(self.raw) - 10, 11))
+        for data, message in ((b'not sparse' * 4, 'not a sparse image'), (self.data[:200], 'truncated')):
+            fd = self.open('bad.img', data)
+            try:
+                with self.subTest(message), self.assertRaisesRegex(simg.SparseError, message):
+                    simg.SparseIndex(fd)
+            finally:
+                os.close(fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
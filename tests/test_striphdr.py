@@ -0,0 +1,93 @@
+import os, struct, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+import striphdr
+
+
+def ext4(size=64 << 10):
+    """Start of an ext4 filesystem with just enough of a superblock"""
+    fs = bytearray(os.urandom(size))
+    sb = striphdr.SUPERBLOCK
+    fs[sb:sb + 80] = bytes(80)
+    struct.pack_into('<I', fs, sb, 1024)        # inodes
+    struct.pack_into('<I', fs, sb + 24, 2)      # 4096 byte blocks
+    fs[sb + 56:sb + 58] = striphdr.EXT4_MAGIC
+    struct.pack_into('<I', fs, sb + 76, 1)      # dynamic revision
+    return bytes(fs)
+
+
+def header(kind, size):
+    # No stray superblock magic in the header itself
+    return (kind + bytes(8) + os.urandom(size - 12)).replace(striphdr.EXT4_MAGIC, b'\0\0')
+
+
+class FindFilesystemTest(unittest.TestCase):
+    def test_known_offset(self):
+        self.assertEqual(striphdr.findFilesystem(header(b'MOTO', 131072) + ext4()), 131072)
+
+    def test_sector_aligned(self):
+        self.assertEqual(striphdr.findFilesystem(header(b'ASUS', 4608) + ext4()), 4608)
+
+    def test_unaligned(self):
+        self.assertEqual(striphdr.findFilesystem(header(b'ASUS', 1000) + ext4()), 1000)
+
+    def test_magic_without_superblock(self):
+        buf = bytearray(header(b'MOTO', 8192) + ext4())
+        # Same magic in the header, but no plausible superblock around it
+        buf[512 + striphdr.MAGIC_OFFSET:512 + striphdr.MAGIC_OFFSET + 2] = striphdr.EXT4_MAGIC
+        self.assertEqual(striphdr.findFilesystem(bytes(buf)), 8192)
+
+    def test_none(self):
+        self.assertIsNone(striphdr.findFilesystem(header(b'MOTO', 8192)))
+
+
+class StripTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'system.img')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_strip(self):
+        fs = ext4()
+        self.write(header(b'MOTO', 131072) + fs)
+        self.assertEqual(striphdr.strip(self.path), ('MOTO', 131072))
+        self.assertEqual(self.read(), fs)
+
+    def test_copy_fallback(self):
+        fs = ext4()
+        self.write(header(b'ASUS', 4608) + fs)
+        striphdr.copyFrom(self.path, 4608)
+        self.assertEqual(self.read(), fs)
+        self.assertFalse(os.path.exists(self.path + '-2'))
+
+    def test_dry_run(self):
+        data = header(b'ASUS', 4608) + ext4()
+        self.write(data)
+        self.assertEqual(striphdr.strip(self.path, dryRun=True), ('ASUS', 4608))
+        self.assertEqual(self.read(), data)
+
+    def test_no_header(self):
+        fs = ext4()
+        self.write(fs)
+        self.assertIsNone(striphdr.strip(self.path))
+        self.assertEqual(self.read(), fs)
+
+    def test_header_without_filesystem(self):
+        self.write(header(b'MOTO', 8192))
+        with self.assertRaises(striphdr.StripError):
+            striphdr.strip(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+import contextlib, io, os, sys, tempfile, unittest
+from unittest import mock
+
+from images import TOOLS, dzFile, gpt, simg
+
+sys.path.insert(0, os.path.join(TOOLS, 'kdztools'))
+
+import undz
+
+BLOCK = 512
+BLOCKS = 4096
+SLICES = [('system', 34, 2034), ('vendor', 2034, 3034), ('userdata', 3034, BLOCKS - 34)]
+# Where the data of chunk 0 and its MD5 are in the DZ file
+CHUNK0_DATA = 2 * BLOCK
+CHUNK0_MD5 = BLOCK + 4 + 32 + 64 + 8
+
+
+def layout():
+    """The chunks of a small disk and the raw disk they make up"""
+    chunks = [
+        ('PrimaryGPT', 'PrimaryGPT_0.bin', 0, gpt(SLICES, BLOCKS), 34),
+        ('system', 'system_34.bin', 34, os.urandom(100 * BLOCK) + bytes(600 * BLOCK) + os.urandom(50 * BLOCK), 1000),
+        ('system', 'system_1034.bin', 1034, os.urandom(20 * BLOCK), 1000),
+        ('vendor', 'vendor_2034.bin', 2034, bytes(10 * BLOCK) + os.urandom(100 * BLOCK), 1000),
+        ('userdata', 'userdata_3034.bin', 3034, os.urandom(8 * BLOCK), BLOCKS - 34 - 3034),
+        # The backup GPT chunk starts with some padding in front of its slice
+        ('BackupGPT', 'BackupGPT_%d.bin' % (BLOCKS - 40), BLOCKS - 40, bytes(6 * BLOCK) + gpt(SLICES, BLOCKS, False), 40),
+    ]
+    disk = bytearray(BLOCKS * BLOCK)
+    for _, _, addr, data, _ in chunks:
+        disk[addr * BLOCK:addr * BLOCK + len(data)] = data
+    return chunks, bytes(disk)
+
+
+class UndzTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test.dz')
+        self.out = os.path.join(self.tmp.name, 'out')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def open(self, **options):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return undz.UNDZFile.open(self.path, **options)
+
+    def extract(self, *args):
+        argv = ['undz.py', '-f', self.path, '-o', self.out] + list(args)
+        with mock.patch.object(sys, 'argv', argv), contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            undz.DZFileTools().main()
+
+    def read(self, name):
+        with open(os.path.join(self.out, name), 'rb') as f:
+            return f.read()
+
+    def verify(self):
+        output = io.StringIO()
+        with self.open(strict=False) as dz, contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            ok = dz.verify()
+        return ok, output.getvalue()
+
+
+class VerifyTest(UndzTest):
+    def test_verify(self):
+        self.write(dzFile(layout()[0]))
+        ok, output = self.verify()
+        self.assertTrue(ok)
+        self.assertIn('6 of 6 chunks passed', output)
+
+    def test_damaged_first_chunk(self):
+        data = bytearray(dzFile(layout()[0]))
+        for name, offset in (('data', CHUNK0_DATA + 10), ('md5', CHUNK0_MD5)):
+            with self.subTest(name):
+                damaged = bytearray(data)
+                damaged[offset] ^= 0xFF
+                self.write(damaged)
+                # Reported as a failed chunk rather than stopping at the GPT
+                ok, output = self.verify()
+                self.assertFalse(ok)
+                self.assertRegex(output, r'\n   0 : PrimaryGPT_0\.bin .* FAIL')
+                self.assertIn('5 of 6 chunks passed', output)
+                with self.assertRaises(undz.DZError):
+                    self.open()
+
+    def test_zstd_errors_are_dz_errors(self):
+        try:
+            import zstandard
+        except ImportError:
+            self.skipTest('no zstandard')
+        chunks = layout()[0]
+        data = bytearray(dzFile(chunks, zstandard.ZstdCompressor(write_content_size=False).compress))
+        self.write(data)
+        self.assertTrue(self.verify()[0])
+        data[CHUNK0_DATA + 20] ^= 0xFF
+        self.write(data)
+        ok, output = self.verify()
+        self.assertFalse(ok)
+        self.assertIn('5 of 6 chunks passed', output)
+
+
+class ExtractTest(UndzTest):
+    def assertSlices(self, disk):
+        for name, start, end in SLICES:
+            self.assertEqual(self.read(name + '.image'), disk[start * BLOCK:end * BLOCK], name)
+
+    def test_slices(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-s')
+        self.assertSlices(disk)
+        self.assertEqual(self.read('PrimaryGPT.image'), disk[:34 * BLOCK])
+        self.assertIn(b'startLBA=34\n', self.read('system.image.params'))
+
+    def test_named_slices(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-s', 'vendor,system')
+        self.assertEqual(sorted(f for f in os.listdir(self.out) if f.endswith('.image')), ['system.image', 'vendor.image'])
+        self.assertEqual(self.read('vendor.image'), disk[2034 * BLOCK:3034 * BLOCK])
+
+    def test_image(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-i')
+        self.assertEqual(self.read('image.img'), disk)
+
+    def test_sparse(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-s', 'system')
+        allocated = os.stat(os.path.join(self.out, 'system.image')).st_blocks
+        self.extract('-s', 'system', '--sparse')
+        self.assertEqual(self.read('system.image'), disk[34 * BLOCK:2034 * BLOCK])
+        # The 600 zero blocks of the first system chunk are left as a hole
+        self.assertLessEqual(os.stat(os.path.join(self.out, 'system.image')).st_blocks, allocated - 500)
+
+    def test_jobs(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        for jobs in ('1', '4'):
+            with self.subTest(jobs=jobs):
+                self.extract('-i', '-j', jobs)
+                self.assertEqual(self.read('image.img'), disk)
+                self.extract('-s', '-j', jobs)
+                self.assertSlices(disk)
+
+    def test_devices_overlap(self):
+        chunks, disk = layout()
+        # The same range on another device, which comes after the first one
+        other = os.urandom(8 * BLOCK)
+        chunks.append(('userdata', 'userdata_3034.bin', 3034, other, BLOCKS - 3034, 1))
+        disk = bytearray(disk)
+        disk[3034 * BLOCK:3042 * BLOCK] = other
+        self.write(dzFile(chunks))
+        for jobs in ('1', '4', '4'):
+            self.extract('-i', '-j', jobs)
+            self.assertEqual(self.read('image.img'), disk)
+
+
+class IndexTest(UndzTest):
+    def setUp(self):
+        super().setUp()
+        self.cache = os.path.join(self.tmp.name, 'cache')
+        patcher = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fromIndex(self):
+        with self.open(useIndex=True) as dz:
+            return dz.fromIndex, dz.getChunkCount()
+
+    def indexFiles(self):
+        return [os.path.join(self.cache, 'kdztools', name) for name in os.listdir(os.path.join(self.cache, 'kdztools'))]
+
+    def test_hit(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.assertEqual(self.fromIndex(), (False, 6))
+        self.assertEqual(len(self.indexFiles()), 1)
+        self.assertEqual(self.fromIndex(), (True, 6))
+        # Extracting from what the index says
+        self.extract('-i', '--index')
+        self.assertEqual(self.read('image.img'), disk)
+        self.extract('-s', '--index')
+        self.assertEqual(self.read('system.image'), disk[34 * BLOCK:2034 * BLOCK])
+
+    def test_file_changed(self):
+        chunks, _ = layout()
+        self.write(dzFile(chunks))
+        self.fromIndex()
+        # Another size
+        self.write(dzFile(chunks[:4] + chunks[5:]))
+        self.assertEqual(self.fromIndex(), (False, 5))
+        self.assertEqual(self.fromIndex(), (True, 5))
+        # Same size, but modified
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(self.fromIndex(), (False, 5))
+        self.assertEqual(self.fromIndex(), (True, 5))
+
+    def test_corrupt_index(self):
+        self.write(dzFile(layout()[0]))
+        self.fromIndex()
+        path, = self.indexFiles()
+        with open(path, 'rb') as f:
+            index = f.read()
+        for data in (b'', index[:len(index) // 2], b'[]', b'{"version": 1}', index.replace(b'"chunks"', b'"chunkz"')):
+            with self.subTest(data=data[:20]):
+                with open(path, 'wb') as f:
+                    f.write(data)
+                self.assertEqual(self.fromIndex(), (False, 6))
+                # Written again
+                self.assertEqual(self.fromIndex(), (True, 6))
+
+    def test_verify_ignores_index(self):
+        chunks, _ = layout()
+        self.write(dzFile(chunks))
+        self.fromIndex()
+        with self.open(useIndex=True) as dz, contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(dz.fromIndex)
+            self.assertTrue(dz.verify())
+            self.assertFalse(dz.fromIndex)
+
+
+def chunkTypes(image):
+    """The chunk types of a sparse image, in order"""
+    header = simg.FILE_HEADER.unpack_from(image)
+    pos, types = header[3], []
+    for _ in range(header[7]):
+        kind, _, _, total = simg.CHUNK_HEADER.unpack_from(image, pos)
+        types.append(kind)
+        pos += total
+    return types
+
+
+class SparseImageTest(UndzTest):
+    def test_round_trip(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-s')
+        plain = {name: self.read(name + '.image') for name, _, _ in SLICES}
+        self.extract('-s', '--simg')
+        for name, _, _ in SLICES:
+            with self.subTest(name):
+                image = self.read(name + '.image')
+                self.assertTrue(simg.isSparse(image))
+                out = io.BytesIO()
+                self.assertEqual(simg.unsparse([io.BytesIO(image)], out), len(plain[name]))
+                self.assertEqual(out.getvalue(), plain[name])
+        # The trimmed areas between and after the chunks are DONT_CARE
+        self.assertEqual(chunkTypes(self.read('system.image')), [simg.CHUNK_RAW, simg.CHUNK_DONT_CARE, simg.CHUNK_RAW, simg.CHUNK_DONT_CARE])
+        self.assertEqual(chunkTypes(self.read('userdata.image')), [simg.CHUNK_RAW, simg.CHUNK_DONT_CARE])
+
+    def test_zero_data_is_a_hole(self):
+        chunks, disk = layout()
+        self.write(dzFile(chunks))
+        self.extract('-s', 'system', '--simg', '--sparse')
+        path = os.path.join(self.out, 'system.image')
+        # The 600 zero blocks of the first chunk are RAW, but never written
+        self.assertLess(os.stat(path).st_blocks, os.stat(path).st_size // BLOCK - 500)
+        out = io.BytesIO()
+        simg.unsparse([io.BytesIO(self.read('system.image'))], out)
+        self.assertEqual(out.getvalue(), disk[34 * BLOCK:2034 * BLOCK])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Works out what kind of firmware a file is, for extractor.sh.
+# The archive is listed once and the magic bytes read once, then every known
+# format is checked against that, instead of one '7z l | grep' per format.
+# That listing can be saved for the later steps of extractor.sh ('--listing').
+#
+# Prints shell variables for 'eval' by default, or JSON with '--json'.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, json, os, re, shlex, subprocess, sys, zipfile
+
+
+# Same as 'OTHERPARTITIONS' of extractor.sh, 'name in archive:partition'
+OTHER_PARTITIONS = 'tz.mbn:tz tz.img:tz modem.img:modem NON-HLOS:modem boot-verified.img:boot dtbo-verified.img:dtbo'
+
+# Formats found from archive members, in the order extractor.sh tries them.
+# Each test gets a member name, members passing it are kept in the plan.
+MEMBER_FORMATS = [
+    ('ota',       lambda n: 'system.new.dat' in n),
+    ('qfil',      lambda n: 'rawprogram' in n),
+    ('nb0',       lambda n: 'nb0' in n),
+    ('chunk',     lambda n: 'system' in n and 'chunk' in n and not n.endswith('.so')),
+    ('super',     lambda n: 'super.img' in n),
+    ('image',     re.compile(r'system_new.img|^system.img|/system.img|/system_image.emmc.img|^system_image.emmc.img').search),
+    ('sin',       re.compile(r'system.sin|system_.*\.sin').search),
+    ('pac',       lambda n: n.endswith('.pac')),
+    ('bin',       lambda n: 'system.bin' in n),
+    ('psuffix',   lambda n: 'system-p' in n),
+    ('sign',      lambda n: 'system-sign.img' in n),
+    ('tarmd5',    lambda n: 'tar.md5' in n and 'AP_' in os.path.basename(n)),
+    ('tar',       lambda n: n.endswith('.tar')),
+    ('payload',   lambda n: 'payload.bin' in n),
+    ('zip',       re.compile(r'\.(rar|zip)').search),
+    ('updateapp', lambda n: 'UPDATE.APP' in n),
+]
+
+
+class Member:
+    """One file inside the firmware archive"""
+
+    def __init__(self, name, size, method=None, offset=None):
+        self.name = name
+        self.size = size
+        self.method = method
+        self.offset = offset
+
+
+class Plan:
+    """What extractor.sh should do with a firmware file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = ''        # branch to take, '' if nothing matched
+        self.matches = []       # every format that matched, best first
+        self.pre = ''           # superimg/payload/pac, from the file name
+        self.members = []       # members of the archive for 'format'
+        self.extras = []        # OTHER_PARTITIONS entries to extract (QFIL)
+        self.dtbo = False       # has firmware-update/dtbo.img
+        self.radio = False      # has radio.img
+        self.listed = None      # names of all members, if the archive was listed
+
+    def toDict(self):
+        return dict(vars(self))
+
+    def toShell(self):
+        """Shell variable assignments, safe for 'eval'"""
+        values = {
+            'FORMAT': self.format,
+            'MATCHES': ' '.join(self.matches),
+            'PRE': self.pre,
+            'MEMBERS': '\n'.join(self.members),
+            'EXTRAS': ' '.join(self.extras),
+            'HAS_DTBO': '1' if self.dtbo else '',
+            'HAS_RADIO': '1' if self.radio else '',
+        }
+        return ''.join(f'{k}={shlex.quote(v)}\n' for k, v in values.items())
+
+
+def listMembers(path):
+    """Return [Member] of a zip (read directly) or any archive 7z knows, [] if it isn't one"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            return [Member(i.filename, i.file_size, i.compress_type, i.header_offset) for i in z.infolist() if not i.is_dir()]
+
+    try:
+        out = subprocess.run(['7z', 'l', '-ba', '-slt', path], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL).stdout.decode('utf-8', 'replace')
+    except OSError:
+        return []
+
+    members = []
+    entry = {}
+    for line in out.splitlines() + ['']:
+        if not line:
+            if 'Path' in entry and 'D' not in entry.get('Attributes', ''):
+                members.append(Member(entry['Path'], int(entry.get('Size') or 0), entry.get('Method'), entry.get('Offset')))
+            entry = {}
+        elif ' = ' in line:
+            key, value = line.split(' = ', 1)
+            entry[key] = value
+    return members
+
+
+def readMagic(path, size=16):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(size)
+    except OSError:
+        return b''
+
+
+def detect(path, members=None, other=OTHER_PARTITIONS):
+    """
+    Return the Plan for the firmware file path.  The archive is only listed
+    if no format can be told from the name and magic; 'members' can be given
+    to skip listing it altogether.
+    """
+    plan = Plan(path)
+    name = os.path.basename(path)
+    magic = readMagic(path)
+
+    # Files handled as they are, before looking any further
+    if 'super.img' in path:
+        plan.pre = 'superimg'
+    elif 'payload.bin' in path:
+        plan.pre = 'payload'
+    elif path.endswith('.pac'):
+        plan.pre = 'pac'
+
+    # Formats known from the name and magic, these never get listed
+    if magic[:12].replace(b'\0', b'') == b'OPPOENCRYPT!' or name.endswith('.ozip'):
+        plan.matches.append('ozip')
+    if 'kdz' in name:
+        plan.matches.append('kdz')
+    if 'ruu_' in name.lower() and 'exe' in name.lower():
+        plan.matches.append('ruu')
+    if name.endswith(('.img', '.bin')) and magic[:6].replace(b'\0', b'\n').rstrip(b'\n') == b'RKFWf':
+        plan.matches.append('rockchip')
+
+    if plan.matches:
+        plan.format = plan.matches[0]
+        return plan
+
+    if members is None:
+        members = listMembers(path)
+    plan.listed = [m.name for m in members]
+
+    # One pass over the members for every format
+    found = {fmt: [] for fmt, _ in MEMBER_FORMATS}
+    found['amlogic'] = []
+    others = [p.split(':', 1) for p in other.split()]
+    seen = set()
+    for m in members:
+        n = m.name
+        if re.search(r'aml.*\.img$', os.path.basename(n)):
+            found['amlogic'].append(n)
+        for fmt, test in MEMBER_FORMATS:
+            if test(n):
+                found[fmt].append(n)
+        for src, dst in others:
+            if src in n:
+                seen.add(src)
+        plan.dtbo |= 'firmware-update/dtbo.img' in n
+        plan.radio |= 'radio.img' in n
+
+    # Single partition images of QFIL packages are extracted in any case
+    if found['qfil']:
+        plan.extras = [f'{src}:{dst}' for src, dst in others if src in seen]
+
+    plan.matches = [fmt for fmt in ['amlogic'] + [f for f, _ in MEMBER_FORMATS] if found[fmt]]
+    if plan.matches:
+        plan.format = plan.matches[0]
+        plan.members = found[plan.format]
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect the firmware format of a file for extractor.sh')
+    parser.add_argument('romzip', help='firmware file or archive')
+    parser.add_argument('--other', default=OTHER_PARTITIONS, help="'name:partition' pairs extracted from QFIL packages")
+    parser.add_argument('--json', action='store_true', help='print the plan as JSON instead of shell variables')
+    parser.add_argument('--listing', metavar='FILE', help='save the names of the members, one per line, if the archive got listed')
+    parser.add_argument('--list', action='store_true', help='only print the names of the members, one per line')
+    args = parser.parse_args()
+
+    if args.list:
+        sys.stdout.writelines(m.name + '\n' for m in listMembers(args.romzip))
+        sys.exit(0)
+
+    plan = detect(args.romzip, other=args.other)
+    if args.listing and plan.listed is not None:
+        with open(args.listing, 'w') as f:
+            f.writelines(n + '\n' for n in plan.listed)
+    if args.json:
+        json.dump(plan.toDict(), sys.stdout, indent=2)
+        print()
+    else:
+        sys.stdout.write(plan.toShell())
@@ -22,7 +22,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import sys
 from struct import Struct
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 
 class DZStruct(object):
@@ -39,24 +39,30 @@ class DZStruct(object):
 		"""
 
 
-		# Generate the struct for .unpack()
-		try:
-			classy._dzstruct
+		# Everything is generated once per format, not per instance
+		if "_dz_struct" in classy.__dict__:
+			return
 
-		except AttributeError:
-			classy._dz_struct = Struct("<" + "".join([x[0] for x in classy._dz_format_dict.values()]))
+		# Generate the struct for .unpack()
+		struct = Struct("<" + "".join([x[0] for x in classy._dz_format_dict.values()]))
 
-			# Sanity check
-			if self._dz_struct.size != self._dz_length:
-				print("[!] Internal error!  Chunk format wrong! (computed={:d}, specified={:d})".format(self._dz_struct.size, self._dz_length), file=sys.stderr)
-				sys.exit(-1)
+		# Sanity check
+		if struct.size != classy._dz_length:
+			print("[!] Internal error!  Chunk format wrong! (computed={:d}, specified={:d})".format(struct.size, classy._dz_length), file=sys.stderr)
+			sys.exit(-1)
 
 		# Generate list of items that can be collapsed (truncated)
-		try:
-			classy._dz_collapsibles
+		classy._dz_collapsibles = [n for n, (y, p) in classy._dz_format_dict.items() if p]
+
+		# Positions of the collapsibles, by type, for unpackrecord()
+		keys = list(classy._dz_format_dict.keys())
+		classy._dz_strip = [keys.index(n) for n in classy._dz_collapsibles if classy._dz_format_dict[n][0][-1] == 's']
+		classy._dz_zero = [keys.index(n) for n in classy._dz_collapsibles if classy._dz_format_dict[n][0][-1] != 's']
+
+		# Records are tuples, with the raw header appended as "buffer"
+		classy._dz_record = namedtuple(classy.__name__ + "Record", keys + ["buffer"])
 
-		except AttributeError:
-			classy._dz_collapsibles = [n for n, (y, p) in classy._dz_format_dict.items() if p]
+		classy._dz_struct = struct
 
 
 	def packdict(self, din):
@@ -100,6 +106,35 @@ class DZStruct(object):
 
 		return d
 
+	def unpackrecord(self, buffer, offset=0):
+		"""
+		Unpack the header at offset of buffer into a record (a namedtuple
+		with the raw header as .buffer), return None if it is short or the
+		magic number/header is absent.  Collapsible strings come back
+		truncated, collapsible integers which aren't zero raise ValueError.
+		"""
+
+		raw = buffer[offset:offset+self._dz_length]
+		if len(raw) != self._dz_length:
+			return None
+
+		values = list(self._dz_struct.unpack(raw))
+
+		if 'header' in self._dz_format_dict and values[0] != self._dz_header:
+			return None
+
+		for i in self._dz_strip:
+			values[i] = values[i].rstrip(b'\x00')
+			if b'\x00' in values[i]:
+				print("[!] Warning: extraneous data found IN "+self._dz_record._fields[i], file=sys.stderr)
+
+		for i in self._dz_zero:
+			if values[i] != 0:
+				raise ValueError('Value supposed to be zero in field "'+self._dz_record._fields[i]+'" is non-zero ('+hex(values[i])+')')
+
+		values.append(raw)
+		return self._dz_record._make(values)
+
 
 
 class DZChunk(DZStruct):
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Positional reads, in-kernel copies and the worker pool shared by the
+# extraction scripts
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TruncatedFile(IOError):
+	"""
+	The source ended before all the requested bytes were copied
+	"""
+
+
+def preadinto(fd, view, offset):
+	"""
+	Positional read into view, leaving the descriptor's offset alone
+	"""
+
+	if hasattr(os, "preadv"):
+		return os.preadv(fd, [view], offset)
+
+	buf = os.pread(fd, len(view), offset)
+	view[:len(buf)] = buf
+	return len(buf)
+
+
+def copyRange(infd, outfile, offset, length, bufSize=1<<20, dest=None):
+	"""
+	Copies length bytes starting at offset of infd into outfile, inside
+	the kernel when possible, otherwise through one large buffer.  With
+	dest, they go to that offset of outfile, which can also be a plain
+	descriptor then, and its position is left alone.
+	"""
+
+	outfd = outfile if isinstance(outfile, int) else outfile.fileno()
+
+	# copy_file_range() can even reflink, sendfile() is older but only
+	# writes at the current position
+	for call in ("copy_file_range", "sendfile"):
+		if not hasattr(os, call) or (call == "sendfile" and dest is not None):
+			continue
+		try:
+			while length > 0:
+				if call == "copy_file_range":
+					count = os.copy_file_range(infd, outfd, length, offset, dest)
+				else:
+					count = os.sendfile(outfd, infd, offset, length)
+				if count == 0:
+					break
+				offset += count
+				length -= count
+				if dest is not None:
+					dest += count
+		except OSError:
+			# unsupported by kernel or filesystem, try the next method
+			continue
+		if length == 0:
+			return
+
+	# Plain copy, reusing a single buffer
+	view = memoryview(bytearray(min(bufSize, length)))
+	while length > 0:
+		count = preadinto(infd, view[:min(length, bufSize)], offset)
+		if not count:
+			raise TruncatedFile("{:d} bytes missing at offset {:d}".format(length, offset))
+		if dest is None:
+			outfile.write(view[:count])
+		else:
+			done = 0
+			while done < count:
+				done += os.pwrite(outfd, view[done:count], dest + done)
+			dest += count
+		offset += count
+		length -= count
+
+
+def runJobs(jobs, tasks, done=None):
+	"""
+	Runs the (function, args...) tuples of tasks on a pool of jobs workers
+	and returns their results in order.  done(index), if given, is called
+	for each task once its result is in, in order; the first failure is
+	raised after the tasks before it are done.
+	"""
+
+	results = []
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+		pending = [pool.submit(*task) for task in tasks]
+		for index, job in enumerate(pending):
+			results.append(job.result())
+			if done:
+				done(index)
+	return results
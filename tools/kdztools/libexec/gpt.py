@@ -22,10 +22,13 @@ from __future__ import print_function
 import os
 import sys
 import io
+import mmap
+import errno
 from collections import OrderedDict
 from struct import Struct
 from uuid import UUID
 from binascii import crc32
+from fileio import copyRange
 
 
 verbose = lambda msg: None
@@ -74,14 +77,14 @@ class GPTSlice(object):
 		verbose("Name({:d}): \"{:s}\" start={:d} end={:d} count={:d}".format(idx, self.name, self.startLBA, self.endLBA, self.endLBA-self.startLBA+1))
 		verbose("typ={:s} id={:s}".format(str(self.type), str(self.uuid)))
 
-	def __init__(self, buf):
+	def __init__(self, values):
 		"""
-		Initialize the GPTSlice class
+		Initialize the GPTSlice class from the unpacked values of an entry
 		"""
 
 		data = dict(zip(
 			self._gpt_slice_fmt.keys(),
-			self._gpt_struct.unpack(buf)
+			values
 		))
 
 		self.type = UUID(bytes=data['type'])
@@ -169,17 +172,21 @@ class GPT(object):
 			verbose("Note: empty LBAs at end ({:d} unused)".format(self.dataEndLBA-current))
 
 
-	def tryParseHeader(self, buf):
+	def tryParseHeader(self, buf, offset=0):
 		"""
-		Try to parse a buffer as a GPT header, return None on failure
+		Try to parse the GPT header at offset of buf, return None on failure
 		"""
 
-		if len(buf) < self._gpt_size:
+		if offset < 0 or len(buf) < offset + self._gpt_size:
 			raise NoGPT("Failed to locate GPT")
 
+		# Only the magic is looked at for most candidates
+		if buf[offset:offset+8] != self._gpt_header:
+			return None
+
 		data = dict(zip(
 			self._gpt_head_fmt.keys(),
-			self._gpt_struct.unpack(buf[0:self._gpt_size])
+			self._gpt_struct.unpack_from(buf, offset)
 		))
 
 		if data['header'] != self._gpt_header:
@@ -193,7 +200,7 @@ class GPT(object):
 		data['crc32'] = tmp
 
 		# just in case future ones are larger
-		crc = crc32(buf[self._gpt_size:data['headerSize']], crc)
+		crc = crc32(buf[offset+self._gpt_size:offset+data['headerSize']], crc)
 		crc &= 0xFFFFFFFF
 
 		if crc != data['crc32']:
@@ -204,9 +211,28 @@ class GPT(object):
 
 
 
+	@classmethod
+	def fromFile(cls, file, **kwargs):
+		"""
+		Parse the GPT of the disk image open as file, mapping it rather
+		than reading it so both the primary and backup can be found
+		"""
+
+		try:
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as map:
+				return cls(map, **kwargs)
+		except (ValueError, OSError, io.UnsupportedOperation):
+			pass
+
+		# header is always in second LBA, slice entries in third
+		# if you run out of slice entries with a 64KB LBA, oy vey!
+		return cls(file.read((1<<17)+(1<<16)), **kwargs)
+
 	def __init__(self, buf, type=None, lbaMinShift=9, lbaMaxShift=16):
 		"""
-		Initialize the GPT class
+		Initialize the GPT class, buf can be anything sliceable which
+		supports the buffer protocol (bytes, mmap, memoryview); only the
+		headers and slice entries are ever copied out of it
 		"""
 
 		# sanity checking
@@ -225,18 +251,14 @@ class GPT(object):
 			lbaSize = 1<<shiftLBA
 
 			# try for a primary GPT
-			hbuf = buf[lbaSize:lbaSize<<1]
-
-			data = self.tryParseHeader(hbuf)
+			data = self.tryParseHeader(buf, lbaSize)
 
 			if data:
 				verbose("Found Primary GPT")
 				break
 
 			# try for a backup GPT
-			hbuf = buf[-lbaSize:]
-
-			data = self.tryParseHeader(hbuf)
+			data = self.tryParseHeader(buf, len(buf)-lbaSize)
 
 			if data:
 				verbose("Found Backup GPT")
@@ -285,23 +307,25 @@ class GPT(object):
 		if self.myLBA == 1:
 			sliceAddr = self.entryStart<<self.shiftLBA
 		else:
-			sliceAddr = (self.entryStart-self.myLBA-1)<<self.shiftLBA
+			sliceAddr = len(buf)+((self.entryStart-self.myLBA-1)<<self.shiftLBA)
 
-		self.slices = []
-		crc = 0
-		for i in range(self.entryCount):
-			sbuf = buf[sliceAddr:sliceAddr+self.entrySize]
-			crc = crc32(sbuf, crc)
-			slice = GPTSlice(sbuf)
-			self.slices.append(slice)
+		if self.entrySize < GPTSlice._gpt_struct.size:
+			raise NoGPT("Error: slice entries too small")
 
-			sliceAddr+=self.entrySize
+		table = buf[sliceAddr:sliceAddr+self.entryCount*self.entrySize]
+		if sliceAddr < 0 or len(table) != self.entryCount*self.entrySize:
+			raise NoGPT("Error: slice entries outside of buffer")
 
-		crc &= 0xFFFFFFFF
-
-		if crc != self.entryCrc32:
+		if crc32(table) & 0xFFFFFFFF != self.entryCrc32:
 			raise NoGPT("Error: bad slice entry CRC")
 
+		if self.entrySize == GPTSlice._gpt_struct.size:
+			entries = GPTSlice._gpt_struct.iter_unpack(table)
+		else:
+			entries = (GPTSlice._gpt_struct.unpack_from(table, addr) for addr in range(0, len(table), self.entrySize))
+
+		self.slices = [GPTSlice(values) for values in entries]
+
 		last = 0
 		for slice in self.slices:
 			if slice.type == UUID(int=0):
@@ -316,6 +340,104 @@ class GPT(object):
 
 
 
+def copyData(infd, outfile, offset, length):
+	"""
+	Copies length bytes at offset of infd to the start of outfile,
+	skipping the holes of infd so they stay holes in outfile
+	"""
+
+	pos = offset
+	end = offset + length
+	while pos < end:
+		try:
+			data = os.lseek(infd, pos, os.SEEK_DATA)
+		except OSError as err:
+			# past the last data of the file, the rest is a hole
+			if err.errno == errno.ENXIO:
+				break
+			data = pos
+		if data >= end:
+			break
+
+		try:
+			hole = min(os.lseek(infd, data, os.SEEK_HOLE), end)
+		except OSError:
+			hole = end
+
+		outfile.seek(data - offset)
+		copyRange(infd, outfile, data, hole - data)
+		pos = hole
+
+	outfile.truncate(length)
+
+
+
+class GPTDisk(object):
+	"""
+	A raw disk image (or one LUN of a UFS device) with a GPT, opened for
+	carving out its slices; can be shared between threads
+	"""
+
+	@classmethod
+	def open(cls, path, lun=None):
+		"""
+		Open the disk image path and parse its GPT
+		"""
+		return cls(path, lun)
+
+	def getSlices(self, names=None):
+		"""
+		Return the slices in use, or only those named in names
+		"""
+		return [s for s in self.gpt.slices if s.type != UUID(int=0) and (names is None or s.name in names)]
+
+	def getRange(self, slice):
+		"""
+		Return the byte offset and length of slice in the image
+		"""
+		return slice.startLBA<<self.gpt.shiftLBA, (slice.endLBA-slice.startLBA+1)<<self.gpt.shiftLBA
+
+	def extract(self, slice, path):
+		"""
+		Copy slice to the file path, holes in the image are kept as holes
+		"""
+
+		offset, length = self.getRange(slice)
+		with io.open(path, "wb") as outfile:
+			# a truncated dump reads as zeros past its end
+			copyData(self.infile.fileno(), outfile, offset, max(min(length, self.length - offset), 0))
+			outfile.truncate(length)
+
+	def close(self):
+		self.infile.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __init__(self, path, lun=None):
+		"""
+		Opens the image and loads its GPT, the backup is used if the
+		primary is damaged
+		"""
+
+		super(GPTDisk, self).__init__()
+
+		self.path = path
+		self.lun = lun
+		self.infile = io.FileIO(path, "rb")
+		self.length = os.fstat(self.infile.fileno()).st_size
+
+		try:
+			self.gpt = GPT.fromFile(self.infile)
+		except NoGPT:
+			self.infile.close()
+			raise
+
+
+
 if __name__ == "__main__":
 	verbose = lambda msg: print(msg)
 
@@ -324,17 +446,13 @@ if __name__ == "__main__":
 
 	for arg in sys.argv:
 		if arg == "-":
-			file = sys.stdin
+			file = sys.stdin.buffer
 		else:
 			file = io.FileIO(arg, "rb")
 
-		# header is always in second LBA, slice entries in third
-		# if you run out of slice entries with a 64KB LBA, oy vey!
-		buf = file.read(1<<17+1<<16)
-
 		try:
-			gpt = GPT(buf)
+			gpt = GPT.fromFile(file)
 			gpt.display()
-		except NoGPT:
-			print(NoGPT, file=sys.stderr)
+		except NoGPT as err:
+			print(err, file=sys.stderr)
 
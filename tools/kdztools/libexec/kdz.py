@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 """
 Copyright (C) 2016 Elliott Mitchell <ehem+android@m5p.com>
@@ -20,10 +20,21 @@ Copyright (C) 2013 IOMonster (thecubed on XDA)
 
 from __future__ import absolute_import
 from __future__ import print_function
+import io
 import sys
-from struct import Struct
+import mmap
+from binascii import b2a_hex
+from struct import Struct, error as StructError
 from collections import OrderedDict
 import dz
+from fileio import preadinto, copyRange, TruncatedFile
+
+
+class KDZError(Exception):
+	def __init__(self, errmsg):
+		self.errmsg = errmsg
+	def __str__(self):
+		return self.errmsg
 
 
 class KDZFile(dz.DZStruct):
@@ -54,3 +65,256 @@ class KDZFile(dz.DZStruct):
 		"""
 		super(KDZFile, self).__init__(KDZFile)
 
+
+
+class KDZMemberFile(io.RawIOBase):
+	"""
+	Read-only seekable view of a file embedded in a KDZ, reads go straight
+	to the KDZ so the member never needs to be copied out
+	"""
+
+	def __init__(self, infile, offset, length):
+		"""
+		View length bytes of the open file infile, starting at offset
+		"""
+		super(KDZMemberFile, self).__init__()
+
+		# Keep a reference so the descriptor stays open
+		self.infile = infile
+		self.fd = infile.fileno()
+		self.offset = offset
+		self.length = length
+		self.pos = 0
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def readinto(self, b):
+		count = max(0, min(len(b), self.length - self.pos))
+		if count == 0:
+			return 0
+
+		count = preadinto(self.fd, memoryview(b)[:count], self.offset + self.pos)
+		self.pos += count
+		return count
+
+	def seek(self, pos, whence=io.SEEK_SET):
+		if whence == io.SEEK_CUR:
+			pos += self.pos
+		elif whence == io.SEEK_END:
+			pos += self.length
+		if pos < 0:
+			raise ValueError("negative seek position {:d}".format(pos))
+		self.pos = pos
+		return self.pos
+
+	def tell(self):
+		return self.pos
+
+
+
+class KDZMember(object):
+	"""
+	A file embedded in a KDZ
+	"""
+
+	def __init__(self, kdz, index, name, length, offset):
+		"""
+		Record where in kdz the file is, index is its place in the headers
+		"""
+
+		self.kdz = kdz
+		self.index = index
+		self.name = name
+		self.length = length
+		self.offset = offset
+
+	def open(self):
+		"""
+		Returns a seekable file object reading the member in place
+		"""
+		return io.BufferedReader(KDZMemberFile(self.kdz.infile, self.offset, self.length))
+
+	def extract_to(self, path):
+		"""
+		Copies the member to the file path, safe to call from several threads
+		"""
+		with io.open(path, "wb") as outfile:
+			try:
+				copyRange(self.kdz.infile.fileno(), outfile, self.offset, self.length)
+			except TruncatedFile:
+				raise KDZError("KDZ file is truncated")
+
+
+
+class KDZ(KDZFile):
+	"""
+	A KDZ file opened for reading; holds no state besides what was parsed
+	from the file, so one instance can be shared between threads
+	"""
+
+	kdz_header = {
+          b"\x28\x05\x00\x00"b"\x34\x31\x25\x80":	0,
+          b"\x18\x05\x00\x00"b"\x32\x79\x44\x50":	1,
+          KDZFile._dz_header:			2,
+	}
+
+	# Compared against when checking the gap after the headers
+	zeroBlock = bytes(1<<16)
+
+
+	@classmethod
+	def open(cls, path):
+		"""
+		Open the KDZ file path and parse its header table
+		"""
+		return cls(path)
+
+	def readHeader(self, offset):
+		"""
+		Reads the KDZ header at offset of the mapping, and returns a single
+		kdz_item record in the form as defined by self._dz_format_dict
+		"""
+
+		if offset + self._dz_length > self.length:
+			raise KDZError("KDZ header table is truncated")
+
+		# "Make the item"
+		# Decode the mapped header with the precompiled format, collapsing
+		# (truncating) the collapsible strings as it goes
+		try:
+			kdz_item = self.unpackrecord(self.map, offset)
+		except ValueError as err:
+			raise KDZError(str(err))
+
+		return kdz_item
+
+	def loadMembers(self):
+		"""
+		Returns the list of files embedded in the KDZ
+		"""
+
+		# Setup initial values
+		members = []
+		last = False
+		cont = not last
+		self.dataStart = 1<<63
+		offset = len(self._dz_header)
+
+		while cont:
+
+			# Read the current KDZ header
+			kdz_sub = self.readHeader(offset)
+			offset += self._dz_length
+
+			# Add it to our list
+			members.append(KDZMember(self, len(members), kdz_sub.name, kdz_sub.length, kdz_sub.offset))
+
+			# Update start of data, if needed
+			if kdz_sub.offset < self.dataStart:
+				self.dataStart = kdz_sub.offset
+
+			# Was it the last one?
+			cont = not last
+
+			# Check for end of headers
+			nextchar = self.map[offset:offset+1]
+			# Is this the last KDZ header? (ctrl-C, how appropos)
+			if nextchar == b'\x03':
+				last = True
+				offset += 1
+			# Alternative, immediate end
+			elif nextchar == b'\x00':
+				cont = False
+				offset += 1
+
+		# Record where headers end
+		self.headerEnd = offset
+
+		# Paranoia check for an updated file format
+		self.hasExtra = not self.isZero(self.headerEnd, self.dataStart - 1)
+
+		return members
+
+	def isZero(self, start, end):
+		"""
+		Checks whether [start, end) of the mapping is all zeroes, comparing
+		views against a zero block rather than copying the area out
+		"""
+
+		zeros = memoryview(self.zeroBlock)
+		view = memoryview(self.map)
+		try:
+			while start < end:
+				count = min(end - start, len(zeros))
+				if view[start:start+count] != zeros[:count]:
+					return False
+				start += count
+		finally:
+			view.release()
+		return True
+
+	def extract_extra(self, path):
+		"""
+		Save the extra data between headers&files to the file path
+		"""
+
+		# Straight from the mapping used for parsing the headers
+		view = memoryview(self.map)
+		try:
+			with io.open(path, "wb") as extra:
+				extra.write(view[self.headerEnd:self.dataStart])
+		finally:
+			view.release()
+
+	def close(self):
+		self.map.close()
+		self.infile.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __init__(self, path):
+		"""
+		Opens the file and loads the list of embedded files
+		"""
+
+		super(KDZ, self).__init__()
+
+		self.path = path
+
+		try:
+			self.infile = io.open(path, "rb")
+		except IOError as err:
+			raise KDZError(str(err))
+
+		self.map = None
+		try:
+			# Get length of whole file
+			self.length = self.infile.seek(0, io.SEEK_END)
+			self.infile.seek(0, io.SEEK_SET)
+
+			# Verify KDZ header
+			verify_header = self.infile.read(8)
+
+			if verify_header not in self.kdz_header:
+				raise KDZError('Unsupported KDZ file format (header "{:s}")'.format(b2a_hex(verify_header).decode("utf8")))
+
+			self.header_type = self.kdz_header[verify_header]
+
+			# The header table is parsed straight out of the page cache
+			self.map = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+			self.members = self.loadMembers()
+		except (KDZError, ValueError, StructError, OSError):
+			if self.map is not None:
+				self.map.close()
+			self.infile.close()
+			raise
+
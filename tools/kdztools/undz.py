@@ -18,8 +18,6 @@ Copyright (C) 2013 IOMonster (thecubed on XDA)
         along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from __future__ import absolute_import
-from __future__ import print_function
 import os
 import sys
 import io
@@ -27,14 +25,36 @@ import zlib
 import zstandard as zstd
 import argparse
 import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from struct import Struct
+from concurrent.futures import ThreadPoolExecutor
 from binascii import crc32, b2a_hex
 from uuid import UUID
 
-# our tools are in "libexec"
-sys.path.append(os.path.join(sys.path[0], "libexec"))
+# our tools are in "libexec", next to us even when imported as a library
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "libexec"))
 
 import dz
 import gpt
+import kdz
+import fileio
+
+
+class DZError(Exception):
+        """
+        Raised for DZ files which can't be read, or don't match their hashes
+        """
+
+        def __init__(self, errmsg):
+                super(DZError, self).__init__(errmsg)
+                self.errmsg = errmsg
+
+        def __str__(self):
+                return self.errmsg
 
 
 class UNDZUtils(object):
@@ -46,7 +66,7 @@ class UNDZUtils(object):
         def loadHeader(self, file):
                 """
                 Loads a structured header, does common processing and returns
-                dictionary with data (buffer stored as "buffer")
+                a record with the data (buffer stored as "buffer")
                 """
 
                 # Read the header structure
@@ -54,50 +74,117 @@ class UNDZUtils(object):
 
 
                 # "Make the item"
-                # Create a new dict using the keys from the format string
-                # and the format string itself
-                # and apply the format to the buffer
-                dz_item = self.unpackdict(buffer)
+                # Decode the buffer with the precompiled format, collapsing
+                # (truncating) the collapsible strings as it goes
+                try:
+                        dz_item = self.unpackrecord(buffer)
+                except ValueError as err:
+                        raise DZError(str(err))
 
 
                 # Verify DZ area header
                 if dz_item == None:
-                        print("[!] Bad DZ {:s} header!".format(self._dz_area), file=sys.stderr)
-                        sys.exit(1)
-
+                        raise DZError("Bad DZ {:s} header!".format(self._dz_area))
 
-                # some paths want to take a look at the raw data
-                dz_item['buffer'] = buffer
-
-
-                # Collapse (truncate) each key's value if it's listed as collapsible
-                for key in self._dz_collapsibles:
-                        if type(dz_item[key]) is str or type(dz_item[key]) is bytes:
-                                dz_item[key] = dz_item[key].rstrip(b'\x00')
-                                if b'\x00' in dz_item[key]:
-                                        print("[!] Warning: extraneous data found IN "+key, file=sys.stderr)
-                                        #sys.exit(1)
-                        elif type(dz_item[key]) is int:
-                                if dz_item[key] != 0:
-                                        print('[!] Error: Value supposed to be zero in field "'+key+'" is non-zero ('+hex(dz_item[key])+')', file=sys.stderr)
-                                        sys.exit(1)
-                        else:
-                                print("[!] Error: internal error", file=sys.stderr)
-                                sys.exit(-1)
 
                 # To my knowledge this is supposed to be blank (for now...)
-                if len(dz_item['pad']) != 0:
+                if len(dz_item.pad) != 0:
                         print("[!] Warning: pad is not empty", file=sys.stderr)
 
                 return dz_item
 
 
 
+def pwriteAll(fd, buf, offset):
+        """
+        pwrite() all of buf to fd at offset, returns the bytes written
+        """
+        view = memoryview(buf)
+        while len(view):
+                count = os.pwrite(fd, view, offset)
+                offset += count
+                view = view[count:]
+        return len(buf)
+
+
+
+class UNDZCache(object):
+        """
+        Cache of decompressed chunk payloads, bounded by limit bytes in
+        total; the least recently used ones are dropped to make room
+        """
+
+        def get(self, key, count=True):
+                """
+                Return the payload cached under key, None if absent; only
+                lookups with count are taken as misses
+                """
+                with self.lock:
+                        buf = self.entries.get(key)
+                        if buf is None:
+                                self.misses += count
+                                return None
+                        self.entries.move_to_end(key)
+                        self.hits += 1
+                        self.saved += len(buf)
+                        return buf
+
+        def put(self, key, buf):
+                """
+                Store the payload buf under key
+                """
+                if len(buf) > self.entryLimit:
+                        return
+                with self.lock:
+                        if key in self.entries:
+                                return
+                        self.entries[key] = buf
+                        self.size += len(buf)
+                        while self.size > self.limit:
+                                old = self.entries.popitem(last=False)[1]
+                                self.size -= len(old)
+
+        def display(self, file=sys.stderr):
+                """
+                Report how well the cache did
+                """
+                print("[ ] Chunk cache: {:d} hits ({:d} bytes not decompressed again), {:d} misses".format(self.hits, self.saved, self.misses), file=file)
+
+        def __init__(self, limit):
+                """
+                Initialize an empty cache holding at most limit bytes
+                """
+
+                self.limit = limit
+                # Larger payloads are streamed, never cached
+                self.entryLimit = limit >> 2
+                self.size = 0
+                self.entries = OrderedDict()
+                self.lock = threading.Lock()
+
+                # Instrumentation
+                self.hits = 0
+                self.misses = 0
+                self.saved = 0
+
+
+
 class UNDZChunk(dz.DZChunk, UNDZUtils):
         """
         Representation of an individual file chunk from a LGE DZ file
         """
 
+        # Compressed bytes read, and most bytes produced, per step while
+        # decompressing
+        readSize = 1<<20
+        writeSize = 1<<20
+
+        # Granularity of hole detection in sparse output, and the zeroes
+        # compared against
+        sparseBlock = 4096
+        zeroBlock = bytes(writeSize)
+        zeroSparseBlock = bytes(sparseBlock)
+
 
         def getChunkName(self):
                 """
@@ -170,85 +257,125 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
                 Display information about our chunk
                 """
                 
-                if cmd.batchMode:
+                if self.dz.batchMode:
                     print("{:d}:{:s}:data".format(sliceIdx,self.sliceName.decode("utf8")))
                 else:
                     print("{:2d}/{:2d} : {:s} ({:d} bytes)".format(sliceIdx, selfIdx, self.chunkName.decode("utf8"), self.dataSize))
                 self.Messages()
                 return ++selfIdx
 
-        def extract(self):
+        def openData(self):
+                """
+                Return a file object over our compressed data, reading the
+                DZ positionally so it doesn't disturb other users of it
                 """
-                Extracts our payload from the compressed DZ file using ZLIB.
-                self function could be particularly memory-intensive when used
-                with large chunks, as the entire compressed chunk is loaded
-                into RAM and decompressed.
+                return kdz.KDZMemberFile(self.dz.rawfile, self.dz.base + self.dataOffset, self.dataSize)
 
-                A better way to do self would be to chunk the zlib compressed
-                data and decompress it with zlib.decompressor() and a while
-                loop.
+        def zlibPieces(self, zdata):
+                """
+                Generator for the zlib stream in zdata, limiting each piece of
+                output to writeSize bytes
+                """
+                dobj = zlib.decompressobj()
+                while not dobj.eof:
+                        data = dobj.unconsumed_tail
+                        if not data:
+                                data = zdata.read(self.readSize)
+                                if not data:
+                                        break
+                        yield dobj.decompress(data, self.writeSize)
+                yield dobj.flush()
 
-                I'm lazy though, and y'all have fast computers, so self is good
-                enough.
+        def decompress(self, result=None, cache=False):
+                """
+                Generator decompressing our payload from the DZ file in pieces
+                of at most writeSize bytes, so memory use stays bounded no
+                matter how large the chunk is.  The MD5 is checked once the
+                whole payload went through; if a result dict is passed, the
+                outcome of the MD5 and CRC32 checks is stored there instead.
+                With cache, the payload is kept for callers parsing it again
+                (the GPT); everything else is only ever streamed.
 
                 Starting with G7 KDZs, LG switched to zstandard compression.
                 To keep comparibility with older KDZs, we are going to compare
-                the compression header to the standard zlib header. If there, we 
+                the compression header to the standard zlib header. If there, we
                 use zlib .. if not, we use zstandard.
                 """
 
-                # Seek to the beginning of the compressed data in the specified partition
-                self.dz.dzfile.seek(self.dataOffset, io.SEEK_SET)
+                # Payloads someone asked to cache are reused, checks always
+                # decompress again
+                cacheable = cache and self.targetSize <= self.dz.cache.entryLimit and result is None
+                if result is None:
+                        buf = self.dz.cache.get(self.dataOffset, cacheable)
+                        if buf is not None:
+                                view = memoryview(buf)
+                                for pos in range(0, len(buf), self.writeSize):
+                                        yield view[pos:pos+self.writeSize]
+                                return
+                if cacheable:
+                        parts = []
+
+                zdata = self.openData()
 
                 zlib_magic = {'zlib': bytes([0x78, 0x01])}
-                cmp_header = self.dz.dzfile.read(2)
+                cmp_header = zdata.read(2)
 
                 # Reset to the beginning of the compressed data
-                self.dz.dzfile.seek(self.dataOffset, io.SEEK_SET)
-
-                # Read the whole compressed segment into RAM
-                zdata = self.dz.dzfile.read(self.dataSize)
+                zdata.seek(0, io.SEEK_SET)
 
                 if cmp_header.startswith(zlib_magic['zlib']):
 
                     # Decompress the data with zlib
-                    buf = zlib.decompress(zdata)
+                    pieces = self.zlibPieces(zdata)
 
                 else:
                     # decompress with zstandard
                     dctx = zstd.ZstdDecompressor()
-                    buf = dctx.decompress(zdata, max_output_size=200000000)
-    
-                crc = crc32(buf) & 0xFFFFFFFF
+                    pieces = dctx.read_to_iter(zdata, read_size=self.readSize, write_size=self.writeSize)
+
+                md5 = hashlib.md5()
+                crc = 0
+
+                # Callers only ever see DZError, whichever the compression
+                try:
+                    for buf in pieces:
+                        md5.update(buf)
+                        crc = crc32(buf, crc)
+                        if cacheable:
+                            parts.append(buf)
+                        yield buf
+                except (zlib.error, zstd.ZstdError) as err:
+                    raise DZError("Corrupt data in chunk {:s}: {:s}".format(self.getChunkName(), str(err)))
+
+                crc &= 0xFFFFFFFF
+
+                if result is not None:
+                        result['md5'] = md5.digest() == self.md5
+                        result['crc32'] = crc == self.crc32
+                        return
 
                 #if crc != self.crc32:
         ##              print("[!] Error: CRC32 of data doesn't match header ({:08X} vs {:08X})".format(crc, self.crc32), file=sys.stderr)
         #               sys.exit(1)
 
-                md5 = hashlib.md5()
-                md5.update(buf)
-
                 if md5.digest() != self.md5:
-                        print("[!] Error: MD5 of data doesn't match header ({:32s} vs {:32s})".format(md5.hexdigest(), b2a_hex(self.md5)), file=sys.stderr)
-                        sys.exit(1)
+                        raise DZError("MD5 of data doesn't match header ({:32s} vs {:32s})".format(md5.hexdigest(), b2a_hex(self.md5).decode("utf8")))
 
-                return buf
+                if cacheable:
+                        self.dz.cache.put(self.dataOffset, b"".join(parts))
 
-        def extractChunk(self, file, name):
+        def extract(self, cache=False):
+                """
+                Extracts our whole payload into RAM, only meant for small
+                chunks (like the GPT), use decompress() for the rest
                 """
-                Extract the payload of our chunk into the file with the name
-
-                Extracts our payload from the compressed DZ file using ZLIB.
-                self function could be particularly memory-intensive when used
-                with large chunks, as the entire compressed chunk is loaded
-                into RAM and decompressed.
 
-                A better way to do self would be to chunk the zlib compressed
-                data and decompress it with zlib.decompressor() and a while
-                loop.
+                return b"".join(self.decompress(cache=cache))
 
-                I'm lazy though, and y'all have fast computers, so self is good
-                enough.
+        def extractChunk(self, file, name):
+                """
+                Extract the payload of our chunk into the file with the name,
+                streaming it so only a piece is held in memory at a time
                 """
 
                 if name:
@@ -267,11 +394,89 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
                         file.truncate(current + (self.trimCount<<self.dz.shiftLBA))
 
                 # Write it to file
-                file.write(self.extract())
+                for buf in self.decompress():
+                        file.write(buf)
 
                 # Print our messages
                 self.Messages()
 
+        def verify(self):
+                """
+                Decompress our payload without writing it anywhere, returns a
+                dict with the results of the MD5 and CRC32 checks, the amount
+                of data produced and the time taken
+                """
+
+                result = {'md5': False, 'crc32': False, 'size': 0, 'error': None}
+                begin = time.monotonic()
+
+                try:
+                        for buf in self.decompress(result):
+                                result['size'] += len(buf)
+                except DZError as err:
+                        result['error'] = str(err)
+
+                result['time'] = time.monotonic() - begin
+                return result
+
+        def writeAt(self, fd, offset, sparse=False, skip=0, length=None):
+                """
+                Decompress our payload into the file descriptor fd at offset
+                using pwrite(), leaving the file position alone so several
+                chunks can be written concurrently.  A negative offset drops
+                that many bytes from the front of our payload, as does skip,
+                and no more than length bytes are written.  With sparse,
+                all-zero blocks are skipped, leaving holes behind.
+                Returns the number of bytes actually written.
+                """
+
+                skip += max(-offset, 0)
+                offset = max(offset, 0)
+                written = 0
+
+                for buf in self.decompress():
+                        if skip:
+                                if skip >= len(buf):
+                                        skip -= len(buf)
+                                        continue
+                                buf = buf[skip:]
+                                skip = 0
+
+                        # Still decompress the rest so the MD5 gets checked
+                        if length is not None:
+                                buf = buf[:length]
+                                length -= len(buf)
+                                if len(buf) == 0:
+                                        continue
+
+                        if not sparse:
+                                written += pwriteAll(fd, buf, offset)
+                                offset += len(buf)
+                                continue
+
+                        # startswith() is a memcmp() against the zeroes and
+                        # takes views, comparing memoryviews goes per element
+                        view = memoryview(buf)
+                        if self.zeroBlock.startswith(view):
+                                offset += len(view)
+                                continue
+
+                        # Write out each run of blocks holding data
+                        run = None
+                        block = self.sparseBlock
+                        for pos in range(0, len(view), block):
+                                if self.zeroSparseBlock.startswith(view[pos:pos+block]):
+                                        if run is not None:
+                                                written += pwriteAll(fd, view[run:pos], offset + run)
+                                                run = None
+                                elif run is None:
+                                        run = pos
+                        if run is not None:
+                                written += pwriteAll(fd, view[run:], offset + run)
+                        offset += len(view)
+
+                return written
+
         def extractChunkfile(self, file, name):
                 """
                 Extract the raw data of our chunk into the file with the name
@@ -286,9 +491,31 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
                 # Print our messages
                 self.Messages()
 
-        def __init__(self, dz, file):
+        # Fields saved in the chunk index, bytes ones get hex encoded
+        _index_fields = ['sliceName', 'chunkName', 'targetAddr', 'targetSize', 'dataSize', 'md5', 'trimCount', 'crc32', 'dev', 'dataOffset', 'messages']
+
+        def getIndexEntry(self):
                 """
-                Loads the DZ header in the form as defined by self._dz_chunk_dict
+                Return what needs saving to recreate us without the DZ header
+                """
+                entry = {}
+                for key in self._index_fields:
+                        value = getattr(self, key)
+                        entry[key] = b2a_hex(value).decode("utf8") if type(value) is bytes else value
+                return entry
+
+        def loadIndexEntry(self, entry):
+                """
+                Load our values from an entry made by getIndexEntry()
+                """
+                for key in self._index_fields:
+                        value = entry[key]
+                        setattr(self, key, bytes.fromhex(value) if key in ('sliceName', 'chunkName', 'md5') else value)
+
+        def __init__(self, dz, file, entry=None):
+                """
+                Loads the DZ header in the form as defined by self._dz_chunk_dict,
+                or from a chunk index entry if one is given
                 """
 
                 super(UNDZChunk, self).__init__()
@@ -296,6 +523,10 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
                 # Save a pointer to the UNDZFile
                 self.dz = dz
 
+                if entry is not None:
+                        self.loadIndexEntry(entry)
+                        return
+
                 # Load the header, does common checking
                 dz_item = self.loadHeader(file)
 
@@ -307,32 +538,32 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
                 self.dataOffset = file.tell()
 
                 # Add ourselves to the hashes for checking
-                dz.md5Headers.update(dz_item['buffer'])
+                dz.md5Headers.update(dz_item.buffer)
 
 ### experiment, results negative
-#               dz.sha1Headers.update(dz_item['buffer'])
+#               dz.sha1Headers.update(dz_item.buffer)
 #
-#               dz.crcHeaders = crc32(dz_item['buffer'], dz.crcHeaders)
+#               dz.crcHeaders = crc32(dz_item.buffer, dz.crcHeaders)
 #
-#               dz.md5HeaderNZ.update(dz_item['buffer'][0:-len(dz_item['pad'])])
-#               dz.crcHeaderNZ=crc32(dz_item['buffer'][0:-len(dz_item['pad'])], dz.crcHeaders)
+#               dz.md5HeaderNZ.update(dz_item.buffer[0:-len(dz_item.pad)])
+#               dz.crcHeaderNZ=crc32(dz_item.buffer[0:-len(dz_item.pad)], dz.crcHeaders)
 ### experiment, results negative
 
 
                 #
-                if dz_item['targetSize']&0x1FF != 0:
-                        self.messages.append("[?] Warning: uncompressed size is {:d}, not a multiple of 512 (please report!)".format(dz_item['targetSize']))
+                if dz_item.targetSize&0x1FF != 0:
+                        self.messages.append("[?] Warning: uncompressed size is {:d}, not a multiple of 512 (please report!)".format(dz_item.targetSize))
 
                 # Save off all the important data
-                self.sliceName  = dz_item['sliceName']
-                self.chunkName  = dz_item['chunkName']
-                self.targetAddr = dz_item['targetAddr']
-                self.targetSize = dz_item['targetSize']
-                self.dataSize   = dz_item['dataSize']
-                self.md5        = dz_item['md5']
-                self.trimCount  = dz_item['trimCount']
-                self.crc32      = dz_item['crc32']
-                self.dev        = dz_item['dev']
+                self.sliceName  = dz_item.sliceName
+                self.chunkName  = dz_item.chunkName
+                self.targetAddr = dz_item.targetAddr
+                self.targetSize = dz_item.targetSize
+                self.dataSize   = dz_item.dataSize
+                self.md5        = dz_item.md5
+                self.trimCount  = dz_item.trimCount
+                self.crc32      = dz_item.crc32
+                self.dev        = dz_item.dev
 
                 # The use of these non-.bin chunks is unknown
                 if self.chunkName[-4:] == b".img":
@@ -399,7 +630,7 @@ class UNDZSlice(object):
                         if not self.index:
                                 chunkIdx = None
                                 sliceIdx = -1
-                        if cmd.batchMode:
+                        if self.dz.batchMode:
                             print("{:2d}:{:s}:empty".format(sliceIdx,self.name))
                             # elif sliceIdx != -1:
                         else:
@@ -441,30 +672,21 @@ class UNDZSlice(object):
                 start = self.getStart()
                 end = self.getEnd()
 
-                for chunk in self.chunks:
-                        cur = chunk.getTargetStart()
-                        # Mostly happens for the backup GPT (large pad at start)
-                        if cur < start:
-                                # this ensures messages from extraction show up
-                                chunk.extractChunk(file, name)
-                                file.seek(0, io.SEEK_SET)
-                                file.truncate(0)
-                                # in case the long buffer was reeeally looong
-
-                                buf = chunk.extract()
-                                file.write(buf[cur-start:])
-                        else:
-                                file.seek(cur-start, io.SEEK_SET)
-                                chunk.extractChunk(file, name)
+                # Chunks starting in front of the slice mostly happen for the
+                # backup GPT (large pad at start), they are cut to fit
+                if self.dz.sparseImage:
+                        self.dz.writeSparseImage(file, name, self.chunks, start, max(self.getLength(), 0))
+                else:
+                        self.dz.writeChunks(file, name, self.chunks, start)
 
-                # it is possible for chunks wipe area to extend beyond slice
-                if self.getLength() >= 0:
-                        file.truncate(self.getLength())
+                        # it is possible for chunks wipe area to extend beyond slice
+                        if self.getLength() >= 0:
+                                file.truncate(self.getLength())
 
 
                 # write a params file for saving values used during recreate
                 params = io.open(name + ".params", "wt")
-                params.write(u'# saved parameters for the file "{:s}"\n'.format(name))
+                params.write(u'# saved parameters for the file "{:s}"\n'.format(os.path.basename(name)))
                 params.write(u"startLBA={:d}\n".format(start >> self.dz.shiftLBA))
                 params.write(u"startAddr={:d}\n".format(start))
                 params.write(u"endLBA={:d}\n".format(end >> self.dz.shiftLBA))
@@ -486,6 +708,20 @@ class UNDZSlice(object):
 
                 params.close()
 
+        def extract(self, dest):
+                """
+                Extract the slice to the path dest, or to name.image inside it
+                if dest is a directory.  Returns the path written.
+                """
+
+                if os.path.isdir(dest):
+                        dest = os.path.join(dest, self.name + ".image")
+
+                with io.FileIO(dest, "wb") as file:
+                        self.extractSlice(file, dest)
+
+                return dest
+
         def __init__(self, dz, index, name, start=0x7FFFFFFFFFFFFFFF, end=0):
                 """
                 Initialize the instance of UNDZSlice class
@@ -510,8 +746,42 @@ class UNDZFile(dz.DZFile, UNDZUtils):
         Representation of the data parsed from a LGE DZ file
         """
 
+        # Bytes of decompressed chunks kept around for reuse
+        cacheSize = 64<<20
+
+        # Bumped whenever the chunk index layout changes
+        indexVersion = 1
+
+        # Android sparse image format (see libsparse's sparse_format.h)
+        _simg_header = Struct("<IHHHHIIII")
+        _simg_chunk = Struct("<HHII")
+        _simg_magic = 0xED26FF3A
+        _simg_raw = 0xCAC1
+        _simg_dont_care = 0xCAC3
+
+        # Block size of sparse images, if the chunks line up with it
+        simgBlock = 4096
+
+
+        def openKDZ(self, name):
+                """
+                Open the DZ embedded in the KDZ file name, without copying it
+                """
+
+                try:
+                        self.kdz = kdz.KDZ.open(name)
+                except kdz.KDZError as err:
+                        raise DZError(str(err))
+
+                for member in self.kdz.members:
+                        if member.name.endswith(b".dz"):
+                                self.rawfile = self.kdz.infile
+                                self.base = member.offset
+                                return member.open()
+
+                raise DZError("No DZ file found inside KDZ")
 
-        def open(self, name):
+        def openFile(self, name):
                 """
                 What do you expect? Open file and check the header
                 """
@@ -520,8 +790,16 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                 try:
                         self.dzfile = io.open(name, "rb")
                 except IOError as err:
-                        print(err, file=sys.stderr)
-                        sys.exit(1)
+                        raise DZError(str(err))
+
+                # Chunk payloads are read positionally from here
+                self.rawfile = self.dzfile
+                self.base = 0
+
+                # A KDZ is read in place, through the DZ embedded in it
+                if self.dzfile.read(8) in kdz.KDZ.kdz_header:
+                        self.dzfile.close()
+                        self.dzfile = self.openKDZ(name)
 
                 # Get length of whole file
                 self.length = self.dzfile.seek(0, io.SEEK_END)
@@ -532,55 +810,54 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                 dz_file = self.loadHeader(self.dzfile)
 
                 # Save the full header for rebuilding the file later
-                self.header = dz_file['buffer']
-
-                #print(dz_file['version'])
-                #print(dz_file['buildType'])
-                #print(dz_file['oldDateCode'])
-                #print(dz_file['chunkCount'])
-                #print(dz_file['md5'])
-                #print(dz_file['unknown0'])
-                #print(dz_file['reserved1'])
-                #print(dz_file['reserved4'])
-                #print(dz_file['unknown1'])
-                #print(dz_file['unknown2'])
+                self.header = dz_file.buffer
+
+                #print(dz_file.version)
+                #print(dz_file.buildType)
+                #print(dz_file.oldDateCode)
+                #print(dz_file.chunkCount)
+                #print(dz_file.md5)
+                #print(dz_file.unknown0)
+                #print(dz_file.reserved1)
+                #print(dz_file.reserved4)
+                #print(dz_file.unknown1)
+                #print(dz_file.unknown2)
                 #print(self.header)
 
                 # Appears to be version numbers for the format
-                if dz_file['formatMajor'] > 2:
-                        print("[!] Error: DZ format version too high! (please report)", file=sys.stderr)
-                        sys.exit(1)
-                elif dz_file['formatMinor'] > 1:
+                if dz_file.formatMajor > 2:
+                        raise DZError("DZ format version too high! (please report)")
+                elif dz_file.formatMinor > 1:
                         print("[!] Warning: DZ format more recent than previous versions, output unreliable", file=sys.stderr)
 
 
-                self.chunkCount = dz_file['chunkCount']
+                self.chunkCount = dz_file.chunkCount
 
                 # save this for creating modified files later
                 # (ro.lge.factoryversion)
-                self.ro_lge_factoryversion = dz_file['version']
+                self.ro_lge_factoryversion = dz_file.version
 
-                self.formatMajor = dz_file['formatMajor']
-                self.formatMinor = dz_file['formatMinor']
+                self.formatMajor = dz_file.formatMajor
+                self.formatMinor = dz_file.formatMinor
 
                 # currently only "user" has been seen in wild
-                self.buildType = dz_file['buildType']
+                self.buildType = dz_file.buildType
 
                 # save this for consistency checking
-                self.md5 = dz_file['md5']
+                self.md5 = dz_file.md5
 
                 # save these for later analysis
-                self.unknown0 = dz_file['unknown0']
-                self.unknown1 = dz_file['unknown1']
-                self.unknown2 = dz_file['unknown2']
-                self.unknown3 = dz_file['unknown3']
+                self.unknown0 = dz_file.unknown0
+                self.unknown1 = dz_file.unknown1
+                self.unknown2 = dz_file.unknown2
+                self.unknown3 = dz_file.unknown3
 
                 # save for reportting and possibly reconstruction later
-                self.old_date_code = dz_file['oldDateCode']
-                self.device = dz_file['device']
-                self.android_version = dz_file['androidVer']
-                self.unknown4 = dz_file['unknown4']
-                self.unknown5 = dz_file['unknown5']
+                self.old_date_code = dz_file.oldDateCode
+                self.device = dz_file.device
+                self.android_version = dz_file.androidVer
+                self.unknown4 = dz_file.unknown4
+                self.unknown5 = dz_file.unknown5
 
 
         def loadChunks(self):
@@ -630,7 +907,7 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 
                 try:
                         emptycount = 0
-                        g = gpt.GPT(self.chunks[0].extract())
+                        g = gpt.GPT(self.chunks[0].extract(cache=True))
                         ordered = range(len(g.slices)) if g.ordered else range(len(g.slices)).sort(key=lambda s: g.slices[s].startLBA)
 
                         self.shiftLBA = g.shiftLBA
@@ -674,25 +951,124 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                         print("[!] Unable to find GPT in DZ file: {:s}".format(err))
                         pass
 
+                # A damaged first chunk is only reported when checking
+                except DZError as err:
+                        if self.strict:
+                                raise
+                        print("[!] Unable to read GPT from DZ file: {:s}".format(str(err)), file=sys.stderr)
+
+                self.headerDigest = self.md5Headers.digest()
+
+                # Remember the slices from the GPT for the chunk index
+                self.gptSlices = [(s.index, s.name, s.start, s.end, self.sliceIdx.get(s.name) is s) for s in self.slices]
+
+                for chunk in self.chunks:
+                        self.addChunk(chunk)
+
+        def getIndexPath(self):
+                """
+                Return where the chunk index for our file is kept and the
+                identity of the file, which must match for the index to be used
+                """
+
+                stat = os.fstat(self.rawfile.fileno())
+                identity = {
+                        'path': os.path.realpath(self.name),
+                        'dev': stat.st_dev,
+                        'ino': stat.st_ino,
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime_ns,
+                        'base': self.base,
+                        'length': self.length,
+                }
+                key = hashlib.sha1(json.dumps(identity, sort_keys=True).encode("utf8")).hexdigest()
+                cache = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+                return os.path.join(cache, "kdztools", key + ".json"), identity
+
+        def loadIndex(self):
+                """
+                Load chunks, slices and GPT data from the index saved by an
+                earlier run, returns False if there is no valid one
+                """
+
+                path, identity = self.getIndexPath()
+                try:
+                        with io.open(path, "rt") as f:
+                                index = json.load(f)
+
+                        if index['version'] != self.indexVersion or index['identity'] != identity:
+                                return False
+
+                        shiftLBA = index['shiftLBA']
+                        headerDigest = bytes.fromhex(index['headerDigest'])
+                        chunks = [UNDZChunk(self, None, entry) for entry in index['chunks']]
+                        gptSlices = [tuple(s) for s in index['slices']]
+                        slices = [(UNDZSlice(self, idx, name, start, end), named) for idx, name, start, end, named in gptSlices]
+
+                # Anything not shaped like one of our indexes is no index
+                except (IOError, ValueError, KeyError, TypeError):
+                        return False
+
+                self.shiftLBA = shiftLBA
+                self.headerDigest = headerDigest
+                self.chunks = chunks
+                self.gptSlices = gptSlices
+                for slice, named in slices:
+                        self.slices.append(slice)
+                        if named:
+                                self.sliceIdx[slice.getSliceName()] = slice
+
                 for chunk in self.chunks:
                         self.addChunk(chunk)
 
+                return True
+
+        def saveIndex(self):
+                """
+                Save what loadChunks() found, so the next open can skip it
+                """
+
+                path, identity = self.getIndexPath()
+                index = {
+                        'version': self.indexVersion,
+                        'identity': identity,
+                        'shiftLBA': self.shiftLBA,
+                        'headerDigest': b2a_hex(self.headerDigest).decode("utf8"),
+                        'slices': self.gptSlices,
+                        'chunks': [chunk.getIndexEntry() for chunk in self.chunks],
+                }
+
+                # The index only saves time, failing to write it is harmless
+                try:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        with io.open(path + ".tmp", "wt") as f:
+                                json.dump(index, f)
+                        os.replace(path + ".tmp", path)
+                except OSError:
+                        pass
+
         def checkValues(self):
                 """
                 Check values for consistency with suspected use
                 """
 
                 # This does look like a count of chunks
-                if len(self.chunks) != self.chunkCount:
+                self.countOK = len(self.chunks) == self.chunkCount
+                if not self.countOK:
+                        if self.strict:
+                                raise DZError("chunks in header differs from chunks found (please report)")
                         print("[!] Error: chunks in header differs from chunks found (please report)", file=sys.stderr)
-                        sys.exit(-1)
 
                 # Checking this field for what is expected
-                md5Headers = self.md5Headers.digest()
+                md5Headers = self.headerDigest
 
-                if md5Headers != self.md5:
-                        print("[!] Error: MD5 of chunk headers doesn't match header ({:32s} vs {:32s})".format(self.md5Headers.hexdigest(), b2a_hex(self.md5)), file=sys.stderr)
-                        sys.exit(-1)
+                self.md5OK = md5Headers == self.md5
+                if not self.md5OK:
+                        error = "MD5 of chunk headers doesn't match header ({:32s} vs {:32s})".format(b2a_hex(md5Headers).decode("utf8"), b2a_hex(self.md5).decode("utf8"))
+                        if self.strict:
+                                raise DZError(error)
+                        print("[!] Error: " + error, file=sys.stderr)
 
 
                 # these are speculative, disabled for others
@@ -744,7 +1120,7 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                         slice = self.sliceIdx[name]
                 else:
 # FIXME: what if chunks out of order?
-                        slice = UNDZSlice(self, self.slices[-1].getIndex()+1, name)
+                        slice = UNDZSlice(self, self.slices[-1].getIndex()+1 if self.slices else 0, name)
                         self.slices.append(slice)
                         self.sliceIdx[name] = slice
 
@@ -784,6 +1160,15 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                 """
                 return self.slices[idx]
 
+        def findSlice(self, name):
+                """
+                Return the slice with the given name from the GPT index, or its
+                "_a" slot if there is no plain one, None if neither exists
+                """
+                if name in self.sliceIdx:
+                        return self.sliceIdx[name]
+                return self.sliceIdx.get(name + "_a")
+
         def getChunk(self, idx):
                 """
                 Return the chunk with the given index
@@ -832,16 +1217,155 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                 """
 
                 # the slice extraction has gotten preoccupied with slices
-                for chunk in self.chunks:
-                        file.seek(chunk.getTargetStart(), io.SEEK_SET)
-                        chunk.extractChunk(file, name)
+                self.writeChunks(file, name, self.chunks)
 
+        def writeChunks(self, file, name, chunks, start=0):
+                """
+                Decompress chunks into file, each at its target offset less
+                start, using a pool of jobs workers.  The file ends up as
+                extracting the chunks one after another would have left it.
+                """
 
-        def saveHeader(self, name):
+                size = 0
+                for chunk in chunks:
+                        print("[+] Extracting {:s} to {:s}".format(chunk.chunkName.decode("utf8"), name))
+                        pos = chunk.getTargetStart() - start
+                        if pos < 0:
+                                size = max(pos + chunk.targetSize, 0)
+                        else:
+                                size = pos + max(chunk.trimCount<<self.shiftLBA, chunk.targetSize)
+
+                # Start out with holes for all of the wipe areas
+                file.flush()
+                fd = file.fileno()
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+
+                # Chunks for different devices (UFS LUNs) can cover the same
+                # range, only runs of one device are written at once so the
+                # last in the file still wins
+                written = 0
+                for dev, group in groupby(chunks, lambda chunk: chunk.getDev()):
+                        group = list(group)
+                        written += sum(fileio.runJobs(self.jobs, [(chunk.writeAt, fd, chunk.getTargetStart() - start, self.sparse) for chunk in group], lambda i: group[i].Messages()))
+
+                if self.sparse:
+                        print("[ ] {:s}: {:d} bytes logical, {:d} bytes written, {:d} bytes allocated".format(name, size, written, os.fstat(fd).st_blocks * 512))
+
+
+        def writeSparseImage(self, file, name, chunks, start, length):
+                """
+                Write the length bytes at start covered by chunks into file as
+                an Android sparse image: RAW chunks for the decompressed data,
+                DONT_CARE for the trimmed and unwritten areas.  The layout is
+                known from the chunk headers, so the data of each chunk gets
+                written in place by the pool of jobs workers.
+                """
+
+                # Fall back to LBA sized blocks for chunks not lining up
+                block = self.simgBlock
+                if any((chunk.getTargetStart() - start) % block for chunk in chunks if chunk.getTargetStart() > start) or length % block:
+                        block = 1<<self.shiftLBA
+
+                # Entries are (type, blocks, chunk, skip, size)
+                plan = []
+                pos = 0
+                for chunk in chunks:
+                        print("[+] Extracting {:s} to {:s}".format(chunk.chunkName.decode("utf8"), name))
+                        target = chunk.getTargetStart() - start
+                        begin = max(target, pos)
+                        end = min(target + chunk.targetSize, length)
+                        if end <= begin:
+                                continue
+                        if begin > pos:
+                                plan.append((self._simg_dont_care, (begin - pos) // block, None, 0, 0))
+                        blocks = -(-(end - begin) // block)
+                        plan.append((self._simg_raw, blocks, chunk, begin - target, end - begin))
+                        pos = begin + blocks * block
+                if pos < length:
+                        plan.append((self._simg_dont_care, -(-(length - pos) // block), None, 0, 0))
+
+                # Lay out the headers, the padding of short RAW chunks is a hole
+                file.flush()
+                fd = file.fileno()
+                os.ftruncate(fd, 0)
+
+                pwriteAll(fd, self._simg_header.pack(self._simg_magic, 1, 0, self._simg_header.size, self._simg_chunk.size, block, sum(e[1] for e in plan), len(plan), 0), 0)
+                offset = self._simg_header.size
+                jobs = []
+                for type, blocks, chunk, skip, size in plan:
+                        data = blocks * block if type == self._simg_raw else 0
+                        pwriteAll(fd, self._simg_chunk.pack(type, 0, blocks, self._simg_chunk.size + data), offset)
+                        offset += self._simg_chunk.size
+                        if data:
+                                jobs.append((chunk, offset, skip, size))
+                                offset += data
+                os.ftruncate(fd, offset)
+
+                fileio.runJobs(self.jobs, [(chunk.writeAt, fd, at, self.sparse, skip, size) for chunk, at, skip, size in jobs], lambda i: jobs[i][0].Messages())
+
+                print("[ ] {:s}: sparse image of {:d} blocks of {:d} bytes in {:d} chunks, {:d} bytes".format(name, sum(e[1] for e in plan), block, len(plan), offset))
+
+        def rescan(self):
+                """
+                Walk the chunk headers of the file again, dropping anything
+                that came from the index
                 """
-                Dump the header from the original file into the output dir
+
+                self.slices = []
+                self.sliceIdx = {}
+                self.chunks = []
+                self.md5Headers = hashlib.new("md5")
+                self.fromIndex = False
+
+                self.dzfile.seek(self.chunkStart, io.SEEK_SET)
+                self.loadChunks()
+                self.checkValues()
+
+        def verify(self):
+                """
+                Check every chunk against its MD5 and CRC32 without writing
+                anything, using a pool of jobs workers.  Prints a table of the
+                results and returns whether everything passed.
+                """
+
+                # Checks are against the file itself, never the index
+                if self.fromIndex:
+                        self.rescan()
+
+                begin = time.monotonic()
+                with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+                        results = list(pool.map(lambda chunk: chunk.verify(), self.chunks))
+                elapsed = time.monotonic() - begin
+
+                status = lambda ok: "ok" if ok else "FAIL"
+
+                print("[+] DZ Verification\n=========================================")
+                failed = 0
+                for idx, (chunk, result) in enumerate(zip(self.chunks, results)):
+                        ok = result['md5'] and result['crc32']
+                        if not ok:
+                                failed += 1
+                        rate = result['size'] / result['time'] / (1<<20) if result['time'] > 0 else 0
+                        print("{:4d} : {:40s} {:12d} bytes  MD5 {:4s}  CRC32 {:4s}  {:8.1f} MiB/s".format(idx, chunk.getChunkName(), result['size'], status(result['md5']), status(result['crc32']), rate))
+                        if result['error']:
+                                print("       [!] {:s}".format(result['error']))
+
+                print("[ ] Chunk count: {:s}".format(status(self.countOK)))
+                print("[ ] Header MD5: {:s}".format(status(self.md5OK)))
+
+                compressed = sum(chunk.dataSize for chunk in self.chunks)
+                decompressed = sum(result['size'] for result in results)
+                rate = lambda size: size / elapsed / (1<<20) if elapsed > 0 else 0
+                print("[+] {:d} of {:d} chunks passed in {:.2f}s: {:.1f} MiB/s compressed, {:.1f} MiB/s decompressed".format(len(self.chunks) - failed, len(self.chunks), elapsed, rate(compressed), rate(decompressed)))
+
+                return failed == 0 and self.countOK and self.md5OK
+
+        def saveHeader(self, name, outdir):
                 """
-                params = open(".dz.params", "wt")
+                Dump the header from the original file into outdir
+                """
+                params = io.open(os.path.join(outdir, ".dz.params"), "wt")
                 params.write('# saved parameters from the file "{:s}"\n'.format(name))
                 params.write("format_major={:d}\n".format(self.formatMajor))
                 params.write("format_minor={:d}\n".format(self.formatMinor))
@@ -873,13 +1397,48 @@ class UNDZFile(dz.DZFile, UNDZUtils):
                 params.close()
 
 
-        def __init__(self, name):
+        @classmethod
+        def open(cls, path, **options):
                 """
-                Constructing this class opens the file and loads map of chunks
+                Open the DZ (or KDZ) file path, see __init__() for options
+                """
+                return cls(path, **options)
+
+        def close(self):
+                for file in (self.dzfile, self.rawfile, self.kdz):
+                        if file:
+                                file.close()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *exc):
+                self.close()
+
+        def __init__(self, name, strict=True, useIndex=False, jobs=None, sparse=False, sparseImage=False, batchMode=False):
+                """
+                Constructing this class opens the file and loads map of chunks,
+                inconsistent headers raise DZError unless strict is False.  With
+                useIndex, the map is kept in an index file under
+                $XDG_CACHE_HOME for reuse; verify() never relies on it.
+                Nothing global is touched, so several can be in use at once.
                 """
 
                 super(UNDZFile, self).__init__()
 
+                self.name = name
+
+                self.strict = strict
+
+                # Short listing output, for scripts
+                self.batchMode = batchMode
+
+                # Set when the DZ is read from inside a KDZ
+                self.kdz = None
+                self.dzfile = None
+                self.rawfile = None
+                self.fromIndex = False
+
                 self.slices = []
                 self.sliceIdx = {}
 
@@ -887,6 +1446,18 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 
                 self.messages = set()
 
+                # Number of chunks decompressed at once
+                self.jobs = jobs or os.cpu_count()
+
+                # Leave holes for zero-filled areas of the output
+                self.sparse = sparse
+
+                # Write slices as Android sparse images
+                self.sparseImage = sparseImage
+
+                # Saves decompressing chunks twice, chunk 0 is read for the GPT
+                self.cache = UNDZCache(self.cacheSize)
+
                 # Hash of the headers for consistency checking
                 self.md5Headers = hashlib.new("md5")
 
@@ -908,9 +1479,20 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 #               self.crcAll = crc32(b"")
 #               # try crc32 ?
 
-                self.open(name)
-                self.loadChunks()
-                self.checkValues()
+                try:
+                        self.openFile(name)
+                        self.chunkStart = self.dzfile.tell()
+
+                        # With an index, chunk headers (and the GPT) are only walked on first use
+                        self.fromIndex = useIndex and self.loadIndex()
+                        if not self.fromIndex:
+                                self.loadChunks()
+                                if useIndex:
+                                        self.saveIndex()
+                        self.checkValues()
+                except DZError:
+                        self.close()
+                        raise
 
 
 
@@ -926,20 +1508,25 @@ class DZFileTools:
         def parseArgs(self):
                 # Parse arguments
                 parser = argparse.ArgumentParser(description='LG Compressed DZ File Extractor originally by IOMonster')
-                parser.add_argument('-f', '--file', help='DZ File to read', action='store', required=True, dest='dzfile')
+                parser.add_argument('-f', '--file', help='DZ (or KDZ) File to read', action='store', required=True, dest='dzfile')
                 parser.add_argument('-b', '--batch', help='batch mode', action='store_true', dest='batchMode')
                 group = parser.add_mutually_exclusive_group(required=True)
                 group.add_argument('-l', '--list', help='list slices/partitions', action='store_true', dest='listOnly')
                 group.add_argument('-x', '--extract', help='extract chunk-file(s) for reconstruction (all by default)', action='store_true', dest='extractChunkfile')
                 group.add_argument('-c', '--chunk', help='extract data chunk(s) (all by default)', action='store_true', dest='extractChunk')
-                group.add_argument('-s', '--single', help='extract diskslice(s) (partition(s)) (all by default)', action='store_true', dest='extractSlice')
+                group.add_argument('-s', '--single', help='extract diskslice(s) (partition(s)) by index or name (all by default)', action='store_true', dest='extractSlice')
                 group.add_argument('-i', '--image', help='extract all slices/partitions as a disk image', action='store_true', dest='extractImage')
+                group.add_argument('--verify', help='check MD5/CRC32 of all chunks without extracting', action='store_true', dest='verifyOnly')
                 parser.add_argument('-d', '--dir', '-o', '--out', help='output location', action='store', dest='outdir')
+                parser.add_argument('--index', help='keep the chunk index of the file under $XDG_CACHE_HOME/kdztools to open it faster next time (never used by --verify)', action='store_true', dest='useIndex')
+                parser.add_argument('--sparse', help='skip writing zero-filled blocks, leaving holes in the output', action='store_true', dest='sparse')
+                parser.add_argument('--simg', help='write slices as Android sparse images (trimmed areas become DONT_CARE)', action='store_true', dest='sparseImage')
+                parser.add_argument('-j', '--jobs', help='number of chunks to decompress in parallel (default: CPU count)', action='store', dest='jobs', type=int, default=os.cpu_count())
 
                 return parser.parse_known_args()
 
         def cmdListPartitions(self):
-            if not cmd.batchMode:
+            if not self.dz_file.batchMode:
                 print("[+] DZ Partition List\n=========================================")
             self.dz_file.display()
 
@@ -961,7 +1548,7 @@ class DZFileTools:
                         if idx < 0 or idx >= self.dz_file.getChunkCount():
                                 print("[!] Cannot extract out of range chunk {:d} (min=0 max={:d})".format(idx, self.dz_file.getChunkCount()-1), file=sys.stderr)
                                 sys.exit(1)
-                        name = self.dz_file.getChunkName(idx)
+                        name = os.path.join(self.outdir, self.dz_file.getChunkName(idx))
                         file = io.FileIO(name, "wb")
                         self.dz_file.extractChunk(file, name, idx)
                         file.close()
@@ -984,12 +1571,22 @@ class DZFileTools:
                         if idx < 0 or idx >= self.dz_file.getChunkCount():
                                 print("[!] Cannot extract out of range chunkfile {:d} (min=0 max={:d})".format(idx, self.dz_file.getChunkCount()-1), file=sys.stderr)
                                 sys.exit(1)
-                        name = self.dz_file.getChunkName(idx) + ".chunk"
+                        name = os.path.join(self.outdir, self.dz_file.getChunkName(idx) + ".chunk")
                         file = io.open(name, "wb")
                         self.dz_file.extractChunkfile(file, name, idx)
                         file.close()
 
         def cmdExtractSlice(self, files):
+                # Slices may also be given by name ("system,vendor,super"),
+                # only the chunks of those get decompressed
+                files = [f for arg in files for f in arg.split(",") if f]
+                names = [f for f in files if not f.isdigit()]
+                files = [f for f in files if f.isdigit()]
+                if len(names) > 0:
+                        self.cmdExtractNamedSlice(names)
+                        if len(files) == 0:
+                                return
+
                 if len(files) == 0:
                         print("[+] Extracting all slices/partitions\n")
                         files = range(0, self.dz_file.getSlice(-1).getIndex()+1)
@@ -1017,16 +1614,30 @@ class DZFileTools:
                                 if slice.getIndex() == None:
                                     slice = self.dz_file.getSlice(idx)
 
-                        name = slice.getSliceName() + ".image"
-                        file = io.FileIO(name, "wb")
-                        self.dz_file.extractSlice(file, name, cur)
-                        file.close()
+                        slice.extract(os.path.join(self.outdir, slice.getSliceName() + ".image"))
+
+        def cmdExtractNamedSlice(self, names):
+                found = []
+                missing = []
+                for name in names:
+                        slice = self.dz_file.findSlice(name)
+                        if slice is None:
+                                missing.append(name)
+                        elif slice not in found:
+                                found.append(slice)
+
+                print("[+] Extracting {:d} named slices^Wpartitions!\n".format(len(found)))
+                if len(missing) > 0:
+                        print("[ ] Not in this DZ: {:s}".format(", ".join(missing)))
+
+                for slice in found:
+                        slice.extract(os.path.join(self.outdir, slice.getSliceName() + ".image"))
 
         def cmdExtractImage(self, files):
                 if len(files) > 0:
                         print("[!] Cannot specify specific portions to extract when outputting image", file=sys.stderr)
                         sys.exit(1)
-                name = "image.img"
+                name = os.path.join(self.outdir, "image.img")
                 try:
                         file = io.open(name, "r+b")
                 except IOError:
@@ -1035,7 +1646,6 @@ class DZFileTools:
                 file.close()
 
         def main(self):
-                global cmd
                 args = self.parseArgs()
                 cmd = args[0]
                 files = args[1]
@@ -1043,18 +1653,24 @@ class DZFileTools:
                 if cmd.outdir:
                         self.outdir = cmd.outdir
 
-                self.dz_file = UNDZFile(cmd.dzfile)
+                try:
+                        self.run(cmd, files)
+                except DZError as err:
+                        print("[!] Error: {:s}".format(str(err)), file=sys.stderr)
+                        sys.exit(1)
+
+        def run(self, cmd, files):
+                self.dz_file = UNDZFile.open(cmd.dzfile, strict=not cmd.verifyOnly, useIndex=cmd.useIndex and not cmd.verifyOnly, jobs=cmd.jobs, sparse=cmd.sparse, sparseImage=cmd.sparseImage, batchMode=cmd.batchMode)
 
                 if cmd.listOnly:
                         self.cmdListPartitions()
                         sys.exit(0)
 
-                # Ensure that the output directory exists
-                if not os.path.exists(self.outdir):
-                        os.makedirs(self.outdir)
+                if cmd.verifyOnly:
+                        sys.exit(0 if self.dz_file.verify() else 1)
 
-                # Change to the output directory
-                os.chdir(self.outdir)
+                # Ensure that the output directory exists
+                os.makedirs(self.outdir, exist_ok=True)
 
                 # Extracting slice(s)
                 if cmd.extractSlice:
@@ -1073,7 +1689,13 @@ class DZFileTools:
                         self.cmdExtractChunk(files)
 
                 # Save the header for later reconstruction
-                self.dz_file.saveHeader(cmd.dzfile)
+                self.dz_file.saveHeader(cmd.dzfile, self.outdir)
+
+                if not cmd.batchMode:
+                        self.dz_file.cache.display()
+
+# Library interface: DZ.open(path), dz.slices, slice.extract(dest)
+DZ = UNDZFile
 
 if __name__ == "__main__":
         dztools = DZFileTools()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import argparse
+import sys
+
+# our tools are in "libexec"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "libexec"))
+
+import gpt
+import fileio
+
+
+class GPTFileTools(object):
+	"""
+	Raw disk image tools, carves the slices^Wpartitions listed in the GPT
+	out of full eMMC/UFS dumps (image.img from undz.py -i, device backups)
+	"""
+
+	# Setup variables
+	outdir = "gptextracted"
+
+
+	def parseArgs(self):
+		# Parse arguments
+		parser = argparse.ArgumentParser(description='GPT disk image partition extractor')
+		parser.add_argument('images', help='disk image(s) to read, one per LUN for UFS devices', nargs='+')
+		group = parser.add_mutually_exclusive_group(required=True)
+		group.add_argument('-l', '--list', help='list partitions', action='store_true', dest='listOnly')
+		group.add_argument('-x', '--extract', help='extract all partitions, or those given with -p', action='store_true', dest='extract')
+		parser.add_argument('-p', '--partitions', help='comma separated names of partitions to extract', action='store', dest='partitions')
+		parser.add_argument('-d', '--dir', '-o', '--out', help='output directory', action='store', dest='outdir')
+		parser.add_argument('-j', '--jobs', help='number of parallel extractions (default: CPU count)', action='store', dest='jobs', type=int, default=os.cpu_count())
+
+		return parser.parse_args()
+
+	def openDisks(self, images):
+		"""
+		Open each image, its position in the list is taken as its LUN
+		"""
+
+		self.disks = []
+		for lun, image in enumerate(images):
+			try:
+				self.disks.append(gpt.GPTDisk.open(image, lun))
+			except (gpt.NoGPT, OSError) as err:
+				print("[!] Error: {:s}: {:s}".format(image, str(err)), file=sys.stderr)
+				sys.exit(1)
+
+	def getPartitions(self, names=None):
+		"""
+		Returns (disk, slice, output name) for the partitions to extract,
+		names used on several LUNs get the LUN appended
+		"""
+
+		parts = [(disk, slice) for disk in self.disks for slice in disk.getSlices(names)]
+
+		seen = {}
+		for disk, slice in parts:
+			seen[slice.name] = seen.get(slice.name, 0) + 1
+
+		return [(disk, slice, slice.name if seen[slice.name] == 1 else "{:s}_lun{:d}".format(slice.name, disk.lun)) for disk, slice in parts]
+
+	def extractPartition(self, disk, slice, name):
+		"""
+		Extracts a partition from a disk image
+		"""
+
+		offset, length = disk.getRange(slice)
+		if offset + length > disk.length:
+			print("[!] Warning: {:s} extends past the end of {:s}, the rest is left empty".format(slice.name, disk.path), file=sys.stderr)
+
+		disk.extract(slice, os.path.join(self.outdir, name + ".img"))
+
+	def cmdListPartitions(self):
+		print("[+] GPT Partition List\n=========================================")
+		for disk in self.disks:
+			print("LUN {:d}: {:s} ({:d} byte blocks)".format(disk.lun, disk.path, 1<<disk.gpt.shiftLBA))
+			for slice in disk.getSlices():
+				offset, length = disk.getRange(slice)
+				print("  {:s} (offset {:d}, {:d} bytes)".format(slice.name, offset, length))
+
+	def cmdExtract(self, names, jobs):
+		parts = self.getPartitions(names)
+
+		if names:
+			missing = set(names) - set(slice.name for disk, slice, name in parts)
+			if missing:
+				print("[ ] Not in these images: {:s}".format(", ".join(sorted(missing))))
+
+		# Ensure that the output directory exists
+		os.makedirs(self.outdir, exist_ok=True)
+
+		for disk, slice, name in parts:
+			print("[+] Extracting " + slice.name + " to " + os.path.join(self.outdir, name + ".img"))
+		fileio.runJobs(jobs, [(self.extractPartition, disk, slice, name) for disk, slice, name in parts])
+
+	def main(self):
+		args = self.parseArgs()
+		self.openDisks(args.images)
+
+		if args.outdir:
+			self.outdir = args.outdir
+
+		try:
+			if args.listOnly:
+				self.cmdListPartitions()
+
+			elif args.extract:
+				names = args.partitions.split(",") if args.partitions else None
+				self.cmdExtract(names, args.jobs)
+		except (gpt.NoGPT, OSError) as err:
+			print("[!] Error: {:s}".format(str(err)), file=sys.stderr)
+			sys.exit(1)
+
+if __name__ == "__main__":
+	gpttools = GPTFileTools()
+	gpttools.main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# Extracts the logical partitions of an Android 'super' image, like lpunpack.
+# The LP metadata is read once for all partitions, which are then copied out
+# at the same time, inside the kernel (copy_file_range) where possible.
+# Sparse super images are read as they are, through an index of their chunks,
+# so the raw super image never has to be written.
+#
+# Prints the name of every partition it extracted.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, hashlib, os, struct, sys
+from concurrent.futures import ThreadPoolExecutor
+
+import simg
+
+SECTOR_SIZE = 512
+
+# Layout of the start of a super image, see liblp's metadata_format.h
+PARTITION_RESERVED_BYTES = 4096
+GEOMETRY_SIZE = 4096
+METADATA_OFFSET = PARTITION_RESERVED_BYTES + 2 * GEOMETRY_SIZE
+
+GEOMETRY_MAGIC = 0x616C4467
+HEADER_MAGIC = 0x414C5030
+
+GEOMETRY = struct.Struct('<II32sIII')
+HEADER = struct.Struct('<IHHI32sI32s12s12s12s12s')
+TABLE = struct.Struct('<III')
+PARTITION = struct.Struct('<36sIIII')
+EXTENT = struct.Struct('<QIQI')
+GROUP = struct.Struct('<36sIQ')
+BLOCK_DEVICE = struct.Struct('<QIIQ36sI')
+
+TARGET_TYPE_LINEAR = 0
+TARGET_TYPE_ZERO = 1
+
+ATTR_READONLY = 1
+
+
+class LpError(Exception):
+    pass
+
+
+def cString(data):
+    return data.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+class Extent:
+    def __init__(self, values):
+        sectors, self.type, target, self.source = values
+        self.length = sectors * SECTOR_SIZE
+        self.offset = target * SECTOR_SIZE
+
+
+class Partition:
+    def __init__(self, values, extents, groups):
+        name, self.attributes, first, count, group = values
+        self.name = cString(name)
+        self.extents = extents[first:first + count]
+        self.group = groups[group] if group < len(groups) else ''
+        self.size = sum(e.length for e in self.extents)
+
+
+class LpMetadata:
+    """Geometry and one slot of the metadata of a super image"""
+
+    def __init__(self, geometry, header, tables):
+        self.metadataMaxSize, self.slotCount, self.blockSize = geometry
+        self.major, self.minor = header
+
+        self.groups = [cString(v[0]) for v in self.readTable(tables, GROUP)]
+        self.blockDevices = [cString(v[4]) for v in self.readTable(tables, BLOCK_DEVICE)]
+        extents = [Extent(v) for v in self.readTable(tables, EXTENT)]
+        self.partitions = [Partition(v, extents, self.groups) for v in self.readTable(tables, PARTITION)]
+        self.byName = {p.name: p for p in self.partitions}
+
+    @staticmethod
+    def readTable(tables, kind):
+        buf, descriptors = tables
+        offset, count, size = descriptors[kind]
+        if size < kind.size or offset + count * size > len(buf):
+            raise LpError('LP metadata table is out of bounds')
+        return [kind.unpack_from(buf, offset + i * size) for i in range(count)]
+
+    @classmethod
+    def fromImage(cls, image, slot=0):
+        """Read the metadata of slot from the super image (RawImage or SparseIndex)"""
+        geometry = None
+        for offset in (PARTITION_RESERVED_BYTES, PARTITION_RESERVED_BYTES + GEOMETRY_SIZE):
+            geometry = cls.parseGeometry(image.pread(GEOMETRY_SIZE, offset))
+            if geometry:
+                break
+        if not geometry:
+            raise LpError('no LP metadata geometry found, not a super image')
+
+        maxSize, slotCount, _ = geometry
+        if slot >= slotCount:
+            raise LpError(f'no metadata slot {slot}, there are {slotCount}')
+
+        # Primary copies of all slots come first, then the backups
+        for offset in (METADATA_OFFSET + slot * maxSize, METADATA_OFFSET + (slotCount + slot) * maxSize):
+            result = cls.parseMetadata(image.pread(maxSize, offset))
+            if result:
+                return cls(geometry, *result)
+        raise LpError(f'LP metadata of slot {slot} is corrupt')
+
+    @staticmethod
+    def parseGeometry(buf):
+        if len(buf) < GEOMETRY.size:
+            return None
+        magic, size, checksum, maxSize, slotCount, blockSize = GEOMETRY.unpack_from(buf)
+        if magic != GEOMETRY_MAGIC or size < GEOMETRY.size or size > len(buf):
+            return None
+        data = bytearray(buf[:size])
+        data[8:40] = bytes(32)
+        if hashlib.sha256(data).digest() != checksum or not maxSize or maxSize % SECTOR_SIZE:
+            return None
+        return maxSize, slotCount, blockSize
+
+    @staticmethod
+    def parseMetadata(buf):
+        if len(buf) < HEADER.size:
+            return None
+        magic, major, minor, headerSize, headerChecksum, tablesSize, tablesChecksum, *descriptors = HEADER.unpack_from(buf)
+        if magic != HEADER_MAGIC or major != 10 or headerSize < HEADER.size or headerSize + tablesSize > len(buf):
+            return None
+        header = bytearray(buf[:headerSize])
+        header[12:44] = bytes(32)
+        if hashlib.sha256(header).digest() != headerChecksum:
+            return None
+        tables = buf[headerSize:headerSize + tablesSize]
+        if hashlib.sha256(tables).digest() != tablesChecksum:
+            return None
+        kinds = (PARTITION, EXTENT, GROUP, BLOCK_DEVICE)
+        return (major, minor), (tables, {k: TABLE.unpack(d) for k, d in zip(kinds, descriptors)})
+
+    def resolve(self, name, suffix=''):
+        """
+        The partition to extract for name, trying name+suffix first.  A
+        partition with data beats an empty one (like the inactive slot).
+        """
+        names = [name + suffix, name] if suffix else [name]
+        candidates = [self.byName[n] for n in names if n in self.byName]
+        for partition in candidates:
+            if partition.size:
+                return partition
+        return candidates[0] if candidates else None
+
+
+class RawImage:
+    """A raw super image, read as it is"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def pread(self, size, offset):
+        return os.pread(self.fd, size, offset)
+
+    def copyTo(self, outfd, offset, length, dest):
+        simg.copyRange(self.fd, outfd, offset, length, dest=dest)
+
+
+def openImage(fd):
+    """The super image open as fd, sparse or raw"""
+    if simg.isSparse(os.pread(fd, 4, 0)):
+        return simg.SparseIndex(fd)
+    return RawImage(fd)
+
+
+def extract(image, partition, path):
+    """Write partition of the super image to path"""
+    with open(path, 'wb') as out:
+        dest = 0
+        for extent in partition.extents:
+            if extent.source != 0:
+                raise LpError(f'{partition.name} is on block device {extent.source}, only the super image can be read')
+            # ZERO extents stay holes
+            if extent.type == TARGET_TYPE_LINEAR:
+                image.copyTo(out.fileno(), extent.offset, extent.length, dest)
+            elif extent.type != TARGET_TYPE_ZERO:
+                raise LpError(f'{partition.name} has an unknown extent type {extent.type}')
+            dest += extent.length
+        out.truncate(partition.size)
+
+
+def unpack(image, outdir, names=None, suffix='', slot=0, jobs=None):
+    """
+    Extract the partitions names (all of them if None) of the super image
+    (raw or sparse) to outdir, as <name>.img.  Returns the names that were
+    found.
+    """
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        image = openImage(fd)
+        metadata = LpMetadata.fromImage(image, slot)
+        if names is None:
+            wanted = [(p.name, p) for p in metadata.partitions]
+        else:
+            wanted = [(n, metadata.resolve(n, suffix)) for n in names]
+            wanted = [(n, p) for n, p in wanted if p]
+
+        os.makedirs(outdir, exist_ok=True)
+        # map() raises the first failure
+        with ThreadPoolExecutor(max_workers=max(1, jobs or os.cpu_count())) as pool:
+            list(pool.map(lambda w: extract(image, w[1], os.path.join(outdir, w[0] + '.img')), wanted))
+        return [n for n, _ in wanted]
+    finally:
+        os.close(fd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the logical partitions of an Android super image')
+    parser.add_argument('image', help='super image, raw or sparse')
+    parser.add_argument('outdir', nargs='?', default='.', help='output directory (default: current directory)')
+    parser.add_argument('-p', '--partition', action='append', help='partition(s) to extract, comma separated or repeated (all by default)')
+    parser.add_argument('-s', '--suffix', default='', help="prefer '<name><suffix>' over '<name>' (e.g. '_a'), written as '<name>.img'")
+    parser.add_argument('-S', '--slot', type=int, default=0, help='metadata slot to read (default: 0)')
+    parser.add_argument('-j', '--jobs', type=int, help='number of parallel extractions (default: CPU count)')
+    parser.add_argument('-l', '--list', action='store_true', help='only list the partitions')
+    args = parser.parse_args()
+
+    names = [n for p in args.partition for n in p.split(',') if n] if args.partition else None
+    try:
+        if args.list:
+            fd = os.open(args.image, os.O_RDONLY)
+            try:
+                metadata = LpMetadata.fromImage(openImage(fd), args.slot)
+            finally:
+                os.close(fd)
+            for p in metadata.partitions:
+                print(f'{p.name:<36} {p.size:>14} {p.group}')
+        else:
+            for name in unpack(args.image, args.outdir, names, args.suffix, args.slot, args.jobs):
+                print(name)
+    except (LpError, simg.SparseError, OSError) as err:
+        print(f'Error: {err}', file=sys.stderr)
+        sys.exit(1)
@@ -9,7 +9,9 @@
 # This file has been put into the public domain.
 # You can do whatever you want with this file.
 
-import argparse, os, struct, sys
+import argparse, os, struct, subprocess, sys, zipfile
+
+import simg
 
 
 # 2124 bytes = (22*2)+4+4+(256*2)+(256*2)+4+4+4+4+4+4+4+(100*2)+4+4+4+(800*1)+4+2+2
@@ -21,6 +23,10 @@ FILE_HEADER_FMT = 'I 512s 512s 504s I I I I I I I I 5I 996s'
 PAC_MAGIC = '0xfffafffa'
 fiveSpaces = ' ' * 5
 
+PAC_VERSIONS = ('BP_R1.0.0', 'BP_R2.0.1')
+# szVersion as it is on disk, for telling a PAC from an archive without decoding
+PAC_VERSION_FIELDS = {v.encode('utf-16le').ljust(44, b'\0') for v in PAC_VERSIONS}
+
 PAC_HEADER = {
     'szVersion': '',            # packet struct version
     'dwHiSize': 0,              # the whole packet high size
@@ -70,6 +76,117 @@ def abort(msg):
     sys.exit(msg)
 
 
+class WindowReader:
+    """Random access to a PAC stored uncompressed inside another file (e.g. a stored zip member)"""
+
+    def __init__(self, f, start):
+        self.f = f
+        self.start = start
+        self.f.seek(start)
+
+    def read(self, size):
+        return self.f.read(size)
+
+    def seek(self, offset):
+        self.f.seek(self.start + offset)
+
+    def close(self):
+        self.f.close()
+
+
+class StreamReader:
+    """Forward-only access to a compressed PAC (deflated zip member, 7z pipe)"""
+
+    def __init__(self, stream, proc=None):
+        self.stream = stream
+        self.proc = proc
+        self.pos = 0
+
+    def read(self, size):
+        dat = self.stream.read(size)
+        self.pos += len(dat)
+        return dat
+
+    def seek(self, offset):
+        if offset < self.pos:
+            abort('Cannot seek backwards in a streamed PAC')
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, 1 << 20)):
+                abort('Unexpected end of PAC stream')
+
+    def close(self):
+        self.stream.close()
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def isPac(path):
+    """True if path is a bare PAC, anything else is taken for an archive"""
+    with open(path, 'rb') as f:
+        version = f.read(44)
+    return version in PAC_VERSION_FIELDS
+
+
+def listPacMembers(path):
+    """Return [(member, size)] of all '.pac' files inside a zip or any archive 7z reads"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            return [(i.filename, i.file_size) for i in z.infolist() if i.filename.lower().endswith('.pac')]
+
+    try:
+        out = subprocess.run(['7z', 'l', '-ba', '-slt', path], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, check=True).stdout.decode('utf-8', 'replace')
+    except (OSError, subprocess.CalledProcessError):
+        abort(f'{path} is neither a PAC firmware nor an archive 7z can read.')
+    members = []
+    name = None
+    for line in out.splitlines():
+        if line.startswith('Path = '):
+            name = line[7:]
+        elif line.startswith('Size = ') and name is not None:
+            if name.lower().endswith('.pac'):
+                members.append((name, int(line[7:])))
+            name = None
+    return members
+
+
+def zipDataOffset(f, info):
+    """Offset of a zip member's data, found by reading its local file header"""
+    f.seek(info.header_offset)
+    hdr = f.read(30)
+    if hdr[:4] != b'PK\x03\x04':
+        abort(f'Bad local header for {info.filename}')
+    nameLen, extraLen = struct.unpack('<HH', hdr[26:30])
+    return info.header_offset + 30 + nameLen + extraLen
+
+
+def openPac(pacfile, member=None):
+    """
+    Open a PAC, either a plain file or 'member' of an archive (zip, 7z, rar, tar, ...).
+    Stored zip members are read in place, anything compressed is streamed.
+    Returns (file, size).
+    """
+    if member is None:
+        return open(pacfile, 'rb'), os.stat(pacfile).st_size
+
+    if zipfile.is_zipfile(pacfile):
+        z = zipfile.ZipFile(pacfile)
+        info = z.getinfo(member)
+        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            f = open(pacfile, 'rb')
+            z.close()
+            return WindowReader(f, zipDataOffset(f, info)), info.file_size
+        return StreamReader(z.open(info)), info.file_size
+
+    size = dict(listPacMembers(pacfile)).get(member)
+    if size is None:
+        abort(f'{member} not found in {pacfile}')
+    proc = subprocess.Popen(['7z', 'x', '-so', pacfile, member],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return StreamReader(proc.stdout, proc), size
+
+
 def getString(name):
     return name.decode('utf-16le').rstrip('\x00')
 
@@ -105,7 +222,7 @@ def printPacHeader(ph):
     print('\n')
 
 
-def parsePacHeader(f, pacfile, debug):
+def parsePacHeader(f, pacSize, debug):
     pacHeader = PAC_HEADER.copy()
     pacHeaderBin = struct.unpack(PAC_HEADER_FMT, f.read(struct.calcsize(PAC_HEADER_FMT)))
 
@@ -118,11 +235,11 @@ def parsePacHeader(f, pacfile, debug):
     if debug:
         printPacHeader(pacHeader)
 
-    if pacHeader['szVersion'] != 'BP_R1.0.0' and pacHeader['szVersion'] != 'BP_R2.0.1':
+    if pacHeader['szVersion'] not in PAC_VERSIONS:
         abort('Unsupported PAC version')
 
     dwSize = pacHeader['dwHiSize'] * 0x100000000 + pacHeader['dwLoSize']
-    if dwSize != os.stat(pacfile).st_size:
+    if dwSize != pacSize:
         abort("Bin packet's size is not correct")
 
     return pacHeader
@@ -201,43 +318,66 @@ def parseFiles(f, fileHeaders, debug):
     fileHeaders.append(fileHeader)
 
 
-def extractFile(f, fh, outdir):
+def extractFile(f, fh, outdir, unsparse=False):
     tempsize = fh['hiPartitionSize'] * 0x100000000 + fh['loPartitionSize']
     if tempsize == 0:
         return
     print(f'{fiveSpaces}{fh["fileName"]}', end='')
 
-    f.seek(fh['hiDataOffset'] * 0x100000000 + fh['loDataOffset'])
+    f.seek(dataOffset(fh))
     size = 4096
     tsize = tempsize
     with open(os.path.join(outdir, fh['fileName']), 'wb') as ofile:
-        while tempsize > 0:
-            if tempsize < size:
-                size = tempsize
-            dat = f.read(size)
-            tempsize -= size
-            ofile.write(dat)
-            print(f'\r{int(100 - ((100 * tempsize) / tsize))}%', end='')
+        sink = ofile
+        try:
+            while tempsize > 0:
+                if tempsize < size:
+                    size = tempsize
+                dat = f.read(size)
+                # Sparse images are written out raw right away
+                if unsparse and tempsize == tsize and simg.isSparse(dat):
+                    sink = simg.SparseDecoder(ofile)
+                tempsize -= size
+                sink.write(dat)
+                print(f'\r{int(100 - ((100 * tempsize) / tsize))}%', end='')
+            if sink is not ofile:
+                sink.close()
+        except simg.SparseError as err:
+            abort(f'{fh["fileName"]}: {err}')
 
     print(f'\r{fh["fileName"]}{fiveSpaces}')
 
 
-# main('path/to/pacfile')
-def main(pacfile, outdir=None, debug=False, checkCRC16=False):
-    if os.stat(pacfile).st_size < struct.calcsize(PAC_HEADER_FMT):
-        abort(f'{pacfile} is not a PAC firmware.')
-    if outdir is None:  # use 'outdir' as default output directory if None specified
-        outdir = os.path.join(os.getcwd(), 'outdir')
-    if os.path.isfile(outdir):
-        abort(f'file with name "{outdir}" exists')
+def dataOffset(fh):
+    return fh['hiDataOffset'] * 0x100000000 + fh['loDataOffset']
+
+
+def isWanted(fh, partitions):
+    if not partitions:
+        return True
+    return fh['partitionName'] in partitions or fh['fileName'] in partitions or \
+        os.path.splitext(fh['fileName'])[0] in partitions
+
+
+def extractPac(pacfile, member, outdir, debug, checkCRC16, partitions, unsparse=False):
+    if member is not None:
+        print(f'Reading {member} from {pacfile}')
+
+    f, pacSize = openPac(pacfile, member)
+    try:
+        if pacSize < struct.calcsize(PAC_HEADER_FMT):
+            abort(f'{member or pacfile} is not a PAC firmware.')
 
-    with open(pacfile, 'rb') as f:
         # Unpack pac Header
-        pacHeader = parsePacHeader(f, pacfile, debug)
+        pacHeader = parsePacHeader(f, pacSize, debug)
 
-        # Verify crc16
+        # Verify crc16, streamed members need a pass of their own
         if checkCRC16:
-            verifyCRC16(f, pacHeader, debug)
+            cf, _ = openPac(pacfile, member)
+            try:
+                verifyCRC16(cf, pacHeader, debug)
+            finally:
+                cf.close()
 
         # Unpack partition Headers
         fileHeaders = []
@@ -245,11 +385,33 @@ def main(pacfile, outdir=None, debug=False, checkCRC16=False):
         for i in range(pacHeader['partitionCount']):
             parseFiles(f, fileHeaders, debug)
 
-        # Extract partitions using partition headers
+        # Extract partitions using partition headers, in file order so that
+        # streamed PACs only ever seek forward
         print(f'\nExtracting to {outdir}\n')
         os.makedirs(outdir, exist_ok=True)
-        for i in range(pacHeader['partitionCount']):
-            extractFile(f, fileHeaders[i], outdir)
+        for fh in sorted(fileHeaders, key=dataOffset):
+            if isWanted(fh, partitions):
+                extractFile(f, fh, outdir, unsparse)
+    finally:
+        f.close()
+
+
+# main('path/to/pacfile')
+# main('path/to/firmware.zip')  # every '.pac' inside the archive
+def main(pacfile, outdir=None, debug=False, checkCRC16=False, member=None, partitions=None, unsparse=False):
+    if outdir is None:  # use 'outdir' as default output directory if None specified
+        outdir = os.path.join(os.getcwd(), 'outdir')
+    if os.path.isfile(outdir):
+        abort(f'file with name "{outdir}" exists')
+
+    if member is None and not isPac(pacfile):
+        members = listPacMembers(pacfile)
+        if not members:
+            abort(f'No PAC firmware found in {pacfile}.')
+        for member, _ in members:
+            extractPac(pacfile, member, outdir, debug, checkCRC16, partitions, unsparse)
+    else:
+        extractPac(pacfile, member, outdir, debug, checkCRC16, partitions, unsparse)
 
     print('\nDone...')
 
@@ -261,10 +423,14 @@ if __name__ == '__main__':
         abort('Requires Python 3.7+')
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('pacfile', help='Spreadtrum .pac file')
+    parser.add_argument('pacfile', help='Spreadtrum .pac file, or an archive (zip, 7z, rar, ...) containing it')
     parser.add_argument('outdir', nargs='?', help='output directory to extract files')
     parser.add_argument('-d', dest='debug', action='store_true', help='enable debug output')
     parser.add_argument('-c', dest='checkCRC16', action='store_true', help='compute and verify CRC16')
+    parser.add_argument('-m', dest='member', help='.pac file inside the archive (all by default)')
+    parser.add_argument('-p', dest='partitions', help='comma separated partitions/files to extract (all by default)')
+    parser.add_argument('-u', dest='unsparse', action='store_true', help='write sparse images as raw images')
     args = parser.parse_args()
 
-    main(args.pacfile, args.outdir, args.debug, args.checkCRC16)
+    partitions = set(args.partitions.split(',')) if args.partitions else None
+    main(args.pacfile, args.outdir, args.debug, args.checkCRC16, args.member, partitions, args.unsparse)
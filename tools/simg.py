@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+# Android sparse image decoder, a streaming simg2img.
+# Sparse data can be fed in pieces of any size (from a pipe, an archive
+# member or a parser), so no intermediate sparse file has to be written.
+# Several sparse images in a row, like Motorola's 'sparsechunk' files, are
+# laid over each other into the same raw image, also straight out of the
+# firmware archive. DONT_CARE chunks and zero FILL chunks are left as holes.
+# SparseIndex reads parts of the raw image straight from a sparse file.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, bisect, os, stat, struct, subprocess, sys, zipfile
+
+# Copying ranges of files is shared with kdztools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kdztools', 'libexec'))
+from fileio import copyRange, TruncatedFile
+
+SPARSE_MAGIC = 0xED26FF3A
+
+FILE_HEADER = struct.Struct('<IHHHHIIII')
+CHUNK_HEADER = struct.Struct('<HHII')
+
+CHUNK_RAW = 0xCAC1
+CHUNK_FILL = 0xCAC2
+CHUNK_DONT_CARE = 0xCAC3
+CHUNK_CRC32 = 0xCAC4
+
+# Largest piece of a FILL chunk written at once
+FILL_BUFFER = 1 << 20
+
+
+class SparseError(Exception):
+    pass
+
+
+def isSparse(data):
+    """True if data (bytes, or the path of a file) starts like a sparse image"""
+    if isinstance(data, (str, os.PathLike)):
+        try:
+            with open(data, 'rb') as f:
+                data = f.read(4)
+        except OSError:
+            return False
+    return len(data) >= 4 and struct.unpack_from('<I', data)[0] == SPARSE_MAGIC
+
+
+def isRegularFile(f):
+    try:
+        return stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+class SparseIndex:
+    """
+    Where the data of the raw image is in a sparse image file, so any part
+    of it can be read without unsparsing the whole image
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        header = os.pread(fd, FILE_HEADER.size, 0)
+        if not isSparse(header) or len(header) < FILE_HEADER.size:
+            raise SparseError('not a sparse image')
+        _, major, minor, fileHeaderSize, chunkHeaderSize, blockSize, blocks, chunks, _ = FILE_HEADER.unpack(header)
+        if major != 1 or fileHeaderSize < FILE_HEADER.size or chunkHeaderSize < CHUNK_HEADER.size or not blockSize or blockSize % 4:
+            raise SparseError(f'unsupported sparse image (version {major}.{minor}, block size {blockSize})')
+        self.size = blocks * blockSize
+
+        # Chunks with data, in raw offset order: (offset, length, kind,
+        # file offset of RAW data or FILL pattern). DONT_CARE isn't kept.
+        self.chunks = []
+        offset = fileHeaderSize
+        pos = 0
+        for _ in range(chunks):
+            header = os.pread(fd, chunkHeaderSize + 4, offset)
+            if len(header) < chunkHeaderSize:
+                raise SparseError('sparse image is truncated')
+            kind, _, count, totalSize = CHUNK_HEADER.unpack_from(header)
+            length = count * blockSize
+            if kind == CHUNK_RAW:
+                if totalSize - chunkHeaderSize != length:
+                    raise SparseError(f'RAW chunk of {length} bytes has {totalSize - chunkHeaderSize} bytes of data')
+                self.chunks.append((pos, length, kind, offset + chunkHeaderSize))
+            elif kind == CHUNK_FILL:
+                pattern = header[chunkHeaderSize:chunkHeaderSize + 4]
+                if pattern != b'\0\0\0\0':
+                    self.chunks.append((pos, length, kind, pattern))
+            elif kind not in (CHUNK_DONT_CARE, CHUNK_CRC32):
+                raise SparseError(f'unknown chunk type {kind:#06x}')
+            offset += totalSize
+            pos += length
+        self.starts = [c[0] for c in self.chunks]
+
+    def pieces(self, offset, length):
+        """Yield (offset, length, kind, data) of the chunks with data in a range of the raw image"""
+        if offset + length > self.size:
+            raise SparseError('read past the end of the sparse image')
+        i = max(bisect.bisect_right(self.starts, offset) - 1, 0)
+        end = offset + length
+        for start, size, kind, data in self.chunks[i:]:
+            if start >= end:
+                break
+            lo, hi = max(start, offset), min(start + size, end)
+            if lo < hi and kind == CHUNK_RAW:
+                yield lo, hi - lo, kind, data + lo - start
+            elif lo < hi:
+                # Pattern as it continues from lo
+                shift = (lo - start) % 4
+                yield lo, hi - lo, kind, data[shift:] + data[:shift]
+
+    def pread(self, size, offset):
+        """size bytes at offset of the raw image"""
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b''
+        buf = bytearray(size)
+        for start, length, kind, data in self.pieces(offset, size):
+            at = start - offset
+            if kind == CHUNK_RAW:
+                buf[at:at + length] = os.pread(self.fd, length, data)
+            else:
+                buf[at:at + length] = (data * (length // 4 + 1))[:length]
+        return bytes(buf)
+
+    def copyTo(self, outfd, offset, length, dest):
+        """
+        Copy a range of the raw image to dest of outfd, parts without data
+        are skipped so they stay holes of a new file
+        """
+        for start, count, kind, data in self.pieces(offset, length):
+            at = dest + start - offset
+            if kind == CHUNK_RAW:
+                try:
+                    copyRange(self.fd, outfd, data, count, dest=at)
+                except TruncatedFile:
+                    raise SparseError('input is truncated')
+            else:
+                buffer = memoryview(data * (min(count, FILL_BUFFER) // 4 + 1))
+                while count > 0:
+                    written = os.pwrite(outfd, buffer[:min(count, len(buffer))], at)
+                    at += written
+                    count -= written
+
+
+class SparseDecoder:
+    """
+    Writes the raw image of the sparse data written to it into out.  Data
+    can come in any pieces, close() must be called once all was written.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.seekable = out.seekable()
+        # Regular files are written with pwrite() at the offset of each chunk
+        self.fd = out.fileno() if isRegularFile(out) else None
+        self.pending = bytearray()      # header being collected
+        self.need = FILE_HEADER.size    # size of that header
+        self.state = 'file'             # file, chunk, fill or crc header next
+        self.skip = 0                   # header bytes to ignore
+        self.raw = 0                    # RAW payload left in this chunk
+        self.chunks = 0                 # chunks left in this image
+        self.blockSize = 0
+        self.chunkHeaderSize = 0
+        self.images = 0                 # images seen, >1 for sparsechunks
+        self.pos = 0                    # output offset of the next data
+        self.end = 0                    # end of the data written so far
+        self.size = 0                   # size of the raw image
+        self.fillLength = 0
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            if self.skip:
+                count = min(self.skip, len(view))
+                self.skip -= count
+                view = view[count:]
+            elif self.raw:
+                count = min(self.raw, len(view))
+                self.output(view[:count])
+                self.raw -= count
+                view = view[count:]
+                if not self.raw:
+                    self.chunkDone()
+            else:
+                count = min(self.need - len(self.pending), len(view))
+                self.pending += view[:count]
+                view = view[count:]
+                if len(self.pending) == self.need:
+                    header = bytes(self.pending)
+                    self.pending.clear()
+                    self.parse(header)
+        return len(data)
+
+    def parse(self, header):
+        if self.state == 'file':
+            magic, major, minor, fileHeaderSize, chunkHeaderSize, blockSize, blocks, chunks, crc = FILE_HEADER.unpack(header)
+            if magic != SPARSE_MAGIC:
+                raise SparseError('not a sparse image' if not self.images else 'garbage after sparse image')
+            if major != 1 or fileHeaderSize < FILE_HEADER.size or chunkHeaderSize < CHUNK_HEADER.size or not blockSize or blockSize % 4:
+                raise SparseError(f'unsupported sparse image (version {major}.{minor}, block size {blockSize})')
+            if self.images and not self.seekable:
+                raise SparseError('several sparse images need a seekable output')
+            self.images += 1
+            self.blockSize = blockSize
+            self.chunkHeaderSize = chunkHeaderSize
+            self.chunks = chunks
+            self.size = max(self.size, blocks * blockSize)
+            self.skip = fileHeaderSize - FILE_HEADER.size
+            self.pos = 0
+            self.nextChunk()
+
+        elif self.state == 'chunk':
+            kind, _, blocks, totalSize = CHUNK_HEADER.unpack(header)
+            length = blocks * self.blockSize
+            self.skip = self.chunkHeaderSize - CHUNK_HEADER.size
+            payload = totalSize - self.chunkHeaderSize
+            if kind == CHUNK_RAW:
+                if payload != length:
+                    raise SparseError(f'RAW chunk of {length} bytes has {payload} bytes of data')
+                self.raw = length
+                if not self.raw:
+                    self.chunkDone()
+            elif kind == CHUNK_FILL:
+                self.fillLength = length
+                self.state, self.need = 'fill', 4
+            elif kind == CHUNK_DONT_CARE:
+                self.pos += length
+                self.chunkDone()
+            elif kind == CHUNK_CRC32:
+                self.state, self.need = 'crc', 4
+            else:
+                raise SparseError(f'unknown chunk type {kind:#06x}')
+
+        elif self.state == 'fill':
+            self.fill(header, self.fillLength)
+            self.chunkDone()
+
+        elif self.state == 'crc':
+            self.chunkDone()
+
+    def nextChunk(self):
+        if self.chunks:
+            self.state, self.need = 'chunk', CHUNK_HEADER.size
+        else:
+            # Another sparse image may follow
+            self.state, self.need = 'file', FILE_HEADER.size
+
+    def chunkDone(self):
+        self.chunks -= 1
+        self.nextChunk()
+
+    def output(self, data):
+        if self.fd is not None:
+            view = memoryview(data)
+            while view:
+                count = os.pwrite(self.fd, view, self.pos)
+                self.pos += count
+                view = view[count:]
+            self.end = max(self.end, self.pos)
+            return
+        if self.seekable:
+            if self.out.tell() != self.pos:
+                self.out.seek(self.pos)
+        else:
+            self.pad(self.pos)
+        self.out.write(data)
+        self.pos += len(data)
+        self.end = max(self.end, self.pos)
+
+    def pad(self, pos):
+        """Write zeros up to pos on an output that can't seek"""
+        zeros = bytes(min(pos - self.end, FILL_BUFFER))
+        while self.end < pos:
+            count = self.out.write(zeros[:pos - self.end])
+            self.end += count
+
+    def fill(self, pattern, length):
+        # Nothing was ever written there, so it can stay a hole
+        if pattern == b'\0\0\0\0' and self.pos >= self.end and self.seekable:
+            self.pos += length
+            return
+        buffer = memoryview(pattern * (min(length, FILL_BUFFER) // 4))
+        while length > 0:
+            count = min(length, len(buffer))
+            self.output(buffer[:count])
+            length -= count
+
+    def readFrom(self, f, bufSize=1 << 20):
+        """
+        Decode everything f has left, returns how much that was.  RAW data
+        of regular files is copied inside the kernel where it can be.
+        """
+        direct = hasattr(os, 'copy_file_range') and isRegularFile(f) and self.fd is not None
+        total = 0
+        while True:
+            if direct and self.raw and not self.skip:
+                try:
+                    total += self.copyRaw(f)
+                    continue
+                except OSError:
+                    direct = False
+            if direct:
+                # Stay on the boundary of the RAW data for copy_file_range()
+                size = self.skip or self.need - len(self.pending)
+            else:
+                size = bufSize
+            data = f.read(size)
+            if not data:
+                return total
+            total += self.write(data)
+
+    def copyRaw(self, f):
+        offset = f.tell()
+        count = os.copy_file_range(f.fileno(), self.fd, self.raw, offset, self.pos)
+        if count == 0:
+            raise SparseError('sparse image is truncated')
+        f.seek(offset + count)
+        self.raw -= count
+        self.pos += count
+        self.end = max(self.end, self.pos)
+        if not self.raw:
+            self.chunkDone()
+        return count
+
+    def close(self):
+        """Finish the raw image, returns its size"""
+        if not self.images:
+            raise SparseError('not a sparse image')
+        if self.state != 'file' or self.pending or self.raw or self.skip:
+            raise SparseError('sparse image is truncated')
+        if self.seekable:
+            self.out.truncate(self.size)
+            # Files grow on truncate(), BytesIO and the like don't
+            self.end = self.out.seek(0, os.SEEK_END)
+        self.pad(self.size)
+        self.out.flush()
+        return self.size
+
+
+def copyStream(f, out):
+    size = 0
+    data = f.read(1 << 20)
+    while data:
+        size += out.write(data)
+        data = f.read(1 << 20)
+    return size
+
+
+def unsparse(sources, out, copyRaw=False):
+    """
+    Write the raw image of the sparse files sources (binary files, read in
+    order as one stream) into out, returns its size.  With copyRaw, input
+    that isn't sparse is copied as it is.
+    """
+    decoder = SparseDecoder(out)
+    sources = iter(sources)
+    for i, f in enumerate(sources):
+        size = 0
+        if i == 0 and copyRaw:
+            head = f.read(FILE_HEADER.size)
+            if not isSparse(head):
+                size = out.write(head) + copyStream(f, out)
+                for f in sources:
+                    size += copyStream(f, out)
+                out.flush()
+                return size
+            size = decoder.write(head)
+        if not size + decoder.readFrom(f):
+            name = getattr(f, 'name', None)
+            raise SparseError(f'{name if isinstance(name, str) else f"input {i + 1}"} is empty')
+    return decoder.close()
+
+
+def openMembers(archive, names):
+    """
+    Yield each member names of archive as a binary stream, in order.  Zips
+    are read with zipfile, anything else through '7z x -so'.
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for name in names:
+                try:
+                    member = z.open(name)
+                except KeyError:
+                    raise SparseError(f'{name} is not in {archive}')
+                with member:
+                    yield member
+        return
+
+    for name in names:
+        proc = subprocess.Popen(['7z', 'x', '-so', archive, name], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with proc.stdout:
+            yield proc.stdout
+        if proc.wait():
+            raise SparseError(f'7z failed to extract {name} from {archive}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert sparse images to a raw image')
+    parser.add_argument('sparse', nargs='+', help="sparse image(s), several for sparsechunks, '-' for stdin")
+    parser.add_argument('raw', help="raw image to write, '-' for stdout")
+    parser.add_argument('-c', '--copy-raw', action='store_true', help="copy input that isn't sparse as it is")
+    parser.add_argument('-a', '--archive', help='read the sparse images as members of this zip/7z archive')
+    args = parser.parse_args()
+
+    sources = []
+    try:
+        if args.archive:
+            sources = openMembers(args.archive, args.sparse)
+        else:
+            for path in args.sparse:
+                sources.append(sys.stdin.buffer if path == '-' else open(path, 'rb'))
+        out = sys.stdout.buffer if args.raw == '-' else open(args.raw, 'wb')
+        with out:
+            unsparse(sources, out, args.copy_raw)
+    except (SparseError, OSError) as err:
+        print(f'Error: {err}', file=sys.stderr)
+        if args.raw != '-' and os.path.exists(args.raw):
+            os.remove(args.raw)
+        sys.exit(1)
+    finally:
+        if not args.archive:
+            for f in sources:
+                f.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Strips the MOTO/ASUS header some vendors put in front of ext4 images.
+# The ext4 superblock is looked for at known header sizes and then at
+# aligned offsets near the start, instead of grepping the whole image for its
+# magic. The header is cut off in place with FALLOC_FL_COLLAPSE_RANGE where
+# the filesystem allows it, otherwise the image is copied once past it.
+#
+# Prints '<header> <offset>' when a header was stripped, nothing otherwise.
+#
+# This file has been put into the public domain.
+# You can do whatever you want with this file.
+
+import argparse, ctypes, errno, os, struct, sys
+
+HEADERS = [b'MOTO', b'ASUS']
+
+# Header sizes seen in the wild, tried before searching
+KNOWN_OFFSETS = [131072]
+
+# The superblock is 1024 bytes into the filesystem, its magic 56 bytes further
+SUPERBLOCK = 1024
+EXT4_MAGIC = b'\x53\xef'
+MAGIC_OFFSET = SUPERBLOCK + 56
+
+# How far into the image a header may end
+SEARCH_WINDOW = 4 << 20
+
+FALLOC_FL_COLLAPSE_RANGE = 0x08
+
+
+class StripError(Exception):
+    pass
+
+
+def isSuperblock(buf, offset):
+    """True if buf has a plausible ext4 superblock for a filesystem starting at offset"""
+    sb = offset + SUPERBLOCK
+    if len(buf) < sb + 80 or buf[sb + 56:sb + 58] != EXT4_MAGIC:
+        return False
+    inodes, = struct.unpack_from('<I', buf, sb)
+    logBlockSize, = struct.unpack_from('<I', buf, sb + 24)
+    revLevel, = struct.unpack_from('<I', buf, sb + 76)
+    return inodes > 0 and logBlockSize <= 6 and revLevel <= 1
+
+
+def findFilesystem(buf):
+    """Return the offset of the ext4 filesystem in buf, None if there is none"""
+    for offset in KNOWN_OFFSETS:
+        if isSuperblock(buf, offset):
+            return offset
+
+    # Headers end on a sector boundary
+    for offset in range(512, len(buf) - MAGIC_OFFSET, 512):
+        if buf[offset + MAGIC_OFFSET:offset + MAGIC_OFFSET + 2] == EXT4_MAGIC and isSuperblock(buf, offset):
+            return offset
+
+    # Anything else, same as grepping for the magic
+    pos = buf.find(EXT4_MAGIC, MAGIC_OFFSET + 1)
+    while pos != -1:
+        if isSuperblock(buf, pos - MAGIC_OFFSET):
+            return pos - MAGIC_OFFSET
+        pos = buf.find(EXT4_MAGIC, pos + 1)
+    return None
+
+
+def collapse(fd, length):
+    """Remove the first length bytes of fd in place, False if the filesystem can't"""
+    if not sys.platform.startswith('linux'):
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    if libc.fallocate(fd, FALLOC_FL_COLLAPSE_RANGE, 0, length) == 0:
+        return True
+    err = ctypes.get_errno()
+    # Unaligned length, unsupported filesystem, or nothing left after the header
+    if err in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS, errno.EPERM):
+        return False
+    raise OSError(err, os.strerror(err))
+
+
+def copyFrom(path, offset):
+    """Replace path with its contents past offset, in one sequential copy"""
+    tmp = path + '-2'
+    with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+        length = os.fstat(src.fileno()).st_size - offset
+        try:
+            while length > 0:
+                count = os.copy_file_range(src.fileno(), dst.fileno(), length, offset)
+                if count == 0:
+                    break
+                offset += count
+                length -= count
+        except (AttributeError, OSError):
+            pass
+        src.seek(offset)
+        dst.seek(0, os.SEEK_END)
+        while length > 0:
+            data = src.read(min(length, 1 << 20))
+            if not data:
+                raise StripError(f'{path} is truncated')
+            dst.write(data)
+            length -= len(data)
+    os.replace(tmp, path)
+
+
+def strip(path, dryRun=False):
+    """
+    Strip the header of the image at path, returns (header, offset) or None
+    if it has no header
+    """
+    with open(path, 'rb+') as f:
+        header = f.read(12).replace(b'\0', b'')
+        kind = next((h for h in HEADERS if h in header), None)
+        if kind is None:
+            return None
+
+        f.seek(0)
+        offset = findFilesystem(f.read(SEARCH_WINDOW + MAGIC_OFFSET + 2))
+        if offset is None:
+            raise StripError(f'{kind.decode()} header on {path} but no ext4 filesystem after it')
+
+        if not dryRun and not collapse(f.fileno(), offset):
+            copyFrom(path, offset)
+    return kind.decode(), offset
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Strip MOTO/ASUS headers from ext4 images in place')
+    parser.add_argument('image', help='image to strip')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only print the header and its size')
+    args = parser.parse_args()
+
+    try:
+        result = strip(args.image, args.dry_run)
+    except (StripError, OSError) as err:
+        print(f'Error: {err}', file=sys.stderr)
+        sys.exit(1)
+    if result:
+        print(*result)
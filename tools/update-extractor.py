@@ -4,6 +4,8 @@ from struct import  unpack
 from argparse import ArgumentParser
 from typing import List
 
+from simg import SparseDecoder, isSparse
+
 MAGIC = b'\x55\xAA\x5A\xA5'
 
 CHUNK_SIZE = 0x400  # 1024 bytes
@@ -63,14 +65,19 @@ class UpdateExtractor:
                     self.package, self.package.tell()
                 ))
 
-    def extract(self, name: str = None):
+    def extract(self, name: str = None, unsparse: bool = False):
         self.output.mkdir(exist_ok=True)
         for partition in self.partitions:
             if name is not None and partition.type != name:
                 continue
             with open('%s/%s.img' % (self.output,
                     partition.type), 'wb') as f:
-                f.write(partition.data)
+                if unsparse and isSparse(partition.data):
+                    decoder = SparseDecoder(f)
+                    decoder.write(partition.data)
+                    decoder.close()
+                else:
+                    f.write(partition.data)
 
 def main():
     parser = ArgumentParser()
@@ -78,6 +85,7 @@ def main():
     parser.add_argument('-e', '--extract', help='Extract partitions to files.', action='store_true')
     parser.add_argument('-o', '--output', help='Output folder.', default='output', type=Path)
     parser.add_argument('-p', '--partition', help='Partition name to extract.', type=str, default=None)
+    parser.add_argument('-u', '--unsparse', help='Write sparse images as raw images.', action='store_true')
     args = parser.parse_args()
 
     extractor = UpdateExtractor(
@@ -88,7 +96,7 @@ def main():
                                            hex(partition.start), hex(partition.end)))
 
     if args.extract:
-        extractor.extract(args.partition)
+        extractor.extract(args.partition, args.unsparse)
 
 if __name__ == '__main__':
     main()